@@ -5,6 +5,10 @@ from app.models.user import User
 from app.models.chat_room import ChatRoom
 from app.models.chat_room_member import ChatRoomMember, ChatRoomMember_Pydantic
 from app.models.user import UserOut_Pydantic
+from app.core.cache import invalidate_membership
+from app.core.websocket import manager
+from app.services.presence import presence_tracker
+from app.api.v1.websocket import check_room_access
 
 router = APIRouter()
 
@@ -15,7 +19,7 @@ async def check_admin_permission(
     """
     检查用户是否有管理员权限
     """
-    room = await ChatRoom.get_or_none(id=room_id)
+    room = await ChatRoom.get_or_none(id=room_id, deleted_at__isnull=True)
     if not room:
         raise HTTPException(
             status_code=404,
@@ -45,7 +49,7 @@ async def list_room_members(
     """
     获取聊天室成员列表
     """
-    room = await ChatRoom.get_or_none(id=room_id)
+    room = await ChatRoom.get_or_none(id=room_id, deleted_at__isnull=True)
     if not room:
         raise HTTPException(
             status_code=404,
@@ -63,6 +67,28 @@ async def list_room_members(
     members = await ChatRoomMember.filter(room=room).prefetch_related('user')
     return [member.user for member in members]
 
+@router.get("/{room_id}/members/online")
+async def list_online_members(
+    room_id: int,
+    current_user: User = Depends(get_current_active_user)
+):
+    """
+    获取聊天室在线成员ID列表（来自WebSocket在线状态，不查询成员表）
+    """
+    # 与WebSocket订阅使用同一个（带缓存的）校验，排除被封禁的成员和已删除的聊天室
+    error = await check_room_access(room_id, current_user)
+    if error:
+        code, reason = error
+        raise HTTPException(
+            status_code=404 if code == 4004 else 400,
+            detail=reason
+        )
+    
+    return {
+        "room_id": room_id,
+        "user_ids": sorted(presence_tracker.get_online_user_ids(room_id))
+    }
+
 @router.post("/{room_id}/members/{user_id}/kick")
 async def kick_member(
     room_id: int,
@@ -87,7 +113,7 @@ async def kick_member(
         )
     
     # 不能踢出群主
-    if target_member.room.owner_id == user_id:
+    if (await target_member.room).owner_id == user_id:
         raise HTTPException(
             status_code=400,
             detail="不能踢出群主"
@@ -95,6 +121,8 @@ async def kick_member(
     
     # 踢出成员
     await target_member.delete()
+    invalidate_membership(user_id, room_id)
+    await manager.revoke_room_access(room_id, user_id, "您已被移出聊天室")
     
     return {"message": "成员已被踢出"}
 
@@ -108,7 +136,7 @@ async def set_admin(
     设置/取消管理员权限
     """
     # 检查是否是群主
-    room = await ChatRoom.get_or_none(id=room_id)
+    room = await ChatRoom.get_or_none(id=room_id, deleted_at__isnull=True)
     if not room or room.owner_id != current_user.id:
         raise HTTPException(
             status_code=403,
@@ -159,7 +187,7 @@ async def ban_member(
         )
     
     # 不能封禁群主
-    if target_member.room.owner_id == user_id:
+    if (await target_member.room).owner_id == user_id:
         raise HTTPException(
             status_code=400,
             detail="不能封禁群主"
@@ -168,6 +196,9 @@ async def ban_member(
     # 切换封禁状态
     target_member.is_banned = not target_member.is_banned
     await target_member.save()
+    invalidate_membership(user_id, room_id)
+    if target_member.is_banned:
+        await manager.revoke_room_access(room_id, user_id, "您已被封禁")
     
     return {
         "message": "封禁状态已更新",
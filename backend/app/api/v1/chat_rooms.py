@@ -1,10 +1,18 @@
-from typing import List, Optional
+from typing import Dict, List, Optional
 from fastapi import APIRouter, Depends, HTTPException, status
 from app.core.deps import get_current_active_user
 from app.models.user import User
 from app.models.chat_room import ChatRoom, ChatRoom_Pydantic, ChatRoomIn_Pydantic
 from app.models.chat_room_member import ChatRoomMember
 from app.core.security import get_password_hash
+from app.core.cache import invalidate_membership
+from app.core.websocket import manager
+from app.crud.read_state import latest_message_id
+from app.schemas.chat_room import RetentionPolicy
+from app.services.message_cache import message_cache
+from app.services.retention import retention_job
+from app.services.search import search_index
+from app.services.unread import unread_tracker
 
 router = APIRouter()
 
@@ -17,7 +25,7 @@ async def create_chat_room(
     创建新的聊天室
     """
     # 检查聊天室名称是否已存在
-    if await ChatRoom.exists(name=room_data.name):
+    if await ChatRoom.exists(name=room_data.name, deleted_at__isnull=True):
         raise HTTPException(
             status_code=400,
             detail="聊天室名称已存在"
@@ -37,7 +45,8 @@ async def create_chat_room(
     await ChatRoomMember.create(
         user=current_user,
         room=room,
-        is_admin=True
+        is_admin=True,
+        last_read_message_id=0  # 新聊天室还没有消息
     )
     
     return room
@@ -51,9 +60,18 @@ async def list_chat_rooms(
     """
     获取聊天室列表
     """
-    rooms = await ChatRoom.all().prefetch_related('owner').offset(skip).limit(limit)
+    rooms = await ChatRoom.filter(deleted_at__isnull=True).prefetch_related('owner').offset(skip).limit(limit)
     return rooms
 
+@router.get("/unread", response_model=Dict[int, int])
+async def get_unread_counts(
+    current_user: User = Depends(get_current_active_user)
+) -> Dict[int, int]:
+    """
+    获取当前用户所有聊天室的未读消息数: room_id -> 未读数
+    """
+    return await unread_tracker.get_counts(current_user.id)
+
 @router.get("/{room_id}", response_model=ChatRoom_Pydantic)
 async def get_chat_room(
     room_id: int,
@@ -62,7 +80,7 @@ async def get_chat_room(
     """
     获取聊天室详情
     """
-    room = await ChatRoom.get_or_none(id=room_id).prefetch_related('owner')
+    room = await ChatRoom.get_or_none(id=room_id, deleted_at__isnull=True).prefetch_related('owner')
     if not room:
         raise HTTPException(
             status_code=404,
@@ -79,7 +97,7 @@ async def join_chat_room(
     """
     加入聊天室
     """
-    room = await ChatRoom.get_or_none(id=room_id)
+    room = await ChatRoom.get_or_none(id=room_id, deleted_at__isnull=True)
     if not room:
         raise HTTPException(
             status_code=404,
@@ -115,12 +133,15 @@ async def join_chat_room(
             detail="聊天室已满"
         )
     
-    # 加入聊天室
+    # 加入聊天室，加入前的历史消息不计入未读
     await ChatRoomMember.create(
         user=current_user,
         room=room,
-        is_admin=False
+        is_admin=False,
+        last_read_message_id=await latest_message_id(room.id)
     )
+    invalidate_membership(current_user.id, room_id)
+    await unread_tracker.refresh(current_user.id)
     
     return {"message": "成功加入聊天室"}
 
@@ -132,7 +153,7 @@ async def leave_chat_room(
     """
     退出聊天室
     """
-    room = await ChatRoom.get_or_none(id=room_id)
+    room = await ChatRoom.get_or_none(id=room_id, deleted_at__isnull=True)
     if not room:
         raise HTTPException(
             status_code=404,
@@ -156,6 +177,8 @@ async def leave_chat_room(
     
     # 退出聊天室
     await member.delete()
+    invalidate_membership(current_user.id, room_id)
+    await unread_tracker.refresh(current_user.id)
     
     return {"message": "成功退出聊天室"}
 
@@ -167,7 +190,7 @@ async def delete_chat_room(
     """
     删除聊天室
     """
-    room = await ChatRoom.get_or_none(id=room_id)
+    room = await ChatRoom.get_or_none(id=room_id, deleted_at__isnull=True)
     if not room:
         raise HTTPException(
             status_code=404,
@@ -181,7 +204,41 @@ async def delete_chat_room(
             detail="只有群主可以删除聊天室"
         )
     
-    # 删除聊天室
-    await room.delete()
+    # 标记删除后立即返回，成员、消息等数据由后台任务分批清理；在线连接立即退出该聊天室
+    await retention_job.delete_room(room)
+    invalidate_membership(room_id=room_id)
+    await manager.revoke_room_access(room_id, detail="聊天室已被删除")
+    await message_cache.invalidate(room_id)
+    await search_index.remove_room(room_id)
+    await unread_tracker.on_room_deleted(room_id)
+    
+    return {"message": "聊天室已删除"}
+
+@router.put("/{room_id}/retention", response_model=RetentionPolicy)
+async def set_retention_policy(
+    room_id: int,
+    policy: RetentionPolicy,
+    current_user: User = Depends(get_current_active_user)
+) -> RetentionPolicy:
+    """
+    设置聊天室的消息保留策略（最长保留天数 / 最多保留条数，为空表示不限）
+    """
+    room = await ChatRoom.get_or_none(id=room_id, deleted_at__isnull=True)
+    if not room:
+        raise HTTPException(
+            status_code=404,
+            detail="聊天室不存在"
+        )
+    
+    # 检查是否是群主
+    if room.owner_id != current_user.id:
+        raise HTTPException(
+            status_code=403,
+            detail="只有群主可以设置消息保留策略"
+        )
+    
+    room.retention_days = policy.retention_days
+    room.retention_max_messages = policy.retention_max_messages
+    await room.save(update_fields=["retention_days", "retention_max_messages"])
     
-    return {"message": "聊天室已删除"} 
\ No newline at end of file
+    return policy
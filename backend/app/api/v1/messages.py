@@ -1,15 +1,31 @@
 from typing import List, Optional
-from fastapi import APIRouter, Depends, HTTPException, status, UploadFile, File
-from fastapi.responses import FileResponse
+from fastapi import APIRouter, Depends, HTTPException, status, UploadFile, File, Query, Request
+from fastapi.responses import FileResponse, Response, StreamingResponse
 from app.core.deps import get_current_active_user
+from app.api.v1.chat_room_members import check_admin_permission
 from app.models.user import User
 from app.models.chat_room import ChatRoom
 from app.models.chat_room_member import ChatRoomMember
 from app.models.message import Message, Message_Pydantic, MessageIn_Pydantic
 from app.core.config import settings
 from app.core.websocket import manager
+from app.core.pagination import decode_cursor, decode_search_cursor, encode_cursor, encode_search_cursor
+from app.core.ratelimit import check_rate_limit, retry_after_header
+from app.crud.message import get_messages_page, recall_message
+from app.crud.read_state import get_read_count, get_read_counts, mark_read
+from app.core.sequence import room_sequencer
+from app.schemas.message import MessageHistory, ReadMark
+from app.services.archive import get_history_page, message_archive
+from app.services.message_cache import CachedMessage, message_cache, serialize_message
+from app.services.profile_cache import get_profiles
+from app.services.delivery import deliver_message
+from app.services.export import export_room
+from app.services.ingest import ingest_messages
+from app.services.unread import unread_tracker
+from app.services.uploads import UploadTooLarge, blob_store
+from app.services.search import search_index
+import orjson
 import os
-import uuid
 from datetime import datetime
 
 router = APIRouter()
@@ -21,7 +37,7 @@ async def check_room_member(
     """
     检查用户是否是聊天室成员
     """
-    room = await ChatRoom.get_or_none(id=room_id)
+    room = await ChatRoom.get_or_none(id=room_id, deleted_at__isnull=True)
     if not room:
         raise HTTPException(
             status_code=404,
@@ -43,6 +59,18 @@ async def check_room_member(
     
     return member
 
+async def check_send_rate(room_id: int, current_user: User):
+    """
+    检查发送频率，超过限制时返回429
+    """
+    retry_after = await check_rate_limit(current_user.id, room_id)
+    if retry_after:
+        raise HTTPException(
+            status_code=429,
+            detail="发送过于频繁",
+            headers=retry_after_header(retry_after)
+        )
+
 @router.post("/{room_id}/messages", response_model=Message_Pydantic)
 async def send_message(
     room_id: int,
@@ -55,49 +83,297 @@ async def send_message(
     # 检查是否是成员
     await check_room_member(room_id, current_user)
     
+    # 检查发送频率
+    await check_send_rate(room_id, current_user)
+    
     # 创建消息
     message = await Message.create(
         room_id=room_id,
         sender=current_user,
         content=message_data.content,
-        message_type=message_data.message_type
+        message_type=message_data.message_type,
+        seq=await room_sequencer.allocate(room_id)
     )
     
-    # 通过WebSocket推送消息
-    await manager.broadcast_to_room(
-        room_id,
-        {
-            "type": "message",
-            "content": message_data.content,
-            "user_id": current_user.id,
-            "username": current_user.username,
-            "message_type": message_data.message_type,
-            "message_id": message.id,
-            "created_at": message.created_at.isoformat()
-        }
-    )
+    # 更新全文索引并通过WebSocket推送消息
+    await search_index.index([message])
+    await deliver_message(message, current_user)
     
     return message
 
-@router.get("/{room_id}/messages", response_model=List[Message_Pydantic])
+def parse_cursor(cursor: Optional[str]):
+    if cursor is None:
+        return None
+    try:
+        return decode_cursor(cursor)
+    except ValueError:
+        raise HTTPException(
+            status_code=400,
+            detail="无效的游标"
+        )
+
+async def history_response(items: List[CachedMessage], headers: Optional[dict] = None) -> Response:
+    """
+    拼接已序列化的消息和去重后的发送者资料，并在响应头中返回翻页游标
+    """
+    if headers is None:
+        headers = {}
+        if items:
+            headers["X-Prev-Cursor"] = encode_cursor(items[0][0], items[0][1])
+            headers["X-Next-Cursor"] = encode_cursor(items[-1][0], items[-1][1])
+    profiles = await get_profiles(sender_id for _, _, sender_id, _ in items)
+    return Response(
+        content=b'{"messages":[' + b",".join(data for _, _, _, data in items) + b'],"users":'
+        + orjson.dumps(profiles, option=orjson.OPT_NON_STR_KEYS) + b"}",
+        media_type="application/json",
+        headers=headers
+    )
+
+@router.get("/{room_id}/messages", response_model=MessageHistory)
 async def get_messages(
     room_id: int,
     current_user: User = Depends(get_current_active_user),
     skip: int = 0,
-    limit: int = 50
-) -> List[Message]:
+    limit: int = 50,
+    before: Optional[str] = None,
+    after: Optional[str] = None
+) -> Response:
     """
-    获取聊天室消息历史
+    获取聊天室消息历史（按时间倒序）
+    使用 before / after 游标翻页，翻页耗时与深度无关：
+    响应头 X-Next-Cursor 是更早一页的 before 游标，X-Prev-Cursor 是更新一页的 after 游标。
+    最新一页优先由最近消息缓存返回；每条消息只带 sender_id，发送者资料在 users 中返回一次。
+    skip 仅为兼容旧客户端保留，深度翻页时很慢
     """
     # 检查是否是成员
     await check_room_member(room_id, current_user)
     
+    if before is not None and after is not None:
+        raise HTTPException(
+            status_code=400,
+            detail="before 和 after 不能同时使用"
+        )
+    
+    # 最新一页
+    if before is None and after is None and not skip:
+        items = message_cache.get_page(room_id, limit)
+        if items is None:
+            token = message_cache.begin_load(room_id)
+            messages = await get_messages_page(room_id, max(limit, settings.MESSAGE_CACHE_PER_ROOM))
+            items = message_cache.fill(room_id, token, messages)[:limit]
+        return await history_response(await message_archive.extend(room_id, items, limit))
+    
     # 获取消息
-    messages = await Message.filter(
-        room_id=room_id
-    ).prefetch_related('sender').order_by('-created_at').offset(skip).limit(limit)
+    if skip and before is None and after is None:
+        messages = await Message.filter(
+            room_id=room_id
+        ).order_by('-created_at', '-id').offset(skip).limit(limit)
+        return await history_response([serialize_message(message) for message in messages])
+    
+    items = await get_history_page(room_id, limit, before=parse_cursor(before), after=parse_cursor(after))
+    return await history_response(items)
+
+@router.get("/{room_id}/messages/search", response_model=MessageHistory)
+async def search_messages(
+    room_id: int,
+    q: str,
+    current_user: User = Depends(get_current_active_user),
+    limit: int = 20,
+    cursor: Optional[str] = None
+) -> Response:
+    """
+    搜索聊天室消息，按相关度排序
+    还有更多结果时，响应头 X-Next-Cursor 是下一页的 cursor
+    """
+    # 检查是否是成员
+    await check_room_member(room_id, current_user)
+    
+    if not q.strip():
+        raise HTTPException(
+            status_code=400,
+            detail="搜索内容不能为空"
+        )
+    
+    after = None
+    if cursor is not None:
+        try:
+            after = decode_search_cursor(cursor)
+        except ValueError:
+            raise HTTPException(
+                status_code=400,
+                detail="无效的游标"
+            )
+    
+    hits = await search_index.search(room_id, q.strip(), limit, after)
+    messages = {message.id: message for message in await Message.filter(id__in=[message_id for message_id, _ in hits])}
+    items = [serialize_message(messages[message_id]) for message_id, _ in hits if message_id in messages]
+    
+    headers = {}
+    if len(hits) == limit:
+        message_id, score = hits[-1]
+        headers["X-Next-Cursor"] = encode_search_cursor(score, message_id)
+    
+    return await history_response(items, headers)
+
+@router.get("/{room_id}/messages/export")
+async def export_messages(
+    room_id: int,
+    current_user: User = Depends(get_current_active_user),
+    since: Optional[datetime] = None,
+    until: Optional[datetime] = None,
+    after: Optional[str] = None,
+    gzip: bool = False
+) -> StreamingResponse:
+    """
+    导出聊天室的全部消息（管理员），NDJSON 格式，按时间顺序
+    边查询边发送，内存占用与消息数无关。since / until 按发送时间过滤；
+    每行的 cursor 可作为 after 参数，从中断处继续导出；gzip=true 时返回gzip压缩的文件
+    """
+    # 检查是否是管理员
+    await check_admin_permission(room_id, current_user)
+    
+    stream = export_room(room_id, since=since, until=until, after=parse_cursor(after), compress=gzip)
+    file_name = f"room_{room_id}.ndjson" + (".gz" if gzip else "")
+    return StreamingResponse(
+        stream,
+        media_type="application/gzip" if gzip else "application/x-ndjson",
+        headers={"Content-Disposition": f'attachment; filename="{file_name}"'}
+    )
+
+@router.post("/{room_id}/messages/import")
+async def import_messages(
+    room_id: int,
+    request: Request,
+    current_user: User = Depends(get_current_active_user)
+):
+    """
+    批量导入历史消息（管理员，用于从其它聊天系统迁移）
+    请求体为 NDJSON，每行一条消息，边接收边分批写入；导入的消息不会推送给在线成员。
+    返回导入条数、被拒绝的行及原因、耗时和吞吐量
+    """
+    # 检查是否是管理员
+    await check_admin_permission(room_id, current_user)
+    
+    return await ingest_messages(room_id, request.stream())
+
+@router.post("/{room_id}/read")
+async def mark_room_read(
+    room_id: int,
+    read: ReadMark,
+    current_user: User = Depends(get_current_active_user)
+):
+    """
+    标记已读到某条消息（推进已读水位线，之前的消息都视为已读）
+    """
+    # 检查是否是成员
+    await check_room_member(room_id, current_user)
+    
+    if not await Message.exists(id=read.message_id, room_id=room_id):
+        raise HTTPException(
+            status_code=404,
+            detail="消息不存在"
+        )
+    
+    if await mark_read(room_id, current_user.id, read.message_id):
+        await unread_tracker.on_read(room_id, current_user.id)
+    return {"message": "已标记为已读"}
+
+@router.get("/{room_id}/messages/read-counts")
+async def get_message_read_counts(
+    room_id: int,
+    message_ids: List[int] = Query(...),
+    current_user: User = Depends(get_current_active_user)
+):
+    """
+    批量获取消息的已读人数: message_id -> 人数
+    """
+    # 检查是否是成员
+    await check_room_member(room_id, current_user)
+    
+    return await get_read_counts(room_id, message_ids)
+
+@router.get("/{room_id}/messages/{message_id}/read-count")
+async def get_message_read_count(
+    room_id: int,
+    message_id: int,
+    current_user: User = Depends(get_current_active_user)
+):
+    """
+    获取消息的已读人数
+    """
+    # 检查是否是成员
+    await check_room_member(room_id, current_user)
+    
+    return {
+        "message_id": message_id,
+        "read_count": await get_read_count(room_id, message_id)
+    }
+
+@router.post("/{room_id}/messages/{message_id}/recall")
+async def recall_room_message(
+    room_id: int,
+    message_id: int,
+    current_user: User = Depends(get_current_active_user)
+):
+    """
+    撤回消息（发送者，2分钟内）
+    """
+    # 检查是否是成员
+    await check_room_member(room_id, current_user)
+    
+    if not await recall_message(message_id, current_user.id, room_id):
+        raise HTTPException(
+            status_code=400,
+            detail="无法撤回该消息"
+        )
+    
+    await message_cache.invalidate(room_id)
+    await search_index.remove(message_id)
+    await manager.broadcast_to_room(room_id, {
+        "type": "recall",
+        "room_id": room_id,
+        "message_id": message_id
+    })
     
-    return messages
+    return {"message": "消息已撤回"}
+
+@router.delete("/{room_id}/messages/{message_id}")
+async def delete_message(
+    room_id: int,
+    message_id: int,
+    current_user: User = Depends(get_current_active_user)
+):
+    """
+    删除消息（发送者或聊天室管理员）
+    """
+    # 检查是否是成员
+    member = await check_room_member(room_id, current_user)
+    
+    message = await Message.get_or_none(id=message_id, room_id=room_id)
+    if not message:
+        raise HTTPException(
+            status_code=404,
+            detail="消息不存在"
+        )
+    
+    if message.sender_id != current_user.id and not member.is_admin:
+        room = await ChatRoom.get(id=room_id)
+        if room.owner_id != current_user.id:
+            raise HTTPException(
+                status_code=403,
+                detail="您没有权限删除该消息"
+            )
+    
+    await message.delete()
+    await message_cache.invalidate(room_id)
+    await search_index.remove(message_id)
+    await manager.broadcast_to_room(room_id, {
+        "type": "message_deleted",
+        "room_id": room_id,
+        "message_id": message_id
+    })
+    
+    return {"message": "消息已删除"}
 
 @router.post("/{room_id}/messages/upload")
 async def upload_image(
@@ -111,6 +387,9 @@ async def upload_image(
     # 检查是否是成员
     await check_room_member(room_id, current_user)
     
+    # 检查发送频率
+    await check_send_rate(room_id, current_user)
+    
     # 检查文件类型
     if not file.content_type.startswith('image/'):
         raise HTTPException(
@@ -118,49 +397,29 @@ async def upload_image(
             detail="只能上传图片文件"
         )
     
-    # 生成文件名
-    file_extension = os.path.splitext(file.filename)[1]
-    file_name = f"{uuid.uuid4()}{file_extension}"
-    
-    # 确保上传目录存在
-    upload_dir = os.path.join(settings.UPLOAD_DIR, str(room_id))
-    os.makedirs(upload_dir, exist_ok=True)
-    
-    # 保存文件
-    file_path = os.path.join(upload_dir, file_name)
-    with open(file_path, "wb") as buffer:
-        content = await file.read()
-        if len(content) > settings.MAX_UPLOAD_SIZE:
-            raise HTTPException(
-                status_code=400,
-                detail="文件大小超过限制"
-            )
-        buffer.write(content)
+    # 按内容哈希保存，相同的图片只保存一份；超过大小限制时中止
+    try:
+        blob = await blob_store.store(file, settings.MAX_UPLOAD_SIZE)
+    except UploadTooLarge:
+        raise HTTPException(
+            status_code=413,
+            detail="文件大小超过限制"
+        )
     
     # 创建图片消息
-    image_url = f"/static/uploads/{room_id}/{file_name}"
+    image_url = blob_store.url(blob)
     message = await Message.create(
         room_id=room_id,
         sender=current_user,
         content="[图片消息]",
         message_type="image",
-        image_url=image_url
+        image_url=image_url,
+        image_hash=blob.hash,
+        seq=await room_sequencer.allocate(room_id)
     )
     
     # 通过WebSocket推送图片消息
-    await manager.broadcast_to_room(
-        room_id,
-        {
-            "type": "message",
-            "content": "[图片消息]",
-            "user_id": current_user.id,
-            "username": current_user.username,
-            "message_type": "image",
-            "image_url": image_url,
-            "message_id": message.id,
-            "created_at": message.created_at.isoformat()
-        }
-    )
+    await deliver_message(message, current_user)
     
     return {
         "message": "图片上传成功",
@@ -1,74 +1,274 @@
+from typing import Optional, Tuple
+import asyncio
+import logging
 from fastapi import APIRouter, WebSocket, WebSocketDisconnect, Depends
-from app.core.deps import get_current_active_user
-from app.core.websocket import manager
+from app.core.cache import membership_cache
+from app.core.deps import get_current_active_user, get_websocket_user
+from app.core.ratelimit import check_rate_limit, get_rate_limit_stats
+from app.core.websocket import Connection, manager
+from app.crud.read_state import mark_read
 from app.models.user import User
 from app.models.chat_room import ChatRoom
 from app.models.chat_room_member import ChatRoomMember
-import json
+from app.services.message_cache import message_cache
+from app.services.message_writer import message_writer
+from app.services.presence import presence_tracker
+from app.services.profile_cache import profile_cache
+from app.services.delivery import deliver_message
+from app.services.replay import replay_room
+from app.services.unread import unread_tracker
+from app.services.typing import typing_tracker
 
 router = APIRouter()
 
-@router.websocket("/ws/{room_id}")
-async def websocket_endpoint(
-    websocket: WebSocket,
-    room_id: int,
-    current_user: User = Depends(get_current_active_user)
+logger = logging.getLogger(__name__)
+
+async def _load_room_access(room_id: int, user_id: int) -> Optional[Tuple[int, str]]:
+    # 已删除的聊天室在后台清理完成前仍有成员记录
+    member = await ChatRoomMember.get_or_none(user_id=user_id, room_id=room_id, room__deleted_at__isnull=True)
+    if not member:
+        if not await ChatRoom.exists(id=room_id, deleted_at__isnull=True):
+            return 4004, "聊天室不存在"
+        return 4003, "您不是该聊天室的成员"
+
+    if member.is_banned:
+        return 4003, "您已被封禁"
+
+    return None
+
+async def check_room_access(room_id: int, current_user: User) -> Optional[Tuple[int, str]]:
+    """
+    检查用户能否订阅聊天室
+    不能订阅时返回 (关闭码, 原因)，可以订阅时返回None
+    校验结果短时间缓存，成员关系变化时会主动清除
+    """
+    return await membership_cache.get_or_load(
+        (current_user.id, room_id),
+        lambda: _load_room_access(room_id, current_user.id)
+    )
+
+class InvalidFrame(ValueError):
+    """
+    客户端发来的帧缺少字段或字段类型不对，回复错误帧后继续处理后续的帧
+    """
+
+def _int_field(message_data: dict, key: str) -> int:
+    value = message_data.get(key)
+    if isinstance(value, str) and value.isdigit():
+        return int(value)
+    if not isinstance(value, int) or isinstance(value, bool):
+        raise InvalidFrame(f"{key} 无效")
+    return value
+
+async def handle_frame(
+    connection: Connection,
+    current_user: User,
+    message_data: dict,
+    default_room_id: Optional[int] = None
 ):
     """
-    WebSocket连接处理
+    处理客户端发来的一帧消息
+    多路复用连接上的帧通过 room_id 指定聊天室
     """
-    # 检查是否是聊天室成员
-    room = await ChatRoom.get_or_none(id=room_id)
-    if not room:
-        await websocket.close(code=4004, reason="聊天室不存在")
+    frame_type = message_data.get("type")
+    room_id = _int_field(message_data, "room_id") if "room_id" in message_data else default_room_id
+
+    if frame_type == "pong":
+        # 心跳响应，收到帧时已经刷新了存活时间
         return
-    
-    member = await ChatRoomMember.get_or_none(user=current_user, room=room)
-    if not member:
-        await websocket.close(code=4003, reason="您不是该聊天室的成员")
+
+    if frame_type == "subscribe":
+        # 订阅聊天室，每次订阅只校验一次成员身份
+        if room_id in connection.rooms:
+            return
+        error = await check_room_access(room_id, current_user)
+        if error:
+            manager.send_to_connection(connection, {"type": "error", "room_id": room_id, "detail": error[1]})
+            return
+        manager.subscribe(connection, room_id)
+        manager.send_to_connection(connection, {"type": "subscribed", "room_id": room_id})
+        manager.send_to_connection(connection, presence_tracker.get_state(room_id))
+        # 重连时带上最后收到的序号，补发断线期间的事件
+        if message_data.get("last_seq") is not None:
+            await replay_room(connection, room_id, _int_field(message_data, "last_seq"))
         return
-    
-    if member.is_banned:
-        await websocket.close(code=4003, reason="您已被封禁")
+
+    if frame_type == "unsubscribe":
+        manager.unsubscribe(connection, room_id)
+        manager.send_to_connection(connection, {"type": "unsubscribed", "room_id": room_id})
         return
-    
-    # 建立连接
-    await manager.connect(websocket, current_user, room_id)
-    
+
+    if room_id not in connection.rooms:
+        manager.send_to_connection(connection, {"type": "error", "room_id": room_id, "detail": "未订阅该聊天室"})
+        return
+
+    if frame_type == "presence":
+        # 查询聊天室在线成员
+        manager.send_to_connection(connection, presence_tracker.get_state(room_id))
+        return
+
+    if frame_type == "read":
+        # 推进已读水位线
+        if await mark_read(room_id, current_user.id, _int_field(message_data, "message_id")):
+            await unread_tracker.on_read(room_id, current_user.id)
+        return
+
+    if frame_type == "message":
+        content = message_data.get("content")
+        if not isinstance(content, str) or not content:
+            raise InvalidFrame("content 不能为空")
+        # 输入状态由 typing_tracker 合并，不占用消息的限流令牌
+        retry_after = await check_rate_limit(current_user.id, room_id)
+        if retry_after:
+            manager.send_to_connection(connection, {
+                "type": "error",
+                "code": "rate_limited",
+                "room_id": room_id,
+                "detail": "发送过于频繁",
+                "retry_after": retry_after
+            })
+            return
+        # 发送消息后不再处于输入状态
+        await typing_tracker.publish(room_id, current_user.id, current_user.username, is_typing=False)
+        # 消息进入批量写入队列，提交后再确认并广播
+        future = await message_writer.submit(
+            room_id,
+            current_user.id,
+            content,
+            message_data.get("message_type", "text")
+        )
+        asyncio.create_task(
+            deliver_after_commit(connection, current_user, future, message_data.get("client_id"))
+        )
+    elif frame_type == "typing":
+        # 输入状态由 typing_tracker 合并后按间隔推送
+        await typing_tracker.publish(
+            room_id,
+            current_user.id,
+            current_user.username,
+            is_typing=message_data.get("is_typing", True)
+        )
+
+async def deliver_after_commit(
+    connection: Connection,
+    current_user: User,
+    future: asyncio.Future,
+    client_id: Optional[str] = None
+):
+    """
+    等待消息写入数据库，然后向发送方确认并广播到聊天室
+    """
+    try:
+        message = await future
+    except Exception:
+        logger.exception("消息持久化失败: user_id=%s", current_user.id)
+        manager.send_to_connection(connection, {
+            "type": "error",
+            "code": "persist_failed",
+            "client_id": client_id,
+            "detail": "消息发送失败，请重试"
+        })
+        return
+
+    manager.send_to_connection(connection, {
+        "type": "ack",
+        "room_id": message.room_id,
+        "client_id": client_id,
+        "message_id": message.id,
+        "seq": message.seq,
+        "created_at": message.created_at.isoformat()
+    })
+    await deliver_message(message, current_user)
+
+async def serve_connection(
+    connection: Connection,
+    current_user: User,
+    default_room_id: Optional[int] = None
+):
+    """
+    接收并处理消息，直到连接断开
+    """
+    websocket = connection.websocket
     try:
         while True:
-            # 接收消息
-            data = await websocket.receive_text()
-            message_data = json.loads(data)
-            
-            # 处理消息
-            if message_data["type"] == "message":
-                # 广播消息到聊天室
-                await manager.broadcast_to_room(
-                    room_id,
-                    {
-                        "type": "message",
-                        "content": message_data["content"],
-                        "user_id": current_user.id,
-                        "username": current_user.username,
-                        "message_type": message_data.get("message_type", "text")
-                    }
-                )
-            elif message_data["type"] == "typing":
-                # 广播正在输入状态
-                await manager.broadcast_to_room(
-                    room_id,
-                    {
-                        "type": "typing",
-                        "user_id": current_user.id,
-                        "username": current_user.username
-                    }
-                )
-    
+            # 接收消息，文本帧和二进制帧都按连接协商的格式解码
+            message = await websocket.receive()
+            if message["type"] == "websocket.disconnect":
+                raise WebSocketDisconnect(message.get("code", 1000))
+            manager.touch(connection)
+            data = message["bytes"] if message.get("bytes") is not None else message["text"]
+            try:
+                message_data = connection.codec.decode(data)
+            except ValueError:
+                # JSON / MessagePack 格式错误
+                message_data = None
+            # 格式不对的帧只回复错误，不断开连接
+            try:
+                if not isinstance(message_data, dict):
+                    raise InvalidFrame("无法解析的帧")
+                await handle_frame(connection, current_user, message_data, default_room_id)
+            except InvalidFrame as e:
+                manager.send_to_connection(connection, {"type": "error", "code": "invalid_frame", "detail": str(e)})
+
     except WebSocketDisconnect:
         # 处理连接断开
-        await manager.disconnect(current_user, room_id)
+        manager.disconnect(connection)
     except Exception as e:
         # 处理其他错误
-        await manager.disconnect(current_user, room_id)
-        raise e 
\ No newline at end of file
+        manager.disconnect(connection)
+        raise e
+
+@router.get("/ws/stats")
+async def websocket_stats(
+    current_user: User = Depends(get_current_active_user)
+):
+    """
+    WebSocket连接统计（连接数、丢弃帧数、被断开的慢消费者和心跳超时连接数、限流计数、消息写入队列、
+    最近消息缓存的命中率和内存占用、用户资料缓存）
+    """
+    return {
+        **manager.get_stats(),
+        "rate_limit": get_rate_limit_stats(),
+        "message_writer": message_writer.get_stats(),
+        "message_cache": message_cache.get_stats(),
+        "profile_cache": profile_cache.get_stats()
+    }
+
+@router.websocket("/ws")
+async def multiplexed_websocket_endpoint(
+    websocket: WebSocket,
+    current_user: User = Depends(get_websocket_user)
+):
+    """
+    多路复用WebSocket连接
+    每个客户端只建立一个连接，通过 subscribe / unsubscribe 帧订阅或取消订阅聊天室，
+    所有聊天室的消息都在这一个连接上收发
+    token 通过 ?token= 查询参数或 bearer.<token> 子协议传递
+    """
+    connection = await manager.connect(websocket, current_user)
+    await serve_connection(connection, current_user)
+
+@router.websocket("/ws/{room_id}")
+async def websocket_endpoint(
+    websocket: WebSocket,
+    room_id: int,
+    current_user: User = Depends(get_websocket_user)
+):
+    """
+    WebSocket连接处理（单聊天室）
+    """
+    # 检查是否是聊天室成员
+    error = await check_room_access(room_id, current_user)
+    if error:
+        code, reason = error
+        await websocket.close(code=code, reason=reason)
+        return
+
+    # 建立连接
+    connection = await manager.connect(websocket, current_user, room_id)
+    manager.send_to_connection(connection, presence_tracker.get_state(room_id))
+    # 重连时通过 ?last_seq= 补发断线期间的事件
+    last_seq = websocket.query_params.get("last_seq")
+    if last_seq is not None and last_seq.isdigit():
+        await replay_room(connection, room_id, int(last_seq))
+    await serve_connection(connection, current_user, room_id)
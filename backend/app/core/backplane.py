@@ -0,0 +1,132 @@
+import asyncio
+import logging
+from typing import Callable, Optional, Set
+import redis.asyncio as redis
+from app.core.config import settings
+
+logger = logging.getLogger(__name__)
+
+# 收到消息时的回调: (channel, frame) -> None
+MessageHandler = Callable[[str, str], None]
+
+
+class Backplane:
+    """
+    跨进程消息总线
+    每个worker只订阅本地有连接的频道，广播先发布到总线，再由各worker投递给本地连接
+    """
+
+    def __init__(self, handler: MessageHandler):
+        self.handler = handler
+
+    async def start(self):
+        pass
+
+    async def stop(self):
+        pass
+
+    async def publish(self, channel: str, frame: str):
+        raise NotImplementedError
+
+    def subscribe(self, channel: str):
+        raise NotImplementedError
+
+    def unsubscribe(self, channel: str):
+        raise NotImplementedError
+
+
+class InMemoryBackplane(Backplane):
+    """
+    进程内消息总线，用于测试和单进程部署
+    """
+
+    def __init__(self, handler: MessageHandler):
+        super().__init__(handler)
+        self.channels: Set[str] = set()
+
+    async def publish(self, channel: str, frame: str):
+        if channel in self.channels:
+            self.handler(channel, frame)
+
+    def subscribe(self, channel: str):
+        self.channels.add(channel)
+
+    def unsubscribe(self, channel: str):
+        self.channels.discard(channel)
+
+
+class RedisBackplane(Backplane):
+    """
+    基于Redis pub/sub的消息总线，用于多worker部署
+    订阅/取消订阅按调用顺序由后台任务依次执行
+    """
+
+    PREFIX = "chatroom:"
+
+    def __init__(self, handler: MessageHandler, url: str):
+        super().__init__(handler)
+        self.redis = redis.from_url(url, decode_responses=True)
+        self.pubsub = self.redis.pubsub()
+        self.commands: asyncio.Queue = asyncio.Queue()
+        self.tasks: list = []
+
+    async def start(self):
+        self.tasks = [
+            asyncio.create_task(self._apply_commands()),
+            asyncio.create_task(self._listen()),
+        ]
+
+    async def stop(self):
+        for task in self.tasks:
+            task.cancel()
+        await asyncio.gather(*self.tasks, return_exceptions=True)
+        self.tasks = []
+        await self.pubsub.close()
+        await self.redis.close()
+
+    async def publish(self, channel: str, frame: str):
+        await self.redis.publish(self.PREFIX + channel, frame)
+
+    def subscribe(self, channel: str):
+        self.commands.put_nowait(("subscribe", self.PREFIX + channel))
+
+    def unsubscribe(self, channel: str):
+        self.commands.put_nowait(("unsubscribe", self.PREFIX + channel))
+
+    async def _apply_commands(self):
+        while True:
+            action, channel = await self.commands.get()
+            try:
+                await getattr(self.pubsub, action)(channel)
+            except Exception:
+                logger.exception("Redis %s 失败: %s", action, channel)
+
+    async def _listen(self):
+        while True:
+            if not self.pubsub.subscribed:
+                await asyncio.sleep(0.1)
+                continue
+            try:
+                message = await self.pubsub.get_message(ignore_subscribe_messages=True, timeout=1.0)
+            except Exception:
+                logger.exception("读取Redis消息失败")
+                await asyncio.sleep(1)
+                continue
+            if message is None:
+                continue
+            try:
+                self.handler(message["channel"][len(self.PREFIX):], message["data"])
+            except Exception:
+                logger.exception("处理总线消息失败: %s", message["channel"])
+
+
+def create_backplane(handler: MessageHandler, backend: Optional[str] = None) -> Backplane:
+    """
+    根据配置创建消息总线: memory（默认）或 redis
+    """
+    backend = backend or settings.BACKPLANE
+    if backend == "redis":
+        return RedisBackplane(handler, settings.REDIS_URL)
+    if backend == "memory":
+        return InMemoryBackplane(handler)
+    raise ValueError(f"未知的消息总线类型: {backend}")
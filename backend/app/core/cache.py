@@ -0,0 +1,104 @@
+import asyncio
+import time
+from collections import OrderedDict
+from typing import Any, Awaitable, Callable, Dict, Hashable, Optional, Tuple
+from app.core.config import settings
+
+_MISSING = object()
+
+
+class TTLCache:
+    """
+    带过期时间的LRU缓存
+    get_or_load 对同一个键的并发加载只执行一次（其余调用等待同一个结果），
+    适合重连风暴时大量相同的校验请求
+    """
+
+    def __init__(self, maxsize: int, ttl: float):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.data: "OrderedDict[Hashable, Tuple[float, Any]]" = OrderedDict()  # key -> (过期时间, 值)
+        self.loading: Dict[Hashable, asyncio.Future] = {}
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key: Hashable, default: Any = None) -> Any:
+        item = self.data.get(key)
+        if item is None:
+            self.misses += 1
+            return default
+        expire_at, value = item
+        if expire_at < time.monotonic():
+            del self.data[key]
+            self.misses += 1
+            return default
+        self.data.move_to_end(key)
+        self.hits += 1
+        return value
+
+    def set(self, key: Hashable, value: Any, ttl: Optional[float] = None):
+        self.data[key] = (time.monotonic() + (self.ttl if ttl is None else ttl), value)
+        self.data.move_to_end(key)
+        while len(self.data) > self.maxsize:
+            self.data.popitem(last=False)
+
+    def invalidate(self, key: Hashable):
+        self.data.pop(key, None)
+
+    def invalidate_where(self, predicate: Callable[[Hashable], bool]):
+        for key in [key for key in self.data if predicate(key)]:
+            del self.data[key]
+
+    def clear(self):
+        self.data.clear()
+
+    async def get_or_load(self, key: Hashable, loader: Callable[[], Awaitable[Any]]) -> Any:
+        value = self.get(key, _MISSING)
+        if value is not _MISSING:
+            return value
+
+        future = self.loading.get(key)
+        if future is not None:
+            return await asyncio.shield(future)
+
+        future = asyncio.get_running_loop().create_future()
+        self.loading[key] = future
+        try:
+            value = await loader()
+            self.set(key, value)
+            future.set_result(value)
+            return value
+        except Exception as e:
+            future.set_exception(e)
+            # 避免没有其它等待者时出现 "exception was never retrieved"
+            future.exception()
+            raise
+        finally:
+            del self.loading[key]
+            if not future.done():
+                future.cancel()
+
+    def get_stats(self) -> dict:
+        return {
+            "size": len(self.data),
+            "hits": self.hits,
+            "misses": self.misses,
+        }
+
+
+# WebSocket握手认证缓存: token -> (user, token过期时间)
+token_cache = TTLCache(settings.WS_AUTH_CACHE_SIZE, settings.WS_AUTH_CACHE_TTL)
+# 聊天室成员校验缓存: (user_id, room_id) -> None 或 (关闭码, 原因)
+membership_cache = TTLCache(settings.WS_AUTH_CACHE_SIZE, settings.WS_AUTH_CACHE_TTL)
+
+
+def invalidate_membership(user_id: Optional[int] = None, room_id: Optional[int] = None):
+    """
+    成员关系变化（加入、退出、踢出、封禁、删除聊天室）时清除缓存
+    """
+    if user_id is not None and room_id is not None:
+        membership_cache.invalidate((user_id, room_id))
+    elif room_id is not None:
+        membership_cache.invalidate_where(lambda key: key[1] == room_id)
+    elif user_id is not None:
+        membership_cache.invalidate_where(lambda key: key[0] == user_id)
@@ -0,0 +1,88 @@
+from typing import Dict, Optional, Tuple, Union
+from fastapi import WebSocket
+import msgpack
+import orjson
+
+
+def encode_json(message: Union[str, dict]) -> str:
+    """
+    将消息编码为JSON文本帧
+    广播时只编码一次，所有接收者共享同一个帧对象
+    """
+    if isinstance(message, str):
+        return message
+    return orjson.dumps(message).decode()
+
+
+class Codec:
+    """
+    WebSocket帧编解码器
+    """
+
+    name: str = ""
+    subprotocol: str = ""
+
+    def encode(self, message: dict) -> Union[str, bytes]:
+        raise NotImplementedError
+
+    def decode(self, data: Union[str, bytes]) -> dict:
+        raise NotImplementedError
+
+
+class JsonCodec(Codec):
+    """
+    JSON文本帧（默认）
+    """
+
+    name = "json"
+    subprotocol = "chat.json"
+
+    def encode(self, message: dict) -> str:
+        return encode_json(message)
+
+    def decode(self, data: Union[str, bytes]) -> dict:
+        return orjson.loads(data)
+
+
+class MsgpackCodec(Codec):
+    """
+    MessagePack二进制帧，体积更小、解析更快，适合移动端
+    """
+
+    name = "msgpack"
+    subprotocol = "chat.msgpack"
+
+    def encode(self, message: dict) -> bytes:
+        return msgpack.packb(message, use_bin_type=True)
+
+    def decode(self, data: Union[str, bytes]) -> dict:
+        if isinstance(data, str):
+            data = data.encode()
+        return msgpack.unpackb(data, raw=False)
+
+
+JSON_CODEC = JsonCodec()
+CODECS: Dict[str, Codec] = {
+    codec.name: codec for codec in (JSON_CODEC, MsgpackCodec())
+}
+SUBPROTOCOLS: Dict[str, Codec] = {
+    codec.subprotocol: codec for codec in CODECS.values()
+}
+
+
+def negotiate_codec(websocket: WebSocket) -> Tuple[Codec, Optional[str]]:
+    """
+    握手时协商帧格式
+    优先使用客户端在 Sec-WebSocket-Protocol 中提供的第一个可识别的子协议，
+    其次使用 ?codec= 查询参数，都没有时使用JSON
+    返回 (编解码器, 需要在accept时回应的子协议)
+    """
+    header = websocket.headers.get("sec-websocket-protocol", "")
+    offered = [item.strip() for item in header.split(",") if item.strip()]
+    for subprotocol in offered:
+        if subprotocol in SUBPROTOCOLS:
+            return SUBPROTOCOLS[subprotocol], subprotocol
+
+    codec = CODECS.get(websocket.query_params.get("codec", ""), JSON_CODEC)
+    # 客户端提供了子协议（例如只有 bearer.<token>）时必须回应其中一个，否则浏览器会中止握手
+    return codec, offered[0] if offered else None
@@ -16,6 +16,81 @@ class Settings(BaseSettings):
     # 文件上传配置
     UPLOAD_DIR: str = "static/uploads"
     MAX_UPLOAD_SIZE: int = 5 * 1024 * 1024  # 5MB
+    IMAGE_BLOB_GC_GRACE: float = 24 * 3600.0  # 不再被引用的图片至少保留的时间（秒），避免回收刚上传、尚未写入消息的图片
+    
+    # WebSocket发送队列配置
+    WS_SEND_QUEUE_SIZE: int = 256  # 每个连接最多缓存的待发送帧数
+    WS_SEND_QUEUE_HIGH_WATER: int = 192  # 高水位线
+    WS_SLOW_CONSUMER_TIMEOUT: float = 5.0  # 持续超过高水位线多少秒后断开连接
+    
+    # WebSocket协议配置
+    WS_PER_MESSAGE_DEFLATE: bool = True  # 是否允许客户端协商 permessage-deflate 压缩
+    WS_HEARTBEAT_INTERVAL: float = 20.0  # 服务端发送ping的间隔（秒）
+    WS_HEARTBEAT_MAX_MISSED: int = 3  # 连续多少次未响应后断开连接
+    WS_AUTH_CACHE_TTL: float = 30.0  # 握手认证和成员校验结果的缓存时间（秒）
+    WS_AUTH_CACHE_SIZE: int = 100_000  # 缓存条目上限
+    PRESENCE_REFRESH_INTERVAL: float = 30.0  # 各worker同步在线状态快照的间隔（秒）
+    
+    # 热门聊天室批量发送配置
+    WS_BATCH_WINDOW: float = 0.03  # 合并发送的窗口（秒），0 表示关闭
+    WS_BATCH_RATE_THRESHOLD: int = 50  # 聊天室每秒消息数超过该值时启用批量发送
+    
+    # 跨进程消息总线配置: memory（单进程/测试）或 redis（多worker）
+    BACKPLANE: str = "memory"
+    REDIS_URL: str = "redis://localhost:6379/0"
+    
+    # 正在输入状态配置
+    TYPING_TTL: float = 5.0  # 输入状态的有效期（秒）
+    TYPING_FLUSH_INTERVAL: float = 0.5  # 每个聊天室最多每隔多少秒推送一次输入状态
+    
+    # 发送频率限制（令牌桶）: memory（单进程）或 redis（多worker共享）
+    RATE_LIMIT_BACKEND: str = "memory"
+    RATE_LIMIT_USER_RATE: float = 5.0  # 每个用户每秒可发送的消息数
+    RATE_LIMIT_USER_BURST: int = 10  # 每个用户允许的突发消息数
+    RATE_LIMIT_ROOM_RATE: float = 50.0  # 每个聊天室每秒可接收的消息数
+    RATE_LIMIT_ROOM_BURST: int = 100  # 每个聊天室允许的突发消息数
+    
+    # 断线重连补发配置
+    REPLAY_BUFFER_SIZE: int = 500  # 每个聊天室在内存中保留的最近事件数
+    REPLAY_MAX_EVENTS: int = 1000  # 单次补发的最大事件数，超过时客户端应改用历史消息接口
+    
+    # 最近消息缓存配置
+    MESSAGE_CACHE_PER_ROOM: int = 100  # 每个聊天室缓存的最新消息数，决定可由缓存返回的最大页大小
+    MESSAGE_CACHE_MAX_BYTES: int = 64 * 1024 * 1024  # 所有聊天室缓存的总字节数上限
+    
+    # 用户资料缓存配置（消息历史和推送中的发送者资料）
+    PROFILE_CACHE_SIZE: int = 100_000  # 缓存的用户数上限
+    PROFILE_CACHE_TTL: float = 300.0  # 缓存时间（秒），资料修改时会主动清除
+    
+    # 未读数配置
+    UNREAD_PUSH_INTERVAL: float = 1.0  # 未读数变化合并推送的间隔（秒）
+    
+    # 全文搜索配置: postgres（tsvector + GIN）或 sqlite（FTS5，测试/单节点）
+    SEARCH_BACKEND: str = "postgres"
+    SEARCH_PG_CONFIG: str = "simple"  # PostgreSQL分词配置，中文可安装 zhparser 后改用对应配置
+    SEARCH_SQLITE_PATH: str = "search.db"
+    
+    # 消息分区与归档配置（需先执行 migrations/20261018_message_partitions.sql）
+    MESSAGE_PARTITION_PREMAKE: int = 3  # 提前创建的月分区数
+    MESSAGE_ARCHIVE_AFTER_MONTHS: int = 12  # 早于该月数的分区导出到归档目录后从数据库分离，0 表示不归档
+    MESSAGE_ARCHIVE_DIR: str = "archive"  # 归档文件目录（gzip压缩的 NDJSON）
+    MESSAGE_ARCHIVE_INTERVAL: float = 3600.0  # 检查分区的间隔（秒）
+    
+    # WebSocket消息批量写入配置
+    MESSAGE_WRITER_BATCH_SIZE: int = 500  # 每批最多写入的消息数
+    MESSAGE_WRITER_FLUSH_INTERVAL: float = 0.02  # 不满一批时最多等待的时间（秒）
+    MESSAGE_WRITER_QUEUE_SIZE: int = 10_000  # 写入队列长度上限
+    
+    # 数据保留与清理配置（后台任务分批删除，每批之间暂停，避免长时间持有锁）
+    RETENTION_INTERVAL: float = 3600.0  # 执行保留策略的间隔（秒）
+    RETENTION_BATCH_SIZE: int = 1000  # 每批删除的行数
+    RETENTION_BATCH_PAUSE: float = 0.05  # 每批之间的暂停（秒）
+    NOTIFICATION_RETENTION_DAYS: int = 90  # 通知保留天数，0 表示不清理
+    ANNOUNCEMENT_HISTORY_RETENTION_DAYS: int = 365  # 公告历史保留天数，0 表示不清理
+    
+    # 消息批量导入配置（从其它聊天系统迁移）
+    INGEST_BATCH_SIZE: int = 5000  # 每批校验并写入的消息数
+    INGEST_MAX_ERRORS: int = 100  # 导入结果中最多列出的错误行数
     
     class Config:
         env_file = ".env"
@@ -1,8 +1,10 @@
-from typing import Optional
-from fastapi import Depends, HTTPException, status
+from typing import Optional, Tuple
+from fastapi import Depends, HTTPException, WebSocket, WebSocketException, status
 from fastapi.security import OAuth2PasswordBearer
 from app.models.user import User
+from app.core.cache import token_cache
 from app.core.security import verify_token
+import time
 
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="api/v1/auth/login")
 
@@ -32,4 +34,51 @@ async def get_current_active_user(
 ) -> User:
     if not current_user.is_active:
         raise HTTPException(status_code=400, detail="用户已被禁用")
-    return current_user 
\ No newline at end of file
+    return current_user
+
+# WebSocket子协议中携带token的前缀，例如 Sec-WebSocket-Protocol: chat.json, bearer.<token>
+WEBSOCKET_TOKEN_PROTOCOL_PREFIX = "bearer."
+
+def get_websocket_token(websocket: WebSocket) -> Optional[str]:
+    """
+    从握手请求中取出token
+    浏览器无法在WebSocket握手时设置Authorization头，因此依次尝试：
+    ?token= 查询参数、bearer.<token> 子协议、Authorization头
+    """
+    token = websocket.query_params.get("token")
+    if token:
+        return token
+
+    offered = websocket.headers.get("sec-websocket-protocol", "")
+    for subprotocol in (item.strip() for item in offered.split(",")):
+        if subprotocol.startswith(WEBSOCKET_TOKEN_PROTOCOL_PREFIX):
+            return subprotocol[len(WEBSOCKET_TOKEN_PROTOCOL_PREFIX):]
+
+    authorization = websocket.headers.get("authorization", "")
+    scheme, _, token = authorization.partition(" ")
+    if scheme.lower() == "bearer" and token:
+        return token
+    return None
+
+async def _load_token_user(token: str) -> Tuple[Optional[User], float]:
+    payload = verify_token(token)
+    if payload is None or payload.get("sub") is None:
+        return None, 0
+    user = await User.get_or_none(id=payload.get("sub"))
+    return user, payload.get("exp", 0)
+
+async def get_websocket_user(websocket: WebSocket) -> User:
+    """
+    WebSocket握手认证
+    token的校验结果短时间缓存，重连风暴时同一token不会重复查询数据库
+    """
+    token = get_websocket_token(websocket)
+    if not token:
+        raise WebSocketException(code=4001, reason="未提供认证凭据")
+
+    user, expire_at = await token_cache.get_or_load(token, lambda: _load_token_user(token))
+    if user is None or expire_at < time.time():
+        raise WebSocketException(code=4001, reason="无效的认证凭据")
+    if not user.is_active:
+        raise WebSocketException(code=4003, reason="用户已被禁用")
+    return user
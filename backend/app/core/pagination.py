@@ -0,0 +1,46 @@
+import base64
+from datetime import datetime
+from typing import Tuple
+import orjson
+
+
+def _encode(values: list) -> str:
+    return base64.urlsafe_b64encode(orjson.dumps(values)).decode().rstrip("=")
+
+
+def _decode(cursor: str) -> list:
+    data = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4))
+    return orjson.loads(data)
+
+
+def encode_cursor(created_at: datetime, message_id: int) -> str:
+    """
+    将 (created_at, id) 编码为不透明的游标
+    """
+    return _encode([created_at.isoformat(), message_id])
+
+
+def decode_cursor(cursor: str) -> Tuple[datetime, int]:
+    """
+    解析游标，格式不正确时抛出 ValueError
+    """
+    try:
+        created_at, message_id = _decode(cursor)
+        return datetime.fromisoformat(created_at), int(message_id)
+    except (TypeError, ValueError, orjson.JSONDecodeError) as e:
+        raise ValueError("无效的游标") from e
+
+
+def encode_search_cursor(score: float, message_id: int) -> str:
+    """
+    将搜索结果的 (得分, id) 编码为不透明的游标
+    """
+    return _encode([score, message_id])
+
+
+def decode_search_cursor(cursor: str) -> Tuple[float, int]:
+    try:
+        score, message_id = _decode(cursor)
+        return float(score), int(message_id)
+    except (TypeError, ValueError, orjson.JSONDecodeError) as e:
+        raise ValueError("无效的游标") from e
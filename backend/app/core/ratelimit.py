@@ -0,0 +1,162 @@
+import math
+import time
+from typing import Dict, Hashable, Optional, Tuple
+import redis.asyncio as redis
+from app.core.config import settings
+
+
+class TokenBucketLimiter:
+    """
+    令牌桶限流器（进程内）
+    每个键只保存 (剩余令牌, 更新时间) 两个浮点数；
+    已经空闲到令牌补满的键与不存在等价，条目过多时直接清理
+    """
+
+    def __init__(self, name: str, rate: float, burst: int, maxsize: int = 100_000):
+        self.name = name
+        self.rate = rate
+        self.burst = burst
+        self.maxsize = maxsize
+        self.buckets: Dict[Hashable, Tuple[float, float]] = {}  # key -> (tokens, updated_at)
+        self.allowed = 0
+        self.limited = 0
+
+    async def acquire(self, key: Hashable) -> float:
+        """
+        尝试消耗一个令牌
+        返回0表示放行，否则返回需要等待的秒数
+        """
+        now = time.monotonic()
+        tokens, updated_at = self.buckets.get(key, (self.burst, now))
+        tokens = min(self.burst, tokens + (now - updated_at) * self.rate)
+        if tokens >= 1:
+            retry_after = 0.0
+            tokens -= 1
+        else:
+            retry_after = (1 - tokens) / self.rate
+        if key not in self.buckets and len(self.buckets) >= self.maxsize:
+            self._sweep(now)
+        self.buckets[key] = (tokens, now)
+        return self._count(retry_after)
+
+    async def refund(self, key: Hashable):
+        """
+        退还 acquire 消耗的一个令牌（请求最终被其它限流器拒绝时调用）
+        """
+        if key in self.buckets:
+            tokens, updated_at = self.buckets[key]
+            self.buckets[key] = (min(self.burst, tokens + 1), updated_at)
+        self.allowed -= 1
+
+    def _count(self, retry_after: float) -> float:
+        if retry_after:
+            self.limited += 1
+        else:
+            self.allowed += 1
+        return retry_after
+
+    def _sweep(self, now: float):
+        refill_time = self.burst / self.rate
+        for key in [key for key, (_, updated_at) in self.buckets.items() if now - updated_at >= refill_time]:
+            del self.buckets[key]
+
+    def get_stats(self) -> dict:
+        return {
+            "allowed": self.allowed,
+            "limited": self.limited,
+            "keys": len(self.buckets),
+        }
+
+
+# 在Redis中原子地执行一次令牌桶计算，使用Redis服务器时间，各worker共享同一个桶
+TOKEN_BUCKET_SCRIPT = """
+local rate = tonumber(ARGV[1])
+local burst = tonumber(ARGV[2])
+local t = redis.call('TIME')
+local now = tonumber(t[1]) + tonumber(t[2]) / 1000000
+local state = redis.call('HMGET', KEYS[1], 'tokens', 'ts')
+local tokens = tonumber(state[1]) or burst
+local ts = tonumber(state[2]) or now
+tokens = math.min(burst, tokens + (now - ts) * rate)
+local retry_after = 0
+if tokens >= 1 then
+    tokens = tokens - 1
+else
+    retry_after = (1 - tokens) / rate
+end
+redis.call('HSET', KEYS[1], 'tokens', tokens, 'ts', now)
+redis.call('PEXPIRE', KEYS[1], math.ceil(burst / rate * 1000))
+return tostring(retry_after)
+"""
+
+# 退还一个令牌，不超过桶的容量；桶已过期（令牌已补满）时不处理
+TOKEN_REFUND_SCRIPT = """
+local tokens = tonumber(redis.call('HGET', KEYS[1], 'tokens'))
+if tokens then
+    redis.call('HSET', KEYS[1], 'tokens', math.min(tonumber(ARGV[1]), tokens + 1))
+end
+"""
+
+
+class RedisTokenBucketLimiter(TokenBucketLimiter):
+    """
+    令牌桶限流器（Redis共享），多worker部署时同一个用户/聊天室共用一个桶
+    """
+
+    PREFIX = "chatroom:ratelimit:"
+
+    def __init__(self, name: str, rate: float, burst: int, url: str):
+        super().__init__(name, rate, burst)
+        self.redis = redis.from_url(url, decode_responses=True)
+        self.script = self.redis.register_script(TOKEN_BUCKET_SCRIPT)
+        self.refund_script = self.redis.register_script(TOKEN_REFUND_SCRIPT)
+
+    async def acquire(self, key: Hashable) -> float:
+        retry_after = await self.script(keys=[f"{self.PREFIX}{self.name}:{key}"], args=[self.rate, self.burst])
+        return self._count(float(retry_after))
+
+    async def refund(self, key: Hashable):
+        await self.refund_script(keys=[f"{self.PREFIX}{self.name}:{key}"], args=[self.burst])
+        self.allowed -= 1
+
+
+def create_limiter(name: str, rate: float, burst: int, backend: Optional[str] = None) -> TokenBucketLimiter:
+    """
+    根据配置创建限流器: memory（默认）或 redis
+    """
+    backend = backend or settings.RATE_LIMIT_BACKEND
+    if backend == "redis":
+        return RedisTokenBucketLimiter(name, rate, burst, settings.REDIS_URL)
+    if backend == "memory":
+        return TokenBucketLimiter(name, rate, burst)
+    raise ValueError(f"未知的限流器类型: {backend}")
+
+
+user_limiter = create_limiter("user", settings.RATE_LIMIT_USER_RATE, settings.RATE_LIMIT_USER_BURST)
+room_limiter = create_limiter("room", settings.RATE_LIMIT_ROOM_RATE, settings.RATE_LIMIT_ROOM_BURST)
+
+
+async def check_rate_limit(user_id: int, room_id: int) -> float:
+    """
+    依次检查用户和聊天室的发送频率
+    返回0表示放行，否则返回需要等待的秒数；只有两者都放行时才消耗令牌:
+    用户被限流时不消耗聊天室的令牌，聊天室被限流时退还用户的令牌
+    """
+    retry_after = await user_limiter.acquire(user_id)
+    if retry_after:
+        return retry_after
+    retry_after = await room_limiter.acquire(room_id)
+    if retry_after:
+        await user_limiter.refund(user_id)
+    return retry_after
+
+
+def retry_after_header(retry_after: float) -> Dict[str, str]:
+    return {"Retry-After": str(max(1, math.ceil(retry_after)))}
+
+
+def get_rate_limit_stats() -> dict:
+    return {
+        user_limiter.name: user_limiter.get_stats(),
+        room_limiter.name: room_limiter.get_stats(),
+    }
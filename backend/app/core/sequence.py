@@ -0,0 +1,93 @@
+from typing import Dict, Optional
+import redis.asyncio as redis
+from app.core.config import settings
+from app.models.message import Message
+
+
+async def load_last_seq(room_id: int) -> int:
+    """
+    数据库中聊天室已使用的最大序号，用于初始化计数器
+    """
+    message = await Message.filter(room_id=room_id, seq__not_isnull=True).order_by("-seq").first()
+    return message.seq if message else 0
+
+
+class RoomSequencer:
+    """
+    聊天室事件序号分配器（进程内）
+    每个聊天室的序号单调递增，第一次使用时从数据库中的最大序号继续
+    """
+
+    def __init__(self):
+        self.last: Dict[int, int] = {}  # room_id -> 最后分配的序号
+
+    async def _ensure(self, room_id: int):
+        if room_id not in self.last:
+            last_seq = await load_last_seq(room_id)
+            # 加载期间可能已有其它协程完成初始化
+            self.last.setdefault(room_id, last_seq)
+
+    async def allocate(self, room_id: int, count: int = 1) -> int:
+        """
+        分配 count 个连续序号，返回最后一个
+        """
+        await self._ensure(room_id)
+        self.last[room_id] += count
+        return self.last[room_id]
+
+    async def forget(self, room_id: int):
+        """
+        聊天室被清理后调用，释放计数器
+        """
+        self.last.pop(room_id, None)
+
+
+# 计数器不存在时用数据库中的最大序号初始化，再原子地递增
+ALLOCATE_SCRIPT = """
+if redis.call('EXISTS', KEYS[1]) == 0 then
+    if ARGV[2] == '' then
+        return false
+    end
+    redis.call('SETNX', KEYS[1], ARGV[2])
+end
+return redis.call('INCRBY', KEYS[1], ARGV[1])
+"""
+
+
+class RedisRoomSequencer(RoomSequencer):
+    """
+    聊天室事件序号分配器（Redis共享），多worker部署时所有worker使用同一个计数器
+    """
+
+    PREFIX = "chatroom:seq:"
+
+    def __init__(self, url: str):
+        super().__init__()
+        self.redis = redis.from_url(url, decode_responses=True)
+        self.script = self.redis.register_script(ALLOCATE_SCRIPT)
+
+    async def allocate(self, room_id: int, count: int = 1) -> int:
+        key = f"{self.PREFIX}{room_id}"
+        last_seq = await self.script(keys=[key], args=[count, ""])
+        if last_seq is None:
+            # 计数器不存在（首次使用或Redis数据丢失），只在这种情况下查询数据库
+            last_seq = await self.script(keys=[key], args=[count, await load_last_seq(room_id)])
+        return int(last_seq)
+
+    async def forget(self, room_id: int):
+        await self.redis.delete(f"{self.PREFIX}{room_id}")
+
+
+def create_sequencer(backend: Optional[str] = None) -> RoomSequencer:
+    """
+    序号计数器与消息总线使用同一种后端: memory（默认）或 redis
+    """
+    backend = backend or settings.BACKPLANE
+    if backend == "redis":
+        return RedisRoomSequencer(settings.REDIS_URL)
+    if backend == "memory":
+        return RoomSequencer()
+    raise ValueError(f"未知的序号计数器类型: {backend}")
+
+
+room_sequencer = create_sequencer()
@@ -0,0 +1,15 @@
+from starlette.responses import Response
+from starlette.staticfiles import StaticFiles
+from starlette.types import Scope
+
+
+class ImmutableStaticFiles(StaticFiles):
+    """
+    文件内容不会改变的静态目录（文件名即内容哈希），允许浏览器和CDN长期缓存
+    """
+
+    async def get_response(self, path: str, scope: Scope) -> Response:
+        response = await super().get_response(path, scope)
+        if response.status_code in (200, 304):
+            response.headers["Cache-Control"] = "public, max-age=31536000, immutable"
+        return response
@@ -0,0 +1,46 @@
+from fastapi import HTTPException
+from starlette.responses import JSONResponse
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+# multipart 的分隔符和各部分头部占用的字节数余量
+MULTIPART_OVERHEAD = 64 * 1024
+
+
+class UploadSizeLimitMiddleware:
+    """
+    限制上传接口的请求体大小
+
+    表单在进入路由函数前就会被完整解析，在路由函数中检查大小时文件已经接收完毕。
+    这里在接收请求体时计数: Content-Length 超出时直接返回413，
+    未声明长度（分块传输）时在累计超出的那一刻中止解析
+    """
+
+    def __init__(self, app: ASGIApp, max_size: int, path_suffix: str = "/messages/upload"):
+        self.app = app
+        self.limit = max_size + MULTIPART_OVERHEAD
+        self.path_suffix = path_suffix
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send):
+        if scope["type"] != "http" or not scope["path"].endswith(self.path_suffix):
+            await self.app(scope, receive, send)
+            return
+
+        for name, value in scope["headers"]:
+            if name == b"content-length" and value.isdigit() and int(value) > self.limit:
+                response = JSONResponse({"detail": "文件大小超过限制"}, status_code=413)
+                await response(scope, receive, send)
+                return
+
+        received = 0
+
+        async def limited_receive() -> Message:
+            nonlocal received
+            message = await receive()
+            if message["type"] == "http.request":
+                received += len(message.get("body", b""))
+                if received > self.limit:
+                    # 由路由的请求体解析转为413响应
+                    raise HTTPException(status_code=413, detail="文件大小超过限制")
+            return message
+
+        await self.app(scope, limited_receive, send)
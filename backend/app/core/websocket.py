@@ -1,54 +1,540 @@
-from typing import Dict, List
+import asyncio
+import logging
+import time
+from collections import OrderedDict
+from typing import Callable, Dict, Iterable, List, Optional, Set, Tuple, Union
 from fastapi import WebSocket
+from app.core.backplane import Backplane, create_backplane
+from app.core.cache import invalidate_membership
+from app.core.codec import JSON_CODEC, Codec, encode_json, negotiate_codec
+from app.core.config import settings
+from app.core.sequence import room_sequencer
 from app.models import User
 
+logger = logging.getLogger(__name__)
+
+# 慢消费者被断开时使用的关闭码
+SLOW_CONSUMER_CLOSE_CODE = 4008
+# 心跳超时被断开时使用的关闭码
+HEARTBEAT_TIMEOUT_CLOSE_CODE = 4009
+
+# 聊天室内部频道的处理函数: (room_id, frame) -> None
+RoomChannelHandler = Callable[[int, str], None]
+# 全局内部频道的处理函数: frame -> None
+ChannelHandler = Callable[[str], None]
+# 用户在本worker上进入/离开聊天室时的回调: (room_id, user_id, online) -> None
+PresenceListener = Callable[[int, int, bool], None]
+# 用户在本worker上第一个连接建立/最后一个连接断开时的回调: (user_id, online) -> None
+UserListener = Callable[[int, bool], None]
+
+PING_FRAME = encode_json({"type": "ping"})
+
+
+class RoomRate:
+    """
+    聊天室消息速率，按一秒的窗口计数
+    速率超过阈值的聊天室进入批量发送模式
+    """
+
+    __slots__ = ("window_start", "count", "batching")
+
+    def __init__(self, now: float):
+        self.window_start = now
+        self.count = 0
+        self.batching = False
+
+
+class ReplayBuffer:
+    """
+    聊天室最近事件的环形缓冲区: seq -> 已编码的帧
+    事件可能乱序到达（先分配序号的消息后提交），因此按序号查找而不是按位置；
+    floor 以下的事件已被淘汰或在缓冲区建立之前，无法从内存补发
+    """
+
+    __slots__ = ("frames", "size", "floor")
+
+    def __init__(self, size: int):
+        self.frames: "OrderedDict[int, str]" = OrderedDict()
+        self.size = size
+        self.floor: Optional[int] = None
+
+    def add(self, seq: int, frame: str):
+        if self.floor is None:
+            self.floor = seq - 1
+        elif seq <= self.floor:
+            return
+        self.frames[seq] = frame
+        if len(self.frames) > self.size:
+            evicted, _ = self.frames.popitem(last=False)
+            self.floor = max(self.floor, evicted)
+
+    def since(self, after_seq: int) -> Optional[List[str]]:
+        """
+        按序号返回 after_seq 之后的事件帧，缓冲区覆盖不到 after_seq 时返回None
+        """
+        if self.floor is None or after_seq < self.floor:
+            return None
+        return [self.frames[seq] for seq in sorted(seq for seq in self.frames if seq > after_seq)]
+
+
+class Connection:
+    """
+    单个WebSocket连接
+    rooms 是该连接订阅的聊天室集合（连接 -> 聊天室 方向的索引）
+    queue 是该连接的有界发送队列，由独立的写任务消费
+    codec 是握手时协商的帧格式
+    """
+
+    __slots__ = ("websocket", "user_id", "codec", "rooms", "queue", "writer", "over_high_water_since", "last_seen")
+
+    def __init__(self, websocket: WebSocket, user_id: int, codec: Codec = JSON_CODEC):
+        self.websocket = websocket
+        self.user_id = user_id
+        self.codec = codec
+        self.rooms: Set[int] = set()
+        self.queue: asyncio.Queue = asyncio.Queue(maxsize=settings.WS_SEND_QUEUE_SIZE)
+        self.writer: Optional[asyncio.Task] = None
+        self.over_high_water_since: Optional[float] = None
+        # 最近一次收到客户端帧的时间，用于心跳检测
+        self.last_seen = time.monotonic()
+
+
+def _pack_room_frame(seq: Optional[int], frame: str) -> str:
+    """
+    聊天室频道上的帧前面带上序号（没有序号时为空），各worker记录补发缓冲区时不需要解析整个帧。
+    JSON帧中不会出现换行符，以第一个换行符分隔
+    """
+    return f"{'' if seq is None else seq}\n{frame}"
+
+
+def _unpack_room_frame(data: str) -> Tuple[Optional[int], str]:
+    seq, _, frame = data.partition("\n")
+    return (int(seq) if seq else None), frame
+
 
 class ConnectionManager:
+    # 成员被踢出、封禁或聊天室被删除时通知所有worker
+    ROOM_ACCESS_CHANNEL = "room_access"
+
     def __init__(self):
         # 存储所有活跃连接
-        self.active_connections: Dict[int, WebSocket] = {}  # user_id -> WebSocket
-        # 存储用户所在的聊天室
-        self.user_rooms: Dict[int, List[int]] = {}  # user_id -> [room_id]
+        self.active_connections: Dict[int, Set[Connection]] = {}  # user_id -> {Connection}
+        # 聊天室 -> 在线连接 的索引，广播时只需访问房间内的连接
+        self.room_connections: Dict[int, Set[Connection]] = {}  # room_id -> {Connection}
+        # 聊天室内每个用户的本地连接数，用于计算在线成员
+        self.room_user_counts: Dict[int, Dict[int, int]] = {}  # room_id -> {user_id -> 连接数}
+        self.presence_listeners: List[PresenceListener] = []
+        self.user_listeners: List[UserListener] = []
+        # 发送队列统计
+        self.stats: Dict[str, int] = {
+            "dropped_frames": 0,
+            "evicted_connections": 0,
+            "reaped_connections": 0,
+            "batched_frames": 0,
+            "batched_events": 0,
+        }
+        # 热门聊天室的批量发送状态
+        self.room_rates: Dict[int, RoomRate] = {}
+        self.room_pending: Dict[int, List[str]] = {}  # room_id -> 等待合并发送的帧
+        # 有本地成员的聊天室的最近事件，用于断线重连补发
+        self.room_history: Dict[int, ReplayBuffer] = {}
+        self.reaper: Optional[asyncio.Task] = None
+        # 跨进程消息总线，广播先发布到总线，再由各worker投递给本地连接
+        self.backplane: Backplane = create_backplane(self._on_backplane_message)
+        self.backplane.subscribe("all")
+        # 聊天室范围的内部频道: kind -> handler，这些事件交给服务端处理，不直接转发给客户端
+        self.room_channel_handlers: Dict[str, RoomChannelHandler] = {}
+        # 所有worker都订阅的内部频道: channel -> handler（如各worker本地缓存的同步）
+        self.channel_handlers: Dict[str, ChannelHandler] = {}
+        self.register_channel(self.ROOM_ACCESS_CHANNEL, self._on_room_access_revoked)
+
+    async def start(self):
+        await self.backplane.start()
+        self.reaper = asyncio.create_task(self._reap_loop())
+
+    async def stop(self):
+        if self.reaper is not None:
+            self.reaper.cancel()
+            await asyncio.gather(self.reaper, return_exceptions=True)
+            self.reaper = None
+        await self.backplane.stop()
+
+    async def connect(self, websocket: WebSocket, user: User, room_id: Optional[int] = None) -> Connection:
+        codec, subprotocol = negotiate_codec(websocket)
+        await websocket.accept(subprotocol=subprotocol)
+        connection = Connection(websocket, user.id, codec)
+        connection.writer = asyncio.create_task(self._write_loop(connection))
+        connections = self.active_connections.setdefault(user.id, set())
+        if not connections:
+            # 本地第一个连接，订阅该用户的频道
+            self.backplane.subscribe(f"user:{user.id}")
+        connections.add(connection)
+        if len(connections) == 1:
+            self._notify_user(user.id, True)
+        if room_id is not None:
+            self.subscribe(connection, room_id)
+        return connection
+
+    def disconnect(self, connection: Connection):
+        for room_id in list(connection.rooms):
+            self.unsubscribe(connection, room_id)
+        connections = self.active_connections.get(connection.user_id)
+        if connections is not None:
+            connections.discard(connection)
+            if not connections:
+                del self.active_connections[connection.user_id]
+                self.backplane.unsubscribe(f"user:{connection.user_id}")
+                self._notify_user(connection.user_id, False)
+        if connection.writer is not None and connection.writer is not asyncio.current_task():
+            connection.writer.cancel()
+
+    def subscribe(self, connection: Connection, room_id: int):
+        """
+        将连接加入聊天室，同时维护双向索引
+        """
+        if room_id in connection.rooms:
+            return
+        connection.rooms.add(room_id)
+        connections = self.room_connections.setdefault(room_id, set())
+        if not connections:
+            # 本地第一个成员，订阅该聊天室的频道
+            for channel in self._room_channels(room_id):
+                self.backplane.subscribe(channel)
+            self.room_history[room_id] = ReplayBuffer(settings.REPLAY_BUFFER_SIZE)
+        connections.add(connection)
+        user_counts = self.room_user_counts.setdefault(room_id, {})
+        user_counts[connection.user_id] = user_counts.get(connection.user_id, 0) + 1
+        if user_counts[connection.user_id] == 1:
+            self._notify_presence(room_id, connection.user_id, True)
+
+    def unsubscribe(self, connection: Connection, room_id: int):
+        """
+        将连接移出聊天室，同时维护双向索引
+        """
+        if room_id not in connection.rooms:
+            return
+        connection.rooms.discard(room_id)
+        connections = self.room_connections[room_id]
+        connections.discard(connection)
+        if not connections:
+            del self.room_connections[room_id]
+            self.room_rates.pop(room_id, None)
+            # 取消订阅后会错过事件，缓冲区不再连续
+            self.room_history.pop(room_id, None)
+            for channel in self._room_channels(room_id):
+                self.backplane.unsubscribe(channel)
+        user_counts = self.room_user_counts[room_id]
+        user_counts[connection.user_id] -= 1
+        if not user_counts[connection.user_id]:
+            del user_counts[connection.user_id]
+            if not user_counts:
+                del self.room_user_counts[room_id]
+            self._notify_presence(room_id, connection.user_id, False)
+
+    def add_presence_listener(self, listener: PresenceListener):
+        self.presence_listeners.append(listener)
 
-    async def connect(self, websocket: WebSocket, user: User):
-        await websocket.accept()
-        self.active_connections[user.id] = websocket
-        self.user_rooms[user.id] = []
+    def add_user_listener(self, listener: UserListener):
+        self.user_listeners.append(listener)
 
-    def disconnect(self, user_id: int):
-        if user_id in self.active_connections:
-            del self.active_connections[user_id]
-        if user_id in self.user_rooms:
-            del self.user_rooms[user_id]
+    def _notify_user(self, user_id: int, online: bool):
+        for listener in self.user_listeners:
+            listener(user_id, online)
+
+    def _notify_presence(self, room_id: int, user_id: int, online: bool):
+        for listener in self.presence_listeners:
+            listener(room_id, user_id, online)
+
+    def register_room_channel(self, kind: str, handler: RoomChannelHandler):
+        """
+        注册聊天室范围的内部频道，worker有本地成员时会同时订阅 {kind}:{room_id}
+        """
+        self.room_channel_handlers[kind] = handler
+
+    def register_channel(self, channel: str, handler: ChannelHandler):
+        """
+        注册全局内部频道，本worker始终订阅
+        """
+        self.channel_handlers[channel] = handler
+        self.backplane.subscribe(channel)
+
+    def unregister_channel(self, channel: str):
+        if self.channel_handlers.pop(channel, None) is not None:
+            self.backplane.unsubscribe(channel)
+
+    def _room_channels(self, room_id: int) -> List[str]:
+        return [f"room:{room_id}"] + [f"{kind}:{room_id}" for kind in self.room_channel_handlers]
 
     def add_user_to_room(self, user_id: int, room_id: int):
-        if user_id in self.user_rooms:
-            if room_id not in self.user_rooms[user_id]:
-                self.user_rooms[user_id].append(room_id)
+        for connection in self.active_connections.get(user_id, ()):
+            self.subscribe(connection, room_id)
 
     def remove_user_from_room(self, user_id: int, room_id: int):
-        if user_id in self.user_rooms and room_id in self.user_rooms[user_id]:
-            self.user_rooms[user_id].remove(room_id)
+        for connection in list(self.active_connections.get(user_id, ())):
+            self.unsubscribe(connection, room_id)
+
+    async def revoke_room_access(self, room_id: int, user_id: Optional[int] = None, detail: str = ""):
+        """
+        收回聊天室的访问权限（user_id 为空表示所有成员），所有worker清除成员缓存，
+        并让受影响的连接退出该聊天室，不再收到聊天室的事件
+        """
+        await self.publish(self.ROOM_ACCESS_CHANNEL, {"room_id": room_id, "user_id": user_id, "detail": detail})
+
+    def _on_room_access_revoked(self, frame: str):
+        event = JSON_CODEC.decode(frame)
+        room_id, user_id = event["room_id"], event["user_id"]
+        invalidate_membership(user_id, room_id)
+        for connection in list(self.room_connections.get(room_id, ())):
+            if user_id is None or connection.user_id == user_id:
+                self.unsubscribe(connection, room_id)
+                self.send_to_connection(connection, {
+                    "type": "unsubscribed",
+                    "room_id": room_id,
+                    "detail": event["detail"]
+                })
+
+    def get_room_user_ids(self, room_id: int) -> Set[int]:
+        return set(self.room_user_counts.get(room_id, ()))
+
+    def touch(self, connection: Connection):
+        """
+        收到客户端的任意帧（包括pong）都视为连接存活
+        """
+        connection.last_seen = time.monotonic()
+
+    def get_stats(self) -> Dict[str, int]:
+        return {
+            "connections": sum(len(connections) for connections in self.active_connections.values()),
+            "rooms": len(self.room_connections),
+            **self.stats,
+        }
+
+    def enqueue(self, connection: Connection, frame: Union[str, bytes]):
+        """
+        将已编码的帧放入连接的发送队列，不等待实际发送
+        队列已满时丢弃该帧；持续超过高水位线的连接会被断开
+        """
+        try:
+            connection.queue.put_nowait(frame)
+        except asyncio.QueueFull:
+            self.stats["dropped_frames"] += 1
+
+        if connection.queue.qsize() < settings.WS_SEND_QUEUE_HIGH_WATER:
+            connection.over_high_water_since = None
+            return
+
+        now = time.monotonic()
+        if connection.over_high_water_since is None:
+            connection.over_high_water_since = now
+        elif now - connection.over_high_water_since >= settings.WS_SLOW_CONSUMER_TIMEOUT:
+            self.evict(connection)
+
+    def evict(self, connection: Connection):
+        """
+        断开慢消费者
+        """
+        logger.warning("断开慢消费者连接: user_id=%s", connection.user_id)
+        self.stats["evicted_connections"] += 1
+        self.disconnect(connection)
+        asyncio.create_task(self._close(connection, SLOW_CONSUMER_CLOSE_CODE, "slow consumer"))
+
+    def reap(self, now: Optional[float] = None):
+        """
+        断开连续多次未响应心跳的连接，并向其余连接发送ping
+        """
+        now = time.monotonic() if now is None else now
+        deadline = settings.WS_HEARTBEAT_INTERVAL * settings.WS_HEARTBEAT_MAX_MISSED
+        alive = []
+        for connections in list(self.active_connections.values()):
+            for connection in list(connections):
+                if now - connection.last_seen > deadline:
+                    self.stats["reaped_connections"] += 1
+                    self.disconnect(connection)
+                    asyncio.create_task(self._close(connection, HEARTBEAT_TIMEOUT_CLOSE_CODE, "heartbeat timeout"))
+                else:
+                    alive.append(connection)
+        self._fan_out(alive, PING_FRAME)
+
+    async def _reap_loop(self):
+        while True:
+            await asyncio.sleep(settings.WS_HEARTBEAT_INTERVAL)
+            try:
+                self.reap()
+            except Exception:
+                logger.exception("心跳检测失败")
+
+    async def _close(self, connection: Connection, code: int, reason: str):
+        try:
+            await asyncio.wait_for(connection.websocket.close(code=code, reason=reason), timeout=5)
+        except Exception:
+            pass
+
+    async def _write_loop(self, connection: Connection):
+        """
+        连接的写任务，按顺序发送队列中的消息
+        """
+        websocket = connection.websocket
+        try:
+            while True:
+                frame = await connection.queue.get()
+                if isinstance(frame, str):
+                    await websocket.send_text(frame)
+                else:
+                    await websocket.send_bytes(frame)
+                if connection.queue.qsize() < settings.WS_SEND_QUEUE_HIGH_WATER:
+                    connection.over_high_water_since = None
+        except asyncio.CancelledError:
+            raise
+        except Exception:
+            # 发送失败说明连接已不可用
+            self.disconnect(connection)
+
+    def send_to_connection(self, connection: Connection, message: Union[str, dict]):
+        """
+        只发送给当前连接（订阅结果、错误提示等）
+        """
+        self._fan_out((connection,), encode_json(message))
+
+    def send_to_local_user(self, user_id: int, message: Union[str, dict]):
+        """
+        只发送给该用户在本worker上的连接，不经过消息总线
+        """
+        self._fan_out(list(self.active_connections.get(user_id, ())), encode_json(message))
+
+    def _fan_out(self, connections: Iterable[Connection], frame: str):
+        """
+        将JSON帧投递给一组连接
+        每种帧格式只编码一次，同格式的连接共享同一个帧对象
+        """
+        encoded: Dict[str, Union[str, bytes]] = {JSON_CODEC.name: frame}
+        message = None
+        for connection in connections:
+            codec = connection.codec
+            data = encoded.get(codec.name)
+            if data is None:
+                if message is None:
+                    message = JSON_CODEC.decode(frame)
+                data = encoded[codec.name] = codec.encode(message)
+            self.enqueue(connection, data)
+
+    def _on_backplane_message(self, channel: str, frame: str):
+        """
+        从消息总线收到帧后投递给本地连接
+        """
+        channel_handler = self.channel_handlers.get(channel)
+        if channel_handler is not None:
+            channel_handler(frame)
+            return
+        kind, _, key = channel.partition(":")
+        handler = self.room_channel_handlers.get(kind)
+        if handler is not None:
+            handler(int(key), frame)
+            return
+        if kind == "room":
+            self._deliver_room_frame(int(key), *_unpack_room_frame(frame))
+            return
+        if kind == "user":
+            connections = list(self.active_connections.get(int(key), ()))
+        elif kind == "all":
+            connections = [c for cs in self.active_connections.values() for c in cs]
+        else:
+            return
+        self._fan_out(connections, frame)
+
+    def _deliver_room_frame(self, room_id: int, seq: Optional[int], frame: str):
+        """
+        投递聊天室广播
+        安静的聊天室立即发送；速率超过阈值的聊天室在发送窗口内合并为一个batch帧
+        """
+        connections = self.room_connections.get(room_id)
+        if not connections:
+            return
+        if seq is not None:
+            self.room_history[room_id].add(seq, frame)
+        if not self._should_batch(room_id):
+            self._fan_out(list(connections), frame)
+            return
+        pending = self.room_pending.get(room_id)
+        if pending is None:
+            pending = self.room_pending[room_id] = []
+            asyncio.get_running_loop().call_later(settings.WS_BATCH_WINDOW, self._flush_room, room_id)
+        pending.append(frame)
+
+    def _should_batch(self, room_id: int) -> bool:
+        if settings.WS_BATCH_WINDOW <= 0:
+            return False
+        now = time.monotonic()
+        rate = self.room_rates.get(room_id)
+        if rate is None:
+            rate = self.room_rates[room_id] = RoomRate(now)
+        elapsed = now - rate.window_start
+        if elapsed >= 1.0:
+            # 以上一个窗口的平均速率决定是否继续批量发送
+            rate.batching = rate.count / elapsed >= settings.WS_BATCH_RATE_THRESHOLD
+            rate.window_start = now
+            rate.count = 0
+        rate.count += 1
+        if rate.count >= settings.WS_BATCH_RATE_THRESHOLD:
+            rate.batching = True
+        return rate.batching
+
+    def _flush_room(self, room_id: int):
+        frames = self.room_pending.pop(room_id, None)
+        if not frames:
+            return
+        if len(frames) == 1:
+            frame = frames[0]
+        else:
+            # 各事件已是JSON帧，直接拼接，不需要重新编码
+            frame = '{"type":"batch","room_id":%d,"events":[%s]}' % (room_id, ",".join(frames))
+            self.stats["batched_frames"] += 1
+            self.stats["batched_events"] += len(frames)
+        self._fan_out(list(self.room_connections.get(room_id, ())), frame)
+
+    def get_replay(self, room_id: int, after_seq: int) -> Optional[List[str]]:
+        """
+        从内存中取出聊天室 after_seq 之后的事件帧
+        本worker没有该聊天室的连续记录时返回None，需要回退到数据库
+        """
+        history = self.room_history.get(room_id)
+        if history is None:
+            return None
+        return history.since(after_seq)
+
+    def deliver_to_room(self, room_id: int, message: Union[str, dict]):
+        """
+        只投递给本worker上的房间成员，不经过消息总线
+        """
+        self._fan_out(list(self.room_connections.get(room_id, ())), encode_json(message))
+
+    async def publish_room_event(self, kind: str, room_id: int, message: Union[str, dict]):
+        """
+        发布聊天室内部事件，由各worker注册的处理函数消费
+        """
+        await self.backplane.publish(f"{kind}:{room_id}", encode_json(message))
+
+    async def publish(self, channel: str, message: Union[str, dict]):
+        """
+        发布到全局内部频道
+        """
+        await self.backplane.publish(channel, encode_json(message))
 
-    async def send_personal_message(self, message: str, user_id: int):
-        if user_id in self.active_connections:
-            await self.active_connections[user_id].send_text(message)
+    async def send_personal_message(self, message: Union[str, dict], user_id: int):
+        await self.backplane.publish(f"user:{user_id}", encode_json(message))
 
-    async def broadcast_to_room(self, message: str, room_id: int):
-        # 获取房间内所有用户
-        room_users = [
-            user_id for user_id, rooms in self.user_rooms.items()
-            if room_id in rooms
-        ]
-        # 向房间内所有用户发送消息
-        for user_id in room_users:
-            if user_id in self.active_connections:
-                await self.active_connections[user_id].send_text(message)
+    async def broadcast_to_room(self, room_id: int, message: Union[str, dict]):
+        # 每个聊天室事件带有递增的序号，消息在持久化前已分配序号
+        seq = None
+        if isinstance(message, dict):
+            if "seq" not in message:
+                message = {**message, "seq": await room_sequencer.allocate(room_id)}
+            seq = message["seq"]
+        # 只编码一次，所有worker上的房间成员共享同一个帧
+        await self.backplane.publish(f"room:{room_id}", _pack_room_frame(seq, encode_json(message)))
 
-    async def broadcast_to_all(self, message: str):
-        for connection in self.active_connections.values():
-            await connection.send_text(message)
+    async def broadcast_to_all(self, message: Union[str, dict]):
+        await self.backplane.publish("all", encode_json(message))
 
 
 # 创建全局连接管理器实例
-manager = ConnectionManager() 
\ No newline at end of file
+manager = ConnectionManager()
@@ -1,22 +1,195 @@
-from datetime import datetime
-from sqlalchemy.orm import Session
-from backend.models.message import Message
+from datetime import datetime, timezone
+from typing import AsyncIterator, List, Optional, Tuple
+from tortoise import Tortoise
+from tortoise.expressions import Q
+from tortoise.transactions import in_transaction
+from app.models.message import Message
 
-def recall_message(db: Session, message_id: int, user_id: int) -> bool:
+# COPY时写入的列，顺序与 _to_record 一致
+MESSAGE_COPY_COLUMNS = [
+    "id", "room_id", "sender_id", "content", "message_type",
+    "image_url", "created_at", "updated_at", "recalled", "seq"
+]
+
+
+def _is_postgres(connection) -> bool:
+    return connection.capabilities.dialect == "postgres"
+
+
+def _aware(value: datetime) -> datetime:
+    return value if value.tzinfo is not None else value.replace(tzinfo=timezone.utc)
+
+
+def _to_record(message: Message) -> tuple:
+    return (
+        message.id,
+        message.room_id,
+        message.sender_id,
+        message.content,
+        message.message_type,
+        message.image_url,
+        _aware(message.created_at),
+        _aware(message.updated_at),
+        message.recalled,
+        message.seq,
+    )
+
+
+async def create_messages(messages: List[Message]) -> List[Message]:
+    """
+    批量写入消息（created_at / updated_at 需已赋值）
+    PostgreSQL: 先从序列批量取ID，再用一条COPY写入所有行，一次往返
+    其它数据库: 在一个事务中逐条插入
+    """
+    if not messages:
+        return messages
+
+    connection = Tortoise.get_connection("default")
+    if not _is_postgres(connection):
+        async with in_transaction():
+            for message in messages:
+                await message.save()
+        return messages
+
+    async with connection.acquire_connection() as raw:
+        async with raw.transaction():
+            rows = await raw.fetch(
+                "SELECT nextval(pg_get_serial_sequence('messages', 'id')) AS id "
+                "FROM generate_series(1, $1)",
+                len(messages)
+            )
+            for message, row in zip(messages, rows):
+                message.id = row["id"]
+            await raw.copy_records_to_table(
+                Message._meta.db_table,
+                records=[_to_record(message) for message in messages],
+                columns=MESSAGE_COPY_COLUMNS
+            )
+    for message in messages:
+        message._saved_in_db = True
+    return messages
+
+
+async def get_messages_page(
+    room_id: int,
+    limit: int,
+    before: Optional[Tuple[datetime, int]] = None,
+    after: Optional[Tuple[datetime, int]] = None
+) -> List[Message]:
+    """
+    按 (created_at, id) 键集分页获取消息，结果按时间倒序
+    before: 取比该位置更早的一页；after: 取比该位置更新的一页
+    条件中冗余的 created_at <= / >= 让 (room_id, created_at, id) 索引可以直接定位起点，
+    翻页耗时与深度无关
+    """
+    query = Message.filter(room_id=room_id)
+    if after is not None:
+        created_at, message_id = after
+        query = query.filter(
+            Q(created_at__gte=created_at),
+            Q(created_at__gt=created_at) | Q(id__gt=message_id)
+        ).order_by('created_at', 'id')
+    else:
+        if before is not None:
+            created_at, message_id = before
+            query = query.filter(
+                Q(created_at__lte=created_at),
+                Q(created_at__lt=created_at) | Q(id__lt=message_id)
+            )
+        query = query.order_by('-created_at', '-id')
+
+    messages = await query.limit(limit)
+    if after is not None:
+        messages.reverse()
+    return messages
+
+
+async def iter_messages(
+    room_id: int,
+    batch_size: int,
+    since: Optional[datetime] = None,
+    until: Optional[datetime] = None,
+    after: Optional[Tuple[datetime, int]] = None
+) -> AsyncIterator[List[dict]]:
+    """
+    按 (created_at, id) 顺序分批读取聊天室的消息（导出用），每行包含 MESSAGE_COPY_COLUMNS
+    PostgreSQL 使用服务端游标，其它数据库按键集分批查询，内存占用与消息总数无关
+    """
+    connection = Tortoise.get_connection("default")
+    if not _is_postgres(connection):
+        query = Message.filter(room_id=room_id)
+        if since is not None:
+            query = query.filter(created_at__gte=since)
+        if until is not None:
+            query = query.filter(created_at__lt=until)
+        while True:
+            page = query
+            if after is not None:
+                created_at, message_id = after
+                page = page.filter(
+                    Q(created_at__gte=created_at),
+                    Q(created_at__gt=created_at) | Q(id__gt=message_id)
+                )
+            rows = await page.order_by('created_at', 'id').limit(batch_size).values(*MESSAGE_COPY_COLUMNS)
+            if not rows:
+                return
+            yield rows
+            after = (rows[-1]["created_at"], rows[-1]["id"])
+
+    conditions = ["room_id = $1"]
+    args: list = [room_id]
+    if since is not None:
+        args.append(since)
+        conditions.append(f"created_at >= ${len(args)}")
+    if until is not None:
+        args.append(until)
+        conditions.append(f"created_at < ${len(args)}")
+    if after is not None:
+        args.extend(after)
+        conditions.append(f"(created_at, id) > (${len(args) - 1}, ${len(args)})")
+    async with connection.acquire_connection() as raw:
+        # 服务端游标只能在事务中使用
+        async with raw.transaction():
+            cursor = await raw.cursor(
+                f"SELECT {', '.join(MESSAGE_COPY_COLUMNS)} FROM messages "
+                f"WHERE {' AND '.join(conditions)} ORDER BY created_at, id",
+                *args
+            )
+            while True:
+                records = await cursor.fetch(batch_size)
+                if not records:
+                    return
+                yield [dict(record) for record in records]
+
+
+async def get_messages_after_seq(room_id: int, after_seq: int, limit: int) -> List[Message]:
+    """
+    按序号顺序获取 after_seq 之后的消息（断线重连补发）
+    """
+    return await Message.filter(
+        room_id=room_id,
+        seq__gt=after_seq
+    ).order_by('seq').limit(limit)
+
+
+async def recall_message(message_id: int, user_id: int, room_id: Optional[int] = None) -> bool:
     """撤回消息"""
-    message = db.query(Message).filter(Message.id == message_id).first()
+    if room_id is not None:
+        message = await Message.get_or_none(id=message_id, room_id=room_id)
+    else:
+        message = await Message.get_or_none(id=message_id)
     if not message:
         return False
-    
+
     # 检查是否是消息发送者
     if message.sender_id != user_id:
         return False
-    
+
     # 检查消息是否在2分钟内
-    if (datetime.utcnow() - message.created_at).total_seconds() > 120:
+    if (datetime.now(timezone.utc) - _aware(message.created_at)).total_seconds() > 120:
         return False
-    
+
     message.content = "[消息已撤回]"
     message.recalled = True
-    db.commit()
-    return True 
\ No newline at end of file
+    await message.save(update_fields=["content", "recalled", "updated_at"])
+    return True
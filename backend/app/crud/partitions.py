@@ -0,0 +1,137 @@
+import re
+from datetime import datetime, timezone
+from typing import Iterable, List, Optional, Tuple
+from tortoise import Tortoise
+from tortoise.backends.base.client import BaseDBAsyncClient
+from tortoise.transactions import in_transaction
+from app.crud.message import MESSAGE_COPY_COLUMNS
+
+# 消息表的月分区命名为 messages_pYYYY_MM，边界为UTC自然月
+_PARTITION_NAME = re.compile(r"messages_p(\d{4})_(\d{2})")
+
+# 分区归档的事务级advisory锁，多个worker中同一时间只有一个在执行
+_MAINTENANCE_LOCK = 0x6D736770
+# 创建分区的锁，与归档分开，创建不必等待耗时的导出
+_CREATE_LOCK = 0x6D736763
+
+_COLUMNS = ", ".join(MESSAGE_COPY_COLUMNS)
+
+
+def month_start(value: datetime) -> datetime:
+    value = value.astimezone(timezone.utc)
+    return datetime(value.year, value.month, 1, tzinfo=timezone.utc)
+
+
+def add_months(month: datetime, count: int) -> datetime:
+    index = month.year * 12 + month.month - 1 + count
+    return datetime(index // 12, index % 12 + 1, 1, tzinfo=timezone.utc)
+
+
+def partition_name(month: datetime) -> str:
+    return f"messages_p{month:%Y_%m}"
+
+
+def _checked(name: str) -> str:
+    # 分区名会直接写入SQL
+    if not _PARTITION_NAME.fullmatch(name):
+        raise ValueError(f"无效的分区名: {name}")
+    return name
+
+
+async def is_partitioned() -> bool:
+    """
+    消息表是否已改为分区表（migrations/20261018_message_partitions.sql）
+    """
+    connection = Tortoise.get_connection("default")
+    if connection.capabilities.dialect != "postgres":
+        return False
+    rows = await connection.execute_query_dict(
+        "SELECT relkind FROM pg_class WHERE oid = to_regclass('messages')"
+    )
+    return bool(rows) and rows[0]["relkind"] == "p"
+
+
+async def try_lock(connection: BaseDBAsyncClient) -> bool:
+    """
+    在当前事务中获取分区维护锁，事务结束时自动释放
+    """
+    rows = await connection.execute_query_dict(
+        "SELECT pg_try_advisory_xact_lock($1) AS locked", [_MAINTENANCE_LOCK]
+    )
+    return rows[0]["locked"]
+
+
+async def list_partitions(connection: Optional[BaseDBAsyncClient] = None) -> List[Tuple[str, datetime]]:
+    """
+    当前挂载在消息表上的月分区: [(分区名, 月份起始时间)]，按时间升序
+    """
+    connection = connection or Tortoise.get_connection("default")
+    rows = await connection.execute_query_dict(
+        "SELECT child.relname AS name FROM pg_inherits "
+        "JOIN pg_class AS child ON child.oid = pg_inherits.inhrelid "
+        "WHERE pg_inherits.inhparent = to_regclass('messages')"
+    )
+    partitions = []
+    for row in rows:
+        match = _PARTITION_NAME.fullmatch(row["name"])
+        if match:
+            month = datetime(int(match.group(1)), int(match.group(2)), 1, tzinfo=timezone.utc)
+            partitions.append((row["name"], month))
+    partitions.sort(key=lambda partition: partition[1])
+    return partitions
+
+
+async def create_partition(connection: BaseDBAsyncClient, month: datetime):
+    await connection.execute_script(
+        f"CREATE TABLE IF NOT EXISTS {partition_name(month)} PARTITION OF messages "
+        f"FOR VALUES FROM ('{month.isoformat()}') TO ('{add_months(month, 1).isoformat()}')"
+    )
+
+
+async def ensure_partitions(months: Iterable[datetime]):
+    """
+    创建缺少的月分区（months 为各月的起始时间）
+    """
+    async with in_transaction() as connection:
+        await connection.execute_query_dict("SELECT pg_advisory_xact_lock($1)", [_CREATE_LOCK])
+        existing = {month for _, month in await list_partitions(connection)}
+        for month in sorted(set(months) - existing):
+            await create_partition(connection, month)
+
+
+async def lock_partition(connection: BaseDBAsyncClient, name: str):
+    """
+    在当前事务中阻止对该分区的写入（读取不受影响）
+    """
+    await connection.execute_script(f"LOCK TABLE {_checked(name)} IN SHARE MODE")
+
+
+async def fetch_partition_rows(
+    connection: BaseDBAsyncClient,
+    name: str,
+    limit: int,
+    after: Optional[Tuple[int, datetime, int]] = None
+) -> List[dict]:
+    """
+    按 (room_id, created_at, id) 键集顺序读取分区中的消息，after 为上一批最后一行的位置
+    """
+    if after is None:
+        return await connection.execute_query_dict(
+            f"SELECT {_COLUMNS} FROM {_checked(name)} "
+            f"ORDER BY room_id, created_at, id LIMIT $1",
+            [limit]
+        )
+    return await connection.execute_query_dict(
+        f"SELECT {_COLUMNS} FROM {_checked(name)} "
+        f"WHERE (room_id, created_at, id) > ($1, $2, $3) "
+        f"ORDER BY room_id, created_at, id LIMIT $4",
+        [*after, limit]
+    )
+
+
+async def detach_partition(connection: BaseDBAsyncClient, name: str):
+    await connection.execute_script(f"ALTER TABLE messages DETACH PARTITION {_checked(name)}")
+
+
+async def drop_partition(name: str):
+    await Tortoise.get_connection("default").execute_script(f"DROP TABLE IF EXISTS {_checked(name)}")
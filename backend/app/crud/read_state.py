@@ -0,0 +1,92 @@
+from bisect import bisect_left
+from typing import Dict, Iterable
+from tortoise import Tortoise, timezone
+from tortoise.expressions import Q
+from app.models.chat_room_member import ChatRoomMember
+from app.models.message import Message
+
+
+async def mark_read(room_id: int, user_id: int, message_id: int) -> bool:
+    """
+    将成员的已读水位线推进到 message_id，只需一条UPDATE
+    水位线只前进不后退，返回是否发生了变化
+    """
+    updated = await ChatRoomMember.filter(
+        Q(last_read_message_id__isnull=True) | Q(last_read_message_id__lt=message_id),
+        room_id=room_id,
+        user_id=user_id
+    ).update(last_read_message_id=message_id, last_read_at=timezone.now())
+    return updated > 0
+
+
+async def get_read_count(room_id: int, message_id: int) -> int:
+    """
+    已读人数: 水位线不小于该消息ID的成员数
+    """
+    return await ChatRoomMember.filter(room_id=room_id, last_read_message_id__gte=message_id).count()
+
+
+async def get_read_counts(room_id: int, message_ids: Iterable[int]) -> Dict[int, int]:
+    """
+    批量计算已读人数，一次取出聊天室所有成员的水位线后二分查找
+    """
+    watermarks = sorted(await ChatRoomMember.filter(
+        room_id=room_id,
+        last_read_message_id__isnull=False
+    ).values_list("last_read_message_id", flat=True))
+    return {
+        message_id: len(watermarks) - bisect_left(watermarks, message_id)
+        for message_id in message_ids
+    }
+
+
+async def get_unread_counts(user_id: int) -> Dict[int, int]:
+    """
+    用户所在的每个聊天室的未读数（水位线之后、不是自己发送的消息），一次分组查询
+    """
+    connection = Tortoise.get_connection("default")
+    if connection.capabilities.dialect != "postgres":
+        # 其它数据库（测试用的SQLite）逐个聊天室计数
+        members = await ChatRoomMember.filter(user_id=user_id, room__deleted_at__isnull=True).values(
+            "room_id", "last_read_message_id"
+        )
+        return {
+            member["room_id"]: await Message.filter(
+                room_id=member["room_id"],
+                id__gt=member["last_read_message_id"] or 0
+            ).exclude(sender_id=user_id).count()
+            for member in members
+        }
+    rows = await connection.execute_query_dict(
+        "SELECT member.room_id, COUNT(message.id) AS unread "
+        "FROM chat_room_members AS member "
+        "JOIN chat_rooms AS room ON room.id = member.room_id AND room.deleted_at IS NULL "
+        "LEFT JOIN messages AS message ON message.room_id = member.room_id "
+        "AND message.id > COALESCE(member.last_read_message_id, 0) "
+        "AND message.sender_id <> member.user_id "
+        "WHERE member.user_id = $1 "
+        "GROUP BY member.room_id",
+        [user_id]
+    )
+    return {row["room_id"]: row["unread"] for row in rows}
+
+
+async def latest_message_id(room_id: int) -> int:
+    """
+    聊天室最新一条消息的ID，没有消息时为0；新成员的水位线从这里开始，之前的消息不算未读
+    """
+    message_id = await Message.filter(room_id=room_id).order_by("-id").first().values_list("id", flat=True)
+    return message_id or 0
+
+
+async def count_unread(room_id: int, user_id: int) -> int:
+    """
+    单个聊天室的未读数
+    """
+    member = await ChatRoomMember.get_or_none(room_id=room_id, user_id=user_id)
+    if member is None:
+        return 0
+    return await Message.filter(
+        room_id=room_id,
+        id__gt=member.last_read_message_id or 0
+    ).exclude(sender_id=user_id).count()
@@ -9,6 +9,17 @@ import os
 sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 
 from app.core.config import settings
+from app.core.static_files import ImmutableStaticFiles
+from app.core.upload_limit import UploadSizeLimitMiddleware
+from app.core.websocket import manager
+from app.services.archive import message_archiver
+from app.services.message_writer import message_writer
+from app.services.presence import presence_tracker
+from app.services.retention import retention_job
+from app.services.search import search_index
+from app.services.typing import typing_tracker
+from app.services.uploads import blob_store
+from app.services.unread import unread_tracker
 from app.api.v1 import api_router
 from app.models import TORTOISE_ORM
 import uvicorn
@@ -19,9 +30,14 @@ app = FastAPI(
     version="1.0.0"
 )
 
-# 挂载静态文件
+# 挂载静态文件；按内容哈希命名的图片长期缓存，需要在 /static 之前挂载
+os.makedirs(blob_store.directory, exist_ok=True)
+app.mount(blob_store.url_prefix, ImmutableStaticFiles(directory=blob_store.directory), name="image_blobs")
 app.mount("/static", StaticFiles(directory="static"), name="static")
 
+# 上传接口在接收请求体时即检查大小，超出后不再继续接收（位于CORS之内，413响应也带跨域头）
+app.add_middleware(UploadSizeLimitMiddleware, max_size=settings.MAX_UPLOAD_SIZE)
+
 # CORS配置
 app.add_middleware(
     CORSMiddleware,
@@ -29,11 +45,27 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    # 消息历史的翻页游标
+    expose_headers=["X-Next-Cursor", "X-Prev-Cursor"],
 )
 
 # 注册路由
 app.include_router(api_router, prefix="/api/v1")
 
+# 关闭时按注册顺序执行: 先停止后台服务、写完队列中的消息，再由 register_tortoise 关闭数据库连接，
+# 因此需要在 register_tortoise 之前注册
+@app.on_event("shutdown")
+async def shutdown():
+    # 先写完队列中的消息，再关闭推送相关的服务
+    await retention_job.stop()
+    await message_archiver.stop()
+    await message_writer.stop()
+    await unread_tracker.stop()
+    await presence_tracker.stop()
+    await typing_tracker.stop()
+    await manager.stop()
+    await search_index.close()
+
 # 数据库配置
 register_tortoise(
     app,
@@ -42,9 +74,26 @@ register_tortoise(
     add_exception_handlers=True,
 )
 
+@app.on_event("startup")
+async def startup():
+    await manager.start()
+    await search_index.setup()
+    typing_tracker.start()
+    presence_tracker.start()
+    unread_tracker.start()
+    message_writer.start()
+    message_archiver.start()
+    retention_job.start()
+
 @app.get("/")
 async def root():
     return {"message": "欢迎使用聊天室API"}
 
 if __name__ == "__main__":
-    uvicorn.run("app.main:app", host="0.0.0.0", port=8000, reload=True)
\ No newline at end of file
+    uvicorn.run(
+        "app.main:app",
+        host="0.0.0.0",
+        port=8000,
+        reload=True,
+        ws_per_message_deflate=settings.WS_PER_MESSAGE_DEFLATE
+    )
\ No newline at end of file
@@ -14,6 +14,9 @@ class ChatRoom(Model):
     updated_at = fields.DatetimeField(auto_now=True)
     announcement = fields.CharField(max_length=255, null=True)  # 添加公告字段
     announcement_updated_at = fields.DatetimeField(null=True)  # 添加公告更新时间字段
+    retention_days = fields.IntField(null=True)  # 消息保留天数，为空表示不限
+    retention_max_messages = fields.IntField(null=True)  # 最多保留的消息数，为空表示不限
+    deleted_at = fields.DatetimeField(null=True)  # 删除时间，不为空时聊天室已删除、等待后台清理
 
     class Meta:
         table = "chat_rooms"
@@ -36,6 +39,11 @@ class AnnouncementHistory(Model):
         return f"{self.room.name} - {self.content[:50]}"
 
 # 创建Pydantic模型用于API
-ChatRoom_Pydantic = pydantic_model_creator(ChatRoom, name="ChatRoom")
-ChatRoomIn_Pydantic = pydantic_model_creator(ChatRoom, name="ChatRoomIn", exclude_readonly=True)
+ChatRoom_Pydantic = pydantic_model_creator(ChatRoom, name="ChatRoom", exclude=("deleted_at",))
+ChatRoomIn_Pydantic = pydantic_model_creator(
+    ChatRoom,
+    name="ChatRoomIn",
+    exclude_readonly=True,
+    exclude=("retention_days", "retention_max_messages", "deleted_at")
+)
 AnnouncementHistory_Pydantic = pydantic_model_creator(AnnouncementHistory, name="AnnouncementHistory") 
\ No newline at end of file
@@ -10,10 +10,12 @@ class ChatRoomMember(Model):
     is_banned = fields.BooleanField(default=False)
     joined_at = fields.DatetimeField(auto_now_add=True)
     last_read_at = fields.DatetimeField(null=True)
+    last_read_message_id = fields.IntField(null=True)  # 已读水位线: 该成员读到的最后一条消息ID
 
     class Meta:
         table = "chat_room_members"
         unique_together = (("user", "room"),)  # 确保用户不能重复加入同一个聊天室
+        indexes = (("room", "last_read_message_id"),)  # 按水位线统计已读人数
 
     def __str__(self):
         return f"{self.user.username} in {self.room.name}"
@@ -0,0 +1,22 @@
+from tortoise import fields
+from tortoise.models import Model
+
+
+class ImageBlob(Model):
+    """
+    按内容寻址存储的上传图片，相同内容只保存一份
+    引用关系为 Message.image_hash，不再被任何消息引用的图片由后台任务回收
+    """
+    hash = fields.CharField(max_length=64, pk=True)  # 内容的SHA-256
+    size = fields.IntField()
+    extension = fields.CharField(max_length=16, default="")  # 首次上传时的扩展名，决定URL
+    content_type = fields.CharField(max_length=100, null=True)
+    created_at = fields.DatetimeField(auto_now_add=True)
+    last_used_at = fields.DatetimeField()  # 最近一次上传该内容的时间
+
+    class Meta:
+        table = "image_blobs"
+        table_description = "上传图片表"
+
+    def __str__(self):
+        return self.hash
@@ -4,20 +4,6 @@ from tortoise.contrib.pydantic import pydantic_model_creator
 from datetime import datetime
 
 
-class MessageRead(Model):
-    id = fields.IntField(pk=True)
-    message = fields.ForeignKeyField('models.Message', related_name='read_records')
-    user = fields.ForeignKeyField('models.User', related_name='message_reads')
-    read_at = fields.DatetimeField(auto_now_add=True)
-
-    class Meta:
-        table = "message_reads"
-        table_description = "消息已读记录表"
-
-    def __str__(self):
-        return f"{self.user.username} read message {self.message.id}"
-
-
 class Message(Model):
     id = fields.IntField(pk=True)
     room = fields.ForeignKeyField('models.ChatRoom', related_name='messages')
@@ -25,15 +11,18 @@ class Message(Model):
     content = fields.TextField()
     message_type = fields.CharField(max_length=20, default='text')  # text, image
     image_url = fields.CharField(max_length=255, null=True)  # 如果是图片消息，存储图片URL
+    image_hash = fields.CharField(max_length=64, null=True)  # 图片内容的SHA-256，引用 ImageBlob
     created_at = fields.DatetimeField(auto_now_add=True)
     updated_at = fields.DatetimeField(auto_now=True)
     recalled = fields.BooleanField(default=False)
-    read_records = fields.ReverseRelation["MessageRead"]
+    seq = fields.BigIntField(null=True)  # 聊天室内的事件序号，断线重连时按序号补发
 
     class Meta:
         table = "messages"
         table_description = "消息表"
         ordering = ["-created_at"]  # 按时间倒序排列
+        # 按聊天室键集分页 / 按序号补发 / 按已读水位线统计未读数 / 回收图片时查找引用
+        indexes = (("room", "created_at", "id"), ("room", "seq"), ("room", "id"), ("image_hash",))
 
     def __str__(self):
         return f"{self.sender.username}: {self.content[:50]}"
@@ -41,5 +30,5 @@ class Message(Model):
 
 # 创建Pydantic模型用于API
 Message_Pydantic = pydantic_model_creator(Message, name="Message")
-MessageIn_Pydantic = pydantic_model_creator(Message, name="MessageIn", exclude_readonly=True)
-MessageRead_Pydantic = pydantic_model_creator(MessageRead, name="MessageRead") 
\ No newline at end of file
+# 序号和图片哈希由服务端生成，不接受客户端传入
+MessageIn_Pydantic = pydantic_model_creator(Message, name="MessageIn", exclude_readonly=True, exclude=("seq", "image_hash"))
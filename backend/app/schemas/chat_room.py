@@ -0,0 +1,7 @@
+from pydantic import BaseModel, Field
+from typing import Optional
+
+class RetentionPolicy(BaseModel):
+    # 为空表示不限；超出的消息由后台任务分批删除
+    retention_days: Optional[int] = Field(None, ge=1)
+    retention_max_messages: Optional[int] = Field(None, ge=1)
@@ -0,0 +1,28 @@
+from pydantic import BaseModel
+from datetime import datetime
+from typing import Dict, List, Optional
+
+class UserProfile(BaseModel):
+    id: int
+    username: str
+    avatar: Optional[str] = None
+
+class MessageOut(BaseModel):
+    id: int
+    room_id: int
+    sender_id: int
+    content: str
+    message_type: str
+    image_url: Optional[str] = None
+    created_at: datetime
+    updated_at: datetime
+    recalled: bool
+    seq: Optional[int] = None
+
+class MessageHistory(BaseModel):
+    messages: List[MessageOut]
+    # 本页消息发送者的资料（去重）: user_id -> 资料
+    users: Dict[int, UserProfile]
+
+class ReadMark(BaseModel):
+    message_id: int
@@ -0,0 +1,372 @@
+import asyncio
+import contextlib
+import gzip
+import logging
+import os
+from datetime import datetime, timezone
+from typing import AsyncIterator, Dict, Iterator, List, NamedTuple, Optional, Tuple
+import orjson
+from tortoise.transactions import in_transaction
+from app.core.config import settings
+from app.crud import partitions
+from app.crud.message import get_messages_page
+from app.services.message_cache import CachedMessage, _aware, serialize_message
+
+logger = logging.getLogger(__name__)
+
+DATA_SUFFIX = ".ndjson.gz"
+MANIFEST_SUFFIX = ".manifest.json"
+
+# 每个gzip块最多包含的消息数，读取时只解压需要的块
+CHUNK_ROWS = 1000
+# 导出时每次从数据库读取的行数
+EXPORT_BATCH_SIZE = 10_000
+
+# 键集分页的位置: (created_at, message_id)
+Position = Tuple[datetime, int]
+
+
+def _position(value: list) -> Position:
+    return _aware(datetime.fromisoformat(value[0])), value[1]
+
+
+class ArchiveChunk(NamedTuple):
+    offset: int
+    length: int
+    first: Position
+    last: Position
+
+
+class ArchivedMonth:
+    """
+    一个已归档的月分区
+    """
+
+    __slots__ = ("start", "end", "path", "rooms")
+
+    def __init__(self, directory: str, manifest: dict):
+        self.start = datetime.fromisoformat(manifest["start"])
+        self.end = datetime.fromisoformat(manifest["end"])
+        self.path = os.path.join(directory, manifest["file"])
+        self.rooms: Dict[int, List[ArchiveChunk]] = {
+            int(room_id): [
+                ArchiveChunk(offset, length, _position(first), _position(last))
+                for offset, length, first, last in chunks
+            ]
+            for room_id, chunks in manifest["rooms"].items()
+        }
+
+
+class ArchiveWriter:
+    """
+    将一个分区的消息写入归档文件（同步接口，在线程中调用）
+
+    消息需按 (room_id, created_at, id) 顺序写入。每个聊天室每 CHUNK_ROWS 条消息压缩为
+    一个独立的gzip块，整个文件仍是合法的gzip，可以直接用 zcat 读取全部 NDJSON。
+    数据文件写完后再写清单，清单出现后归档才对读取可见
+    """
+
+    def __init__(self, directory: str, partition: str, start: datetime, end: datetime):
+        os.makedirs(directory, exist_ok=True)
+        self.directory = directory
+        self.partition = partition
+        self.start = start
+        self.end = end
+        self.file_name = partition + DATA_SUFFIX
+        self.path = os.path.join(directory, self.file_name)
+        self.file = open(self.path + ".tmp", "wb")
+        self.rooms: Dict[int, list] = {}
+        self.rows = 0
+        self.room_id: Optional[int] = None
+        self.lines: List[bytes] = []
+        self.first: Optional[list] = None
+        self.last: Optional[list] = None
+
+    def add(self, rows: List[dict]):
+        for row in rows:
+            if row["room_id"] != self.room_id or len(self.lines) >= CHUNK_ROWS:
+                self._write_chunk()
+                self.room_id = row["room_id"]
+            position = [_aware(row["created_at"]).isoformat(), row["id"]]
+            if not self.lines:
+                self.first = position
+            self.last = position
+            # 每行与消息历史接口中的单条消息格式一致，读取时可直接返回
+            self.lines.append(orjson.dumps(row))
+        self.rows += len(rows)
+
+    def _write_chunk(self):
+        if not self.lines:
+            return
+        # 固定mtime，重复导出同一分区得到完全相同的文件
+        data = gzip.compress(b"\n".join(self.lines) + b"\n", mtime=0)
+        self.rooms.setdefault(self.room_id, []).append([self.file.tell(), len(data), self.first, self.last])
+        self.file.write(data)
+        self.lines = []
+
+    def commit(self):
+        self._write_chunk()
+        self.file.flush()
+        os.fsync(self.file.fileno())
+        self.file.close()
+        os.replace(self.path + ".tmp", self.path)
+        manifest = {
+            "partition": self.partition,
+            "start": self.start.isoformat(),
+            "end": self.end.isoformat(),
+            "file": self.file_name,
+            "rows": self.rows,
+            "rooms": self.rooms
+        }
+        manifest_path = os.path.join(self.directory, self.partition + MANIFEST_SUFFIX)
+        with open(manifest_path + ".tmp", "wb") as f:
+            f.write(orjson.dumps(manifest, option=orjson.OPT_NON_STR_KEYS))
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(manifest_path + ".tmp", manifest_path)
+
+    def abort(self):
+        self.file.close()
+        with contextlib.suppress(FileNotFoundError):
+            os.remove(self.path + ".tmp")
+
+
+class MessageArchive:
+    """
+    已归档消息的读取
+
+    归档目录中每个分区对应一个数据文件和一个清单，清单记录每个聊天室各gzip块的偏移和首尾位置，
+    读取时只解压与请求范围相交的块。目录有变化时（其它worker完成归档）重新加载清单
+    """
+
+    def __init__(self, directory: str):
+        self.directory = directory
+        self.months: List[ArchivedMonth] = []  # 按时间升序
+        self.mtime: Optional[int] = None
+
+    def _load(self) -> List[ArchivedMonth]:
+        months = []
+        for name in os.listdir(self.directory):
+            if name.endswith(MANIFEST_SUFFIX):
+                with open(os.path.join(self.directory, name), "rb") as f:
+                    months.append(ArchivedMonth(self.directory, orjson.loads(f.read())))
+        months.sort(key=lambda month: month.start)
+        return months
+
+    async def _months(self) -> List[ArchivedMonth]:
+        try:
+            mtime = os.stat(self.directory).st_mtime_ns
+        except FileNotFoundError:
+            return []
+        if mtime != self.mtime:
+            self.months = await asyncio.to_thread(self._load)
+            self.mtime = mtime
+        return self.months
+
+    async def horizon(self) -> Optional[datetime]:
+        """
+        已归档范围的结束时间，早于该时间的消息都在归档中
+        """
+        months = await self._months()
+        return months[-1].end if months else None
+
+    @staticmethod
+    def _read_chunk(path: str, chunk: ArchiveChunk) -> List[CachedMessage]:
+        with open(path, "rb") as f:
+            f.seek(chunk.offset)
+            data = f.read(chunk.length)
+        items = []
+        for line in gzip.decompress(data).split(b"\n"):
+            if line:
+                row = orjson.loads(line)
+                items.append((_aware(datetime.fromisoformat(row["created_at"])), row["id"], row["sender_id"], line))
+        return items
+
+    @staticmethod
+    def _chunks(months: List[ArchivedMonth], room_id: int, newest_first: bool) -> Iterator[Tuple[str, ArchiveChunk]]:
+        for month in reversed(months) if newest_first else months:
+            chunks = month.rooms.get(room_id, ())
+            for chunk in reversed(chunks) if newest_first else chunks:
+                yield month.path, chunk
+
+    async def get_page(
+        self,
+        room_id: int,
+        limit: int,
+        before: Optional[Position] = None,
+        after: Optional[Position] = None
+    ) -> List[CachedMessage]:
+        """
+        按 (created_at, id) 键集分页读取已归档的消息，参数与 get_messages_page 相同，结果按时间倒序
+        """
+        items: List[CachedMessage] = []
+        if limit <= 0:
+            return items
+        months = await self._months()
+        if after is not None:
+            for path, chunk in self._chunks(months, room_id, newest_first=False):
+                if chunk.last <= after:
+                    continue
+                rows = await asyncio.to_thread(self._read_chunk, path, chunk)
+                items.extend(item for item in rows if item[:2] > after)
+                if len(items) >= limit:
+                    break
+            items = items[:limit]
+            items.reverse()
+        else:
+            for path, chunk in self._chunks(months, room_id, newest_first=True):
+                if before is not None and chunk.first >= before:
+                    continue
+                rows = await asyncio.to_thread(self._read_chunk, path, chunk)
+                items.extend(item for item in reversed(rows) if before is None or item[:2] < before)
+                if len(items) >= limit:
+                    break
+            items = items[:limit]
+        return items
+
+    async def iter_room(
+        self,
+        room_id: int,
+        since: Optional[datetime] = None,
+        until: Optional[datetime] = None,
+        after: Optional[Position] = None
+    ) -> AsyncIterator[List[CachedMessage]]:
+        """
+        按时间顺序逐块读取聊天室已归档的消息（导出用），一次只解压一个块
+        """
+        for path, chunk in self._chunks(await self._months(), room_id, newest_first=False):
+            if (after is not None and chunk.last <= after) or (since is not None and chunk.last[0] < since):
+                continue
+            if until is not None and chunk.first[0] >= until:
+                return
+            items = [
+                item for item in await asyncio.to_thread(self._read_chunk, path, chunk)
+                if (after is None or item[:2] > after)
+                and (since is None or item[0] >= since)
+                and (until is None or item[0] < until)
+            ]
+            if items:
+                yield items
+
+    async def extend(self, room_id: int, items: List[CachedMessage], limit: int, before: Optional[Position] = None) -> List[CachedMessage]:
+        """
+        数据库中的消息不足一页时，继续从归档中读取更早的消息
+        """
+        if len(items) >= limit:
+            return items
+        boundary = items[-1][:2] if items else before
+        return items + await self.get_page(room_id, limit - len(items), before=boundary)
+
+
+message_archive = MessageArchive(settings.MESSAGE_ARCHIVE_DIR)
+
+
+async def get_history_page(
+    room_id: int,
+    limit: int,
+    before: Optional[Position] = None,
+    after: Optional[Position] = None
+) -> List[CachedMessage]:
+    """
+    按游标获取一页消息历史，按时间倒序
+    数据库中只有未归档的分区，更早的范围透明地从归档读取
+    """
+    if after is not None:
+        horizon = await message_archive.horizon()
+        if horizon is not None and after[0] < horizon:
+            items = await message_archive.get_page(room_id, limit, after=after)
+            if len(items) < limit:
+                # 数据库中只取比归档中最新一条更新的消息，分区分离前也不会重复
+                newest = items[0][:2] if items else after
+                messages = await get_messages_page(room_id, limit - len(items), after=newest)
+                items = [serialize_message(message) for message in messages] + items
+            return items
+        messages = await get_messages_page(room_id, limit, after=after)
+        return [serialize_message(message) for message in messages]
+    messages = await get_messages_page(room_id, limit, before=before)
+    return await message_archive.extend(room_id, [serialize_message(message) for message in messages], limit, before)
+
+
+class MessageArchiver:
+    """
+    消息分区维护（仅在消息表已改为分区表时生效）
+
+    - 提前创建当前月及之后 premake 个月的分区
+    - 结束时间早于 archive_after_months 个月前的分区: 导出到归档目录，写入清单后从消息表分离并删除
+    导出期间锁定该分区的写入，归档内容与分离时的数据一致；
+    分离前中断时归档已可见但分区仍在，下次重新导出得到相同的文件
+    """
+
+    def __init__(self, archive: MessageArchive, premake: int, archive_after_months: int, interval: float):
+        self.archive = archive
+        self.premake = premake
+        self.archive_after_months = archive_after_months
+        self.interval = interval
+        self.task: Optional[asyncio.Task] = None
+
+    def start(self):
+        self.task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self.task is not None:
+            self.task.cancel()
+            await asyncio.gather(self.task, return_exceptions=True)
+            self.task = None
+
+    async def run_once(self):
+        if not await partitions.is_partitioned():
+            return
+        current = partitions.month_start(datetime.now(timezone.utc))
+        await partitions.ensure_partitions(partitions.add_months(current, i) for i in range(self.premake + 1))
+
+        if self.archive_after_months <= 0:
+            return
+        cutoff = partitions.add_months(current, -self.archive_after_months)
+        for name, month in await partitions.list_partitions():
+            if partitions.add_months(month, 1) <= cutoff:
+                await self.archive_partition(name, month)
+
+    async def archive_partition(self, name: str, month: datetime) -> bool:
+        """
+        导出并分离一个分区，其它worker正在维护分区时返回False
+        """
+        async with in_transaction() as connection:
+            if not await partitions.try_lock(connection):
+                return False
+            await partitions.lock_partition(connection, name)
+            writer = await asyncio.to_thread(
+                ArchiveWriter, self.archive.directory, name, month, partitions.add_months(month, 1)
+            )
+            try:
+                after = None
+                while True:
+                    rows = await partitions.fetch_partition_rows(connection, name, EXPORT_BATCH_SIZE, after)
+                    if not rows:
+                        break
+                    await asyncio.to_thread(writer.add, rows)
+                    last = rows[-1]
+                    after = (last["room_id"], last["created_at"], last["id"])
+                await asyncio.to_thread(writer.commit)
+            except BaseException:
+                await asyncio.to_thread(writer.abort)
+                raise
+            await partitions.detach_partition(connection, name)
+        await partitions.drop_partition(name)
+        logger.info("分区已归档: %s，%s 条消息", name, writer.rows)
+        return True
+
+    async def _run(self):
+        while True:
+            try:
+                await self.run_once()
+            except Exception:
+                logger.exception("消息分区维护失败")
+            await asyncio.sleep(self.interval)
+
+
+message_archiver = MessageArchiver(
+    message_archive,
+    settings.MESSAGE_PARTITION_PREMAKE,
+    settings.MESSAGE_ARCHIVE_AFTER_MONTHS,
+    settings.MESSAGE_ARCHIVE_INTERVAL
+)
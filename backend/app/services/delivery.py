@@ -0,0 +1,15 @@
+from app.core.websocket import manager
+from app.models.message import Message
+from app.models.user import User
+from app.services.message_cache import message_cache
+from app.services.replay import message_event
+from app.services.unread import unread_tracker
+
+
+async def deliver_message(message: Message, sender: User):
+    """
+    消息提交后的推送: 写入最近消息缓存、累加未读数、广播到聊天室
+    """
+    await message_cache.add(message)
+    await unread_tracker.on_message(message)
+    await manager.broadcast_to_room(message.room_id, message_event(message, sender.username))
@@ -0,0 +1,64 @@
+import zlib
+from datetime import datetime
+from typing import AsyncIterator, List, Optional, Tuple
+import orjson
+from app.core.pagination import encode_cursor
+from app.crud.message import iter_messages
+from app.services.archive import message_archive
+from app.services.message_cache import _aware
+
+# 每次从数据库游标读取的行数
+EXPORT_BATCH_SIZE = 1000
+# 累积到该字节数后发送一次
+EXPORT_FLUSH_BYTES = 64 * 1024
+
+
+def _line(data: bytes, created_at: datetime, message_id: int) -> bytes:
+    # 每行附带该消息的游标，导出中断后以最后一行的 cursor 作为 after 参数继续
+    return data[:-1] + b',"cursor":"' + encode_cursor(created_at, message_id).encode() + b'"}\n'
+
+
+async def _lines(
+    room_id: int,
+    since: Optional[datetime],
+    until: Optional[datetime],
+    after: Optional[Tuple[datetime, int]]
+) -> AsyncIterator[List[bytes]]:
+    # 先读归档，数据库中只取归档之后的消息
+    async for items in message_archive.iter_room(room_id, since, until, after):
+        yield [_line(data, created_at, message_id) for created_at, message_id, _, data in items]
+        after = items[-1][:2]
+    async for rows in iter_messages(room_id, EXPORT_BATCH_SIZE, since, until, after):
+        yield [_line(orjson.dumps(row), _aware(row["created_at"]), row["id"]) for row in rows]
+
+
+async def export_room(
+    room_id: int,
+    since: Optional[datetime] = None,
+    until: Optional[datetime] = None,
+    after: Optional[Tuple[datetime, int]] = None,
+    compress: bool = False
+) -> AsyncIterator[bytes]:
+    """
+    按时间顺序导出聊天室的消息（包括已归档的部分），每条消息一行JSON
+    逐批读取、逐批发送，compress 时输出gzip流
+    """
+    since = _aware(since) if since is not None else None
+    until = _aware(until) if until is not None else None
+    compressor = zlib.compressobj(wbits=31) if compress else None
+    buffer = bytearray()
+    async for lines in _lines(room_id, since, until, after):
+        for line in lines:
+            buffer += line
+        if len(buffer) >= EXPORT_FLUSH_BYTES:
+            data = bytes(buffer)
+            buffer.clear()
+            if compressor is not None:
+                data = compressor.compress(data)
+            if data:
+                yield data
+    data = bytes(buffer)
+    if compressor is not None:
+        data = compressor.compress(data) + compressor.flush()
+    if data:
+        yield data
@@ -0,0 +1,187 @@
+import time
+from datetime import datetime, timezone
+from typing import AsyncIterable, AsyncIterator, Dict, List, Optional, Set, Tuple
+import orjson
+from app.core.config import settings
+from app.crud import partitions
+from app.crud.message import create_messages
+from app.models.message import Message
+from app.models.user import User
+from app.services.archive import message_archive
+from app.services.message_cache import _aware, message_cache
+from app.services.search import search_index
+
+MESSAGE_TYPES = {"text", "image"}
+
+
+async def iter_lines(chunks: AsyncIterable[bytes]) -> AsyncIterator[bytes]:
+    """
+    将字节流切分为行
+    """
+    pending = b""
+    async for chunk in chunks:
+        pending += chunk
+        *lines, pending = pending.split(b"\n")
+        for line in lines:
+            yield line
+    if pending:
+        yield pending
+
+
+class MessageIngest:
+    """
+    向一个聊天室批量导入历史消息
+
+    输入为 NDJSON，每行一条消息:
+        {"sender_id": 1 或 "username": "...", "content": "...", "message_type": "text",
+         "image_url": null, "created_at": "2020-01-01T00:00:00+00:00", "recalled": false}
+    每 batch_size 行为一批: 一次查询校验本批中未见过的发送者，再用 create_messages（COPY）写入。
+    导入的消息不推送、不分配聊天室序号（不会被断线重连补发），每批单独提交
+    """
+
+    def __init__(self, room_id: int, batch_size: int, max_errors: int):
+        self.room_id = room_id
+        self.batch_size = batch_size
+        self.max_errors = max_errors
+        self.batch: List[Tuple[int, dict]] = []  # (行号, 解析后的消息)
+        self.sender_ids: Set[int] = set()  # 已确认存在的用户
+        self.usernames: Dict[str, int] = {}  # 已确认存在的用户名 -> user_id
+        self.months: Set[datetime] = set()  # 已确认存在的月分区
+        self.partitioned = False
+        self.horizon: Optional[datetime] = None
+        self.now = datetime.now(timezone.utc)
+        self.accepted = 0
+        self.rejected = 0
+        self.errors: List[dict] = []
+
+    def reject(self, line_no: int, reason: str):
+        self.rejected += 1
+        if len(self.errors) < self.max_errors:
+            self.errors.append({"line": line_no, "error": reason})
+
+    def parse(self, line: bytes) -> dict:
+        try:
+            data = orjson.loads(line)
+        except orjson.JSONDecodeError:
+            raise ValueError("不是合法的JSON")
+        if not isinstance(data, dict):
+            raise ValueError("每行应为一个JSON对象")
+
+        sender_id = data.get("sender_id")
+        username = data.get("username")
+        if not isinstance(sender_id, int) and not isinstance(username, str):
+            raise ValueError("缺少 sender_id 或 username")
+        content = data.get("content")
+        if not isinstance(content, str) or not content:
+            raise ValueError("content 不能为空")
+        message_type = data.get("message_type", "text")
+        if message_type not in MESSAGE_TYPES:
+            raise ValueError(f"无效的 message_type: {message_type}")
+        image_url = data.get("image_url")
+        if image_url is not None and (not isinstance(image_url, str) or len(image_url) > 255):
+            raise ValueError("无效的 image_url")
+
+        created_at = data.get("created_at")
+        if created_at is None:
+            created_at = self.now
+        else:
+            try:
+                created_at = _aware(datetime.fromisoformat(created_at))
+            except (TypeError, ValueError):
+                raise ValueError("无效的 created_at")
+            if created_at > self.now:
+                raise ValueError("created_at 不能晚于当前时间")
+            if self.horizon is not None and created_at < self.horizon:
+                raise ValueError("created_at 早于已归档的范围")
+
+        return {
+            "sender_id": sender_id if isinstance(sender_id, int) else None,
+            "username": username,
+            "content": content,
+            "message_type": message_type,
+            "image_url": image_url,
+            "created_at": created_at,
+            "recalled": bool(data.get("recalled", False))
+        }
+
+    async def _resolve_senders(self):
+        ids = {row["sender_id"] for _, row in self.batch if row["sender_id"] is not None} - self.sender_ids
+        if ids:
+            self.sender_ids.update(await User.filter(id__in=ids).values_list("id", flat=True))
+        names = {row["username"] for _, row in self.batch if row["sender_id"] is None} - self.usernames.keys()
+        if names:
+            self.usernames.update(await User.filter(username__in=names).values_list("username", "id"))
+
+    async def flush(self):
+        if not self.batch:
+            return
+        await self._resolve_senders()
+        messages: List[Message] = []
+        for line_no, row in self.batch:
+            if row["sender_id"] is not None:
+                sender_id = row["sender_id"] if row["sender_id"] in self.sender_ids else None
+            else:
+                sender_id = self.usernames.get(row["username"])
+            if sender_id is None:
+                self.reject(line_no, "发送者不存在")
+                continue
+            messages.append(Message(
+                room_id=self.room_id,
+                sender_id=sender_id,
+                content=row["content"],
+                message_type=row["message_type"],
+                image_url=row["image_url"],
+                created_at=row["created_at"],
+                updated_at=row["created_at"],
+                recalled=row["recalled"]
+            ))
+        self.batch = []
+        if not messages:
+            return
+
+        if self.partitioned:
+            months = {partitions.month_start(message.created_at) for message in messages} - self.months
+            if months:
+                await partitions.ensure_partitions(months)
+                self.months |= months
+        await create_messages(messages)
+        await search_index.index(messages)
+        self.accepted += len(messages)
+
+    async def run(self, chunks: AsyncIterable[bytes]) -> dict:
+        started = time.perf_counter()
+        self.partitioned = await partitions.is_partitioned()
+        self.horizon = await message_archive.horizon()
+        line_no = 0
+        try:
+            async for line in iter_lines(chunks):
+                line_no += 1
+                if not line.strip():
+                    continue
+                try:
+                    self.batch.append((line_no, self.parse(line)))
+                except ValueError as e:
+                    self.reject(line_no, str(e))
+                    continue
+                if len(self.batch) >= self.batch_size:
+                    await self.flush()
+            await self.flush()
+        finally:
+            if self.accepted:
+                await message_cache.invalidate(self.room_id)
+        seconds = time.perf_counter() - started
+        return {
+            "accepted": self.accepted,
+            "rejected": self.rejected,
+            "errors": sorted(self.errors, key=lambda error: error["line"]),
+            "seconds": round(seconds, 3),
+            "rows_per_second": round(self.accepted / seconds) if seconds > 0 else self.accepted
+        }
+
+
+async def ingest_messages(room_id: int, chunks: AsyncIterable[bytes]) -> dict:
+    """
+    批量导入消息，返回导入条数、拒绝条数、错误明细和吞吐量
+    """
+    ingest = MessageIngest(room_id, settings.INGEST_BATCH_SIZE, settings.INGEST_MAX_ERRORS)
+    return await ingest.run(chunks)
@@ -0,0 +1,175 @@
+import sys
+from collections import OrderedDict
+from datetime import datetime, timezone
+from typing import Dict, List, Optional, Tuple
+import orjson
+from app.core.config import settings
+from app.core.websocket import ConnectionManager, manager
+from app.models.message import Message
+
+# 缓存条目: (created_at, message_id, sender_id, 序列化后的JSON)
+CachedMessage = Tuple[datetime, int, int, bytes]
+
+
+def _aware(value: datetime) -> datetime:
+    # 数据库可能返回不带时区的时间（UTC），统一后才能比较
+    return value if value.tzinfo is not None else value.replace(tzinfo=timezone.utc)
+
+
+def history_item(message: Message) -> dict:
+    """
+    消息历史接口中单条消息的格式（与 MessageOut 一致），发送者资料另行返回
+    """
+    return {
+        "id": message.id,
+        "room_id": message.room_id,
+        "sender_id": message.sender_id,
+        "content": message.content,
+        "message_type": message.message_type,
+        "image_url": message.image_url,
+        "created_at": message.created_at,
+        "updated_at": message.updated_at,
+        "recalled": message.recalled,
+        "seq": message.seq
+    }
+
+
+def serialize_message(message: Message) -> CachedMessage:
+    return _aware(message.created_at), message.id, message.sender_id, orjson.dumps(history_item(message))
+
+
+class RoomMessages:
+    """
+    单个聊天室的最近消息，按 (created_at, id) 从新到旧排列
+    complete 表示聊天室的消息总数不超过缓存条数，缓存即全部消息
+    """
+
+    __slots__ = ("items", "complete", "size")
+
+    def __init__(self, items: List[CachedMessage], complete: bool):
+        self.items = items
+        self.complete = complete
+        self.size = sum(sys.getsizeof(item[-1]) for item in items)
+
+
+class RecentMessageCache:
+    """
+    热门聊天室最近消息缓存
+
+    每个聊天室保存最新 per_room 条已序列化的消息，按聊天室LRU淘汰，总字节数不超过 max_bytes。
+    新消息和撤回/删除经消息总线的 message_cache 频道通知所有worker，
+    各worker只更新已缓存的聊天室，未缓存的聊天室在下次读取时从数据库加载。
+    """
+
+    CHANNEL = "message_cache"
+
+    def __init__(self, connection_manager: ConnectionManager, per_room: int, max_bytes: int):
+        self.manager = connection_manager
+        self.per_room = per_room
+        self.max_bytes = max_bytes
+        self.rooms: "OrderedDict[int, RoomMessages]" = OrderedDict()
+        self.bytes = 0
+        # 正在从数据库加载的聊天室 -> 加载期间收到的事件数，有事件时放弃写入缓存
+        self.loading: Dict[int, int] = {}
+        self.hits = 0
+        self.misses = 0
+        connection_manager.register_channel(self.CHANNEL, self._on_event)
+
+    def get_page(self, room_id: int, limit: int) -> Optional[List[CachedMessage]]:
+        """
+        取聊天室最新一页，缓存不能覆盖时返回None
+        """
+        room = self.rooms.get(room_id)
+        if room is None or (len(room.items) < limit and not room.complete):
+            self.misses += 1
+            return None
+        self.rooms.move_to_end(room_id)
+        self.hits += 1
+        return room.items[:limit]
+
+    def begin_load(self, room_id: int) -> int:
+        return self.loading.setdefault(room_id, 0)
+
+    def fill(self, room_id: int, token: int, messages: List[Message]) -> List[CachedMessage]:
+        """
+        用数据库中最新的消息（从新到旧，至少 per_room 条）建立缓存，返回序列化后的条目
+        加载期间聊天室有新事件时不写入缓存，避免缓存缺少这些事件
+        """
+        items = [serialize_message(message) for message in messages]
+        if self.loading.pop(room_id, None) == token and self.per_room > 0:
+            self._store(room_id, RoomMessages(items[:self.per_room], len(items) < self.per_room))
+        return items
+
+    def _store(self, room_id: int, room: RoomMessages):
+        self._discard(room_id)
+        self.rooms[room_id] = room
+        self.bytes += room.size
+        self._evict()
+
+    def _evict(self):
+        while self.bytes > self.max_bytes and self.rooms:
+            _, evicted = self.rooms.popitem(last=False)
+            self.bytes -= evicted.size
+
+    def _discard(self, room_id: int):
+        room = self.rooms.pop(room_id, None)
+        if room is not None:
+            self.bytes -= room.size
+
+    async def add(self, message: Message):
+        """
+        新消息写入后调用（写穿）
+        """
+        await self.manager.publish(self.CHANNEL, {
+            "op": "add",
+            "room_id": message.room_id,
+            "message": history_item(message)
+        })
+
+    async def invalidate(self, room_id: int):
+        """
+        撤回、删除消息或删除聊天室后调用
+        """
+        await self.manager.publish(self.CHANNEL, {"op": "invalidate", "room_id": room_id})
+
+    def _on_event(self, frame: str):
+        event = orjson.loads(frame)
+        room_id = event["room_id"]
+        if room_id in self.loading:
+            self.loading[room_id] += 1
+        if event["op"] == "invalidate":
+            self._discard(room_id)
+            return
+        room = self.rooms.get(room_id)
+        if room is None:
+            return
+        message = event["message"]
+        data = orjson.dumps(message)
+        item = (_aware(datetime.fromisoformat(message["created_at"])), message["id"], message["sender_id"], data)
+        # 通常插入在最前面；先分配时间戳的消息可能稍晚提交
+        position = 0
+        while position < len(room.items) and room.items[position][:2] > item[:2]:
+            position += 1
+        room.items.insert(position, item)
+        room.size += sys.getsizeof(data)
+        self.bytes += sys.getsizeof(data)
+        if len(room.items) > self.per_room:
+            dropped = room.items.pop()[-1]
+            room.size -= sys.getsizeof(dropped)
+            self.bytes -= sys.getsizeof(dropped)
+            room.complete = False
+        self._evict()
+
+    def get_stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return {
+            "rooms": len(self.rooms),
+            "bytes": self.bytes,
+            "max_bytes": self.max_bytes,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+        }
+
+
+message_cache = RecentMessageCache(manager, settings.MESSAGE_CACHE_PER_ROOM, settings.MESSAGE_CACHE_MAX_BYTES)
@@ -0,0 +1,158 @@
+import asyncio
+import logging
+from typing import Dict, List, Optional, Tuple
+from tortoise import timezone
+from app.core.config import settings
+from app.core.sequence import room_sequencer
+from app.crud.message import create_messages
+from app.models.message import Message
+from app.services.search import search_index
+
+logger = logging.getLogger(__name__)
+
+# 停止信号
+_STOP = object()
+
+
+class MessageWriter:
+    """
+    消息写后批量持久化
+
+    WebSocket收到的消息先进入有界队列（入队时确定时间戳），后台任务按数量或时间
+    触发批量写入：PostgreSQL上一次取号加一条COPY，其它数据库一个事务。
+    submit 返回的 future 在该批次提交后才完成，调用方以此作为确认发送方的时机，
+    未收到确认的消息由客户端重发。停止时会先写完队列中的所有消息。
+    """
+
+    def __init__(self, batch_size: int, flush_interval: float, max_queue: int):
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.queue: asyncio.Queue = asyncio.Queue(maxsize=max_queue)
+        self.task: Optional[asyncio.Task] = None
+        self.closing = False
+        self.stats = {
+            "flushed_batches": 0,
+            "flushed_messages": 0,
+            "failed_messages": 0,
+        }
+
+    def start(self):
+        self.closing = False
+        self.task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        """
+        停止接收新消息，等待队列中的消息全部写入
+        """
+        if self.task is None:
+            return
+        self.closing = True
+        await self.queue.put(_STOP)
+        await self.task
+        self.task = None
+
+    async def submit(
+        self,
+        room_id: int,
+        sender_id: int,
+        content: str,
+        message_type: str = "text",
+        image_url: Optional[str] = None
+    ) -> asyncio.Future:
+        """
+        将消息放入写入队列，队列满时等待（背压）
+        返回的 future 在消息提交到数据库后得到 Message 对象
+        """
+        if self.closing or self.task is None:
+            raise RuntimeError("消息写入服务未运行")
+        now = timezone.now()
+        message = Message(
+            room_id=room_id,
+            sender_id=sender_id,
+            content=content,
+            message_type=message_type,
+            image_url=image_url,
+            created_at=now,
+            updated_at=now,
+            recalled=False
+        )
+        future = asyncio.get_running_loop().create_future()
+        await self.queue.put((message, future))
+        return future
+
+    async def _run(self):
+        stopping = False
+        while not stopping:
+            item = await self.queue.get()
+            if item is _STOP:
+                break
+            batch: List[Tuple[Message, asyncio.Future]] = [item]
+            # 队列里不够一批时等待一个时间窗口，让更多消息进入同一批
+            if self.queue.qsize() < self.batch_size - 1:
+                await asyncio.sleep(self.flush_interval)
+            while len(batch) < self.batch_size and not self.queue.empty():
+                item = self.queue.get_nowait()
+                if item is _STOP:
+                    stopping = True
+                    break
+                batch.append(item)
+            await self._flush(batch)
+
+        # 写完停止信号之后仍在队列中的消息
+        remaining = []
+        while not self.queue.empty():
+            item = self.queue.get_nowait()
+            if item is not _STOP:
+                remaining.append(item)
+        for start in range(0, len(remaining), self.batch_size):
+            await self._flush(remaining[start:start + self.batch_size])
+
+    async def _assign_seq(self, messages: List[Message]):
+        """
+        按聊天室分组，每个聊天室一次取出该批需要的全部序号
+        """
+        rooms: Dict[int, List[Message]] = {}
+        for message in messages:
+            rooms.setdefault(message.room_id, []).append(message)
+        for room_id, room_messages in rooms.items():
+            last_seq = await room_sequencer.allocate(room_id, len(room_messages))
+            first_seq = last_seq - len(room_messages) + 1
+            for offset, message in enumerate(room_messages):
+                message.seq = first_seq + offset
+
+    async def _flush(self, batch: List[Tuple[Message, asyncio.Future]]):
+        messages = [message for message, _ in batch]
+        try:
+            await self._assign_seq(messages)
+            await create_messages(messages)
+        except Exception as e:
+            logger.exception("批量写入 %d 条消息失败", len(batch))
+            self.stats["failed_messages"] += len(batch)
+            for _, future in batch:
+                if not future.done():
+                    future.set_exception(e)
+                    future.exception()
+            return
+        self.stats["flushed_batches"] += 1
+        self.stats["flushed_messages"] += len(batch)
+        for message, future in batch:
+            if not future.done():
+                future.set_result(message)
+        try:
+            # 消息已提交，索引失败只影响搜索
+            await search_index.index(messages)
+        except Exception:
+            logger.exception("更新全文索引失败")
+
+    def get_stats(self) -> dict:
+        return {
+            **self.stats,
+            "queued": self.queue.qsize(),
+        }
+
+
+message_writer = MessageWriter(
+    settings.MESSAGE_WRITER_BATCH_SIZE,
+    settings.MESSAGE_WRITER_FLUSH_INTERVAL,
+    settings.MESSAGE_WRITER_QUEUE_SIZE
+)
@@ -0,0 +1,138 @@
+import asyncio
+import logging
+import time
+import uuid
+from typing import Dict, Optional, Set, Tuple
+import orjson
+from app.core.config import settings
+from app.core.websocket import ConnectionManager, manager
+
+logger = logging.getLogger(__name__)
+
+
+class PresenceTracker:
+    """
+    聊天室在线成员
+
+    每个worker从连接管理器得知本地用户进入/离开聊天室，经消息总线的
+    presence:{room_id} 频道通知其它worker；每个有本地成员的worker都维护
+    room_id -> worker_id -> 在线用户 的完整视图，客户端查询时无需访问数据库。
+
+    - worker首次有本地成员时发布 sync，其它worker回复各自的快照
+    - 各worker定期发布快照，超过三个周期未刷新的worker视为已下线
+    - 用户在整个集群中上线/下线时，向本地成员推送 presence 事件
+    """
+
+    def __init__(self, connection_manager: ConnectionManager, refresh_interval: float):
+        self.manager = connection_manager
+        self.refresh_interval = refresh_interval
+        self.worker_id = uuid.uuid4().hex
+        self.rooms: Dict[int, Dict[str, Tuple[Set[int], float]]] = {}  # room_id -> {worker_id -> (user_ids, 刷新时间)}
+        self.task: Optional[asyncio.Task] = None
+        connection_manager.register_room_channel("presence", self._on_event)
+        connection_manager.add_presence_listener(self._on_local_change)
+
+    def start(self):
+        self.task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self.task is not None:
+            self.task.cancel()
+            await asyncio.gather(self.task, return_exceptions=True)
+            self.task = None
+
+    def get_online_user_ids(self, room_id: int) -> Set[int]:
+        # 本worker的变化经消息总线回传前，以本地连接为准
+        return self.manager.get_room_user_ids(room_id) | self._known_user_ids(room_id)
+
+    def _known_user_ids(self, room_id: int) -> Set[int]:
+        online: Set[int] = set()
+        for user_ids, _ in self.rooms.get(room_id, {}).values():
+            online |= user_ids
+        return online
+
+    def get_state(self, room_id: int) -> dict:
+        return {
+            "type": "presence_state",
+            "room_id": room_id,
+            "user_ids": sorted(self.get_online_user_ids(room_id))
+        }
+
+    def _on_local_change(self, room_id: int, user_id: int, online: bool):
+        if online and room_id not in self.rooms:
+            # 本地第一个成员，向其它worker请求快照
+            self.rooms[room_id] = {}
+            self._publish(room_id, {"op": "sync"})
+        self._publish(room_id, {"op": "join" if online else "leave", "user_id": user_id})
+        if room_id not in self.manager.room_connections:
+            # 本地已无成员，不会再收到该聊天室的事件，丢弃其状态
+            self.rooms.pop(room_id, None)
+
+    def _publish(self, room_id: int, event: dict):
+        event["worker"] = self.worker_id
+        asyncio.create_task(self.manager.publish_room_event("presence", room_id, event))
+
+    def _publish_snapshot(self, room_id: int):
+        self._publish(room_id, {"op": "snapshot", "user_ids": list(self.manager.get_room_user_ids(room_id))})
+
+    def _on_event(self, room_id: int, frame: str):
+        if room_id not in self.rooms:
+            return
+        event = orjson.loads(frame)
+        op = event["op"]
+        worker_id = event["worker"]
+        if op == "sync":
+            if worker_id != self.worker_id:
+                self._publish_snapshot(room_id)
+            return
+
+        before = self._known_user_ids(room_id)
+        workers = self.rooms[room_id]
+        user_ids = set(workers.get(worker_id, (set(), 0))[0])
+        if op == "join":
+            user_ids.add(event["user_id"])
+        elif op == "leave":
+            user_ids.discard(event["user_id"])
+        elif op == "snapshot":
+            user_ids = set(event["user_ids"])
+        workers[worker_id] = (user_ids, time.monotonic())
+        self._deliver_changes(room_id, before)
+
+    def _deliver_changes(self, room_id: int, before: Set[int]):
+        after = self._known_user_ids(room_id)
+        for user_id in after - before:
+            self.manager.deliver_to_room(
+                room_id, {"type": "presence", "room_id": room_id, "user_id": user_id, "online": True}
+            )
+        for user_id in before - after:
+            self.manager.deliver_to_room(
+                room_id, {"type": "presence", "room_id": room_id, "user_id": user_id, "online": False}
+            )
+
+    def refresh(self):
+        """
+        发布本地快照，并清理长时间未刷新的worker
+        """
+        expire_before = time.monotonic() - self.refresh_interval * 3
+        for room_id, workers in list(self.rooms.items()):
+            self._publish_snapshot(room_id)
+            stale = [
+                worker_id for worker_id, (_, refreshed_at) in workers.items()
+                if worker_id != self.worker_id and refreshed_at < expire_before
+            ]
+            if stale:
+                before = self._known_user_ids(room_id)
+                for worker_id in stale:
+                    del workers[worker_id]
+                self._deliver_changes(room_id, before)
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(self.refresh_interval)
+            try:
+                self.refresh()
+            except Exception:
+                logger.exception("刷新在线成员失败")
+
+
+presence_tracker = PresenceTracker(manager, settings.PRESENCE_REFRESH_INTERVAL)
@@ -0,0 +1,57 @@
+from typing import Dict, Iterable, List
+import orjson
+from tortoise.signals import post_save
+from app.core.cache import TTLCache
+from app.core.config import settings
+from app.core.websocket import manager
+from app.models.user import User
+
+_MISSING = object()
+
+# 用户资料缓存: user_id -> {"id", "username", "avatar"}
+profile_cache = TTLCache(settings.PROFILE_CACHE_SIZE, settings.PROFILE_CACHE_TTL)
+
+# 用户资料变化时经消息总线通知所有worker清除缓存
+PROFILE_CHANNEL = "profile_cache"
+
+
+def user_profile(user: User) -> dict:
+    return {"id": user.id, "username": user.username, "avatar": user.avatar}
+
+
+async def get_profiles(user_ids: Iterable[int]) -> Dict[int, dict]:
+    """
+    批量获取用户资料，未缓存的用户用一次查询加载
+    """
+    profiles: Dict[int, dict] = {}
+    missing: List[int] = []
+    for user_id in set(user_ids):
+        profile = profile_cache.get(user_id, _MISSING)
+        if profile is _MISSING:
+            missing.append(user_id)
+        else:
+            profiles[user_id] = profile
+    if missing:
+        for profile in await User.filter(id__in=missing).values("id", "username", "avatar"):
+            profile_cache.set(profile["id"], profile)
+            profiles[profile["id"]] = profile
+    return profiles
+
+
+async def invalidate_profile(user_id: int):
+    await manager.publish(PROFILE_CHANNEL, {"user_id": user_id})
+
+
+def _on_invalidate(frame: str):
+    profile_cache.invalidate(orjson.loads(frame)["user_id"])
+
+
+manager.register_channel(PROFILE_CHANNEL, _on_invalidate)
+
+
+@post_save(User)
+async def _on_user_saved(sender, instance: User, created: bool, using_db, update_fields):
+    # 任何修改用户的地方都会经过这里，只关心资料中的字段
+    if created or (update_fields and not {"username", "avatar"} & set(update_fields)):
+        return
+    await invalidate_profile(instance.id)
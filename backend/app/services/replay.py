@@ -0,0 +1,62 @@
+from app.core.codec import encode_json
+from app.core.config import settings
+from app.core.websocket import Connection, manager
+from app.crud.message import get_messages_after_seq
+from app.models.message import Message
+from app.services.profile_cache import get_profiles
+
+
+def message_event(message: Message, username: str) -> dict:
+    """
+    消息的推送格式，实时广播和数据库补发使用同一种格式
+    """
+    event = {
+        "type": "message",
+        "room_id": message.room_id,
+        "seq": message.seq,
+        "content": message.content,
+        "user_id": message.sender_id,
+        "username": username,
+        "message_type": message.message_type,
+        "message_id": message.id,
+        "created_at": message.created_at.isoformat()
+    }
+    if message.image_url:
+        event["image_url"] = message.image_url
+    return event
+
+
+async def replay_room(connection: Connection, room_id: int, after_seq: int):
+    """
+    补发断线期间错过的聊天室事件
+    优先使用本worker内存中的最近事件；缓冲区覆盖不到时从数据库按序号补发消息，
+    数据库中只有消息，输入状态、在线状态等临时事件不会补发。
+    结果合并为一个 replay 帧，complete 为 false 时客户端应改用历史消息接口
+    """
+    frames = manager.get_replay(room_id, after_seq)
+    source = "memory"
+    complete = True
+    if frames is None:
+        source = "database"
+        messages = await get_messages_after_seq(room_id, after_seq, settings.REPLAY_MAX_EVENTS)
+        profiles = await get_profiles(message.sender_id for message in messages)
+        frames = [
+            encode_json(message_event(message, profiles.get(message.sender_id, {}).get("username")))
+            for message in messages
+        ]
+        complete = len(messages) < settings.REPLAY_MAX_EVENTS
+        if complete:
+            # 查询期间可能已有更新的事件进入内存，按序号补齐
+            last_seq = messages[-1].seq if messages else after_seq
+            frames.extend(manager.get_replay(room_id, last_seq) or [])
+    elif len(frames) > settings.REPLAY_MAX_EVENTS:
+        frames = frames[:settings.REPLAY_MAX_EVENTS]
+        complete = False
+
+    # 各事件已是JSON帧，直接拼接
+    manager.send_to_connection(
+        connection,
+        '{"type":"replay","room_id":%d,"after_seq":%d,"source":"%s","complete":%s,"events":[%s]}' % (
+            room_id, after_seq, source, "true" if complete else "false", ",".join(frames)
+        )
+    )
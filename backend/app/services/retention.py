@@ -0,0 +1,201 @@
+import asyncio
+import logging
+import os
+import shutil
+from contextlib import asynccontextmanager
+from datetime import datetime, timedelta, timezone
+from typing import AsyncIterator, Awaitable, Callable, List, Optional, Type
+from tortoise import Tortoise
+from tortoise import timezone as tortoise_timezone
+from tortoise.expressions import Q
+from tortoise.models import Model
+from app.core.config import settings
+from app.core.sequence import room_sequencer
+from app.models.chat_room import AnnouncementHistory, ChatRoom
+from app.models.chat_room_member import ChatRoomMember
+from app.models.message import Message
+from app.models.notification import Notification
+from app.services.archive import message_archive
+from app.services.message_cache import message_cache
+from app.services.search import search_index
+from app.services.uploads import blob_store
+
+logger = logging.getLogger(__name__)
+
+# 多个worker中同一时间只有一个执行清理
+_RETENTION_LOCK = 0x6D736772
+
+
+class RetentionJob:
+    """
+    数据保留与清理后台任务
+
+    - 已删除（deleted_at 不为空）的聊天室: 分批删除消息、公告历史和成员，最后删除聊天室本身和上传的文件
+    - 设置了保留策略的聊天室: 删除超过保留天数或超出保留条数的消息
+    - 超过保留天数的通知和公告历史
+    - 不再被任何消息引用的上传图片
+    每批按 id 键集顺序删除 batch_size 行，批之间暂停 pause 秒，不会长时间持有锁。
+    """
+
+    def __init__(
+        self,
+        interval: float,
+        batch_size: int,
+        pause: float,
+        notification_days: int,
+        announcement_days: int
+    ):
+        self.interval = interval
+        self.batch_size = batch_size
+        self.pause = pause
+        self.notification_days = notification_days
+        self.announcement_days = announcement_days
+        self.wakeup = asyncio.Event()
+        self.task: Optional[asyncio.Task] = None
+
+    def start(self):
+        self.task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self.task is not None:
+            self.task.cancel()
+            await asyncio.gather(self.task, return_exceptions=True)
+            self.task = None
+
+    def wake(self):
+        """
+        不等下一个间隔，立即执行一轮
+        """
+        self.wakeup.set()
+
+    async def delete_room(self, room: ChatRoom):
+        """
+        标记删除聊天室，聊天室立即不可见；成员、消息等数据由后台分批清理
+        """
+        room.deleted_at = tortoise_timezone.now()
+        await room.save(update_fields=["deleted_at"])
+        self.wake()
+
+    @asynccontextmanager
+    async def _exclusive(self) -> AsyncIterator[bool]:
+        connection = Tortoise.get_connection("default")
+        if connection.capabilities.dialect != "postgres":
+            yield True
+            return
+        # 会话级advisory锁，整轮清理期间占用一个连接
+        async with connection.acquire_connection() as raw:
+            locked = await raw.fetchval("SELECT pg_try_advisory_lock($1)", _RETENTION_LOCK)
+            try:
+                yield locked
+            finally:
+                if locked:
+                    await raw.execute("SELECT pg_advisory_unlock($1)", _RETENTION_LOCK)
+
+    async def _delete_batches(
+        self,
+        model: Type[Model],
+        *conditions: Q,
+        on_batch: Optional[Callable[[List[int]], Awaitable]] = None,
+        **filters
+    ) -> int:
+        """
+        按 id 顺序分批删除满足条件的行，返回删除的行数
+        """
+        total = 0
+        last_id = 0
+        while True:
+            ids = await model.filter(*conditions, id__gt=last_id, **filters).order_by("id").limit(
+                self.batch_size
+            ).values_list("id", flat=True)
+            if not ids:
+                return total
+            await model.filter(id__in=ids).delete()
+            if on_batch is not None:
+                await on_batch(ids)
+            total += len(ids)
+            last_id = ids[-1]
+            await asyncio.sleep(self.pause)
+
+    async def purge_room(self, room_id: int):
+        await self._delete_batches(Message, room_id=room_id, on_batch=search_index.remove_many)
+        await self._delete_batches(AnnouncementHistory, room_id=room_id)
+        await self._delete_batches(ChatRoomMember, room_id=room_id)
+        await ChatRoom.filter(id=room_id).delete()
+        await room_sequencer.forget(room_id)
+        await asyncio.to_thread(shutil.rmtree, os.path.join(settings.UPLOAD_DIR, str(room_id)), True)
+        logger.info("已清理删除的聊天室: %s", room_id)
+
+    async def apply_room_policy(self, room: dict, now: datetime):
+        room_id = room["id"]
+        deleted = 0
+        if room["retention_days"] is not None:
+            deleted += await self._delete_batches(
+                Message,
+                room_id=room_id,
+                created_at__lt=now - timedelta(days=room["retention_days"]),
+                on_batch=search_index.remove_many
+            )
+        if room["retention_max_messages"] is not None:
+            # 保留最新的 N 条，第 N+1 条及更早的都删除
+            boundary = await Message.filter(room_id=room_id).order_by("-created_at", "-id").offset(
+                room["retention_max_messages"]
+            ).limit(1).values("created_at", "id")
+            if boundary:
+                created_at, message_id = boundary[0]["created_at"], boundary[0]["id"]
+                deleted += await self._delete_batches(
+                    Message,
+                    Q(created_at__lt=created_at) | Q(created_at=created_at, id__lte=message_id),
+                    room_id=room_id,
+                    on_batch=search_index.remove_many
+                )
+        if deleted:
+            await message_cache.invalidate(room_id)
+            logger.info("聊天室 %s 按保留策略删除了 %s 条消息", room_id, deleted)
+
+    async def run_once(self):
+        async with self._exclusive() as locked:
+            if not locked:
+                return
+            for room_id in await ChatRoom.filter(deleted_at__isnull=False).values_list("id", flat=True):
+                await self.purge_room(room_id)
+
+            now = datetime.now(timezone.utc)
+            rooms = await ChatRoom.filter(
+                Q(retention_days__isnull=False) | Q(retention_max_messages__isnull=False),
+                deleted_at__isnull=True
+            ).values("id", "retention_days", "retention_max_messages")
+            for room in rooms:
+                await self.apply_room_policy(room, now)
+
+            if self.notification_days > 0:
+                await self._delete_batches(Notification, created_at__lt=now - timedelta(days=self.notification_days))
+            if self.announcement_days > 0:
+                await self._delete_batches(
+                    AnnouncementHistory, created_at__lt=now - timedelta(days=self.announcement_days)
+                )
+
+            # 消息删除后才会出现不再被引用的图片，放在最后
+            collected = await blob_store.collect(self.batch_size, await message_archive.horizon())
+            if collected:
+                logger.info("回收了 %s 张不再被引用的图片", collected)
+
+    async def _run(self):
+        while True:
+            try:
+                await self.run_once()
+            except Exception:
+                logger.exception("数据清理失败")
+            try:
+                await asyncio.wait_for(self.wakeup.wait(), self.interval)
+            except asyncio.TimeoutError:
+                pass
+            self.wakeup.clear()
+
+
+retention_job = RetentionJob(
+    settings.RETENTION_INTERVAL,
+    settings.RETENTION_BATCH_SIZE,
+    settings.RETENTION_BATCH_PAUSE,
+    settings.NOTIFICATION_RETENTION_DAYS,
+    settings.ANNOUNCEMENT_HISTORY_RETENTION_DAYS
+)
@@ -0,0 +1,216 @@
+import asyncio
+import logging
+import re
+import sqlite3
+from typing import Iterable, List, Optional, Tuple
+from tortoise import Tortoise
+from app.core.config import settings
+from app.crud.partitions import is_partitioned
+from app.models.message import Message
+
+logger = logging.getLogger(__name__)
+
+# 搜索结果: (message_id, 得分)，得分越小越相关
+SearchHit = Tuple[int, float]
+
+
+def searchable(message: Message) -> bool:
+    # 图片消息的内容是占位文字，不建立索引
+    return message.message_type == "text" and not message.recalled
+
+
+class SearchIndex:
+    """
+    消息全文索引
+    结果按 (得分, id) 升序排列，以上一页最后一条的 (得分, id) 作为游标翻页
+    """
+
+    async def setup(self):
+        pass
+
+    async def close(self):
+        pass
+
+    async def index(self, messages: Iterable[Message]):
+        """
+        新消息写入后调用
+        """
+        raise NotImplementedError
+
+    async def remove(self, message_id: int):
+        """
+        消息撤回或删除后调用
+        """
+        raise NotImplementedError
+
+    async def remove_many(self, message_ids: List[int]):
+        """
+        按保留策略批量删除消息后调用
+        """
+        for message_id in message_ids:
+            await self.remove(message_id)
+
+    async def remove_room(self, room_id: int):
+        """
+        聊天室删除后调用
+        """
+        raise NotImplementedError
+
+    async def search(
+        self,
+        room_id: int,
+        query: str,
+        limit: int,
+        after: Optional[Tuple[float, int]] = None
+    ) -> List[SearchHit]:
+        raise NotImplementedError
+
+
+class PostgresSearchIndex(SearchIndex):
+    """
+    PostgreSQL tsvector + GIN 表达式索引
+    索引由数据库在插入、更新（撤回会替换内容）和删除时自动维护，应用侧无需额外写入。
+    分词配置由 SEARCH_PG_CONFIG 指定，中文需要安装 zhparser 等扩展后使用对应的配置
+    """
+
+    def __init__(self, config: str):
+        if not re.fullmatch(r"[a-z_][a-z0-9_]*", config):
+            raise ValueError(f"无效的全文搜索配置: {config}")
+        # 查询中的表达式必须与索引表达式完全一致才能使用索引，因此配置名直接写入SQL
+        self.document = f"to_tsvector('{config}', content)"
+        self.config = config
+
+    async def setup(self):
+        connection = Tortoise.get_connection("default")
+        try:
+            # CONCURRENTLY 不阻塞写入；多个worker同时启动时只有一个会真正创建。
+            # 分区表不支持 CONCURRENTLY，在父表上创建后新分区会自动带上该索引
+            concurrently = "" if await is_partitioned() else "CONCURRENTLY "
+            await connection.execute_script(
+                f"CREATE INDEX {concurrently}IF NOT EXISTS idx_messages_content_fts "
+                f"ON messages USING GIN ({self.document})"
+            )
+        except Exception:
+            logger.exception("创建全文索引失败")
+
+    async def index(self, messages: Iterable[Message]):
+        pass
+
+    async def remove(self, message_id: int):
+        pass
+
+    async def remove_many(self, message_ids: List[int]):
+        pass
+
+    async def remove_room(self, room_id: int):
+        pass
+
+    async def search(
+        self,
+        room_id: int,
+        query: str,
+        limit: int,
+        after: Optional[Tuple[float, int]] = None
+    ) -> List[SearchHit]:
+        connection = Tortoise.get_connection("default")
+        score, message_id = after if after is not None else (None, None)
+        rows = await connection.execute_query_dict(
+            f"SELECT id, score FROM ("
+            f"  SELECT id, -ts_rank({self.document}, q) AS score"
+            f"  FROM messages, plainto_tsquery('{self.config}', $2) AS q"
+            f"  WHERE room_id = $1 AND NOT recalled AND message_type = 'text' AND {self.document} @@ q"
+            f") AS hits "
+            f"WHERE $3::float8 IS NULL OR (score, id) > ($3::float8, $4::int) "
+            f"ORDER BY score, id LIMIT $5",
+            [room_id, query, score, message_id, limit]
+        )
+        return [(row["id"], row["score"]) for row in rows]
+
+
+class SqliteSearchIndex(SearchIndex):
+    """
+    SQLite FTS5 索引，独立的数据库文件，用于测试和单节点部署
+    使用 trigram 分词，中文可以按子串搜索（至少3个字符）；得分为 bm25
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self.db: Optional[sqlite3.Connection] = None
+        self.lock = asyncio.Lock()
+
+    async def setup(self):
+        self.db = sqlite3.connect(self.path, check_same_thread=False)
+        await self._execute(
+            "CREATE VIRTUAL TABLE IF NOT EXISTS message_fts USING fts5("
+            "content, room_id UNINDEXED, tokenize='trigram')"
+        )
+
+    async def close(self):
+        if self.db is not None:
+            self.db.close()
+            self.db = None
+
+    def _run(self, sql: str, params=(), many: bool = False) -> list:
+        with self.db:
+            if many:
+                self.db.executemany(sql, params)
+                return []
+            return self.db.execute(sql, params).fetchall()
+
+    async def _execute(self, sql: str, params=(), many: bool = False) -> list:
+        # sqlite3 是同步接口，放到线程中执行，同一时间只有一个操作
+        async with self.lock:
+            return await asyncio.to_thread(self._run, sql, params, many)
+
+    async def index(self, messages: Iterable[Message]):
+        rows = [(message.id, message.content, message.room_id) for message in messages if searchable(message)]
+        if rows:
+            await self._execute(
+                "INSERT OR REPLACE INTO message_fts (rowid, content, room_id) VALUES (?, ?, ?)", rows, many=True
+            )
+
+    async def remove(self, message_id: int):
+        await self._execute("DELETE FROM message_fts WHERE rowid = ?", (message_id,))
+
+    async def remove_many(self, message_ids: List[int]):
+        await self._execute(
+            "DELETE FROM message_fts WHERE rowid = ?", [(message_id,) for message_id in message_ids], many=True
+        )
+
+    async def remove_room(self, room_id: int):
+        await self._execute("DELETE FROM message_fts WHERE room_id = ?", (room_id,))
+
+    async def search(
+        self,
+        room_id: int,
+        query: str,
+        limit: int,
+        after: Optional[Tuple[float, int]] = None
+    ) -> List[SearchHit]:
+        # 作为一个短语搜索，避免用户输入被解析为FTS5语法
+        phrase = '"' + query.replace('"', '""') + '"'
+        score, message_id = after if after is not None else (None, None)
+        rows = await self._execute(
+            "SELECT id, score FROM ("
+            "  SELECT rowid AS id, bm25(message_fts) AS score"
+            "  FROM message_fts WHERE message_fts MATCH ? AND room_id = ?"
+            ") WHERE ? IS NULL OR score > ? OR (score = ? AND id > ?) "
+            "ORDER BY score, id LIMIT ?",
+            (phrase, room_id, score, score, score, message_id, limit)
+        )
+        return [(row[0], row[1]) for row in rows]
+
+
+def create_search_index(backend: Optional[str] = None) -> SearchIndex:
+    """
+    根据配置创建全文索引: postgres（默认）或 sqlite
+    """
+    backend = backend or settings.SEARCH_BACKEND
+    if backend == "postgres":
+        return PostgresSearchIndex(settings.SEARCH_PG_CONFIG)
+    if backend == "sqlite":
+        return SqliteSearchIndex(settings.SEARCH_SQLITE_PATH)
+    raise ValueError(f"未知的全文索引类型: {backend}")
+
+
+search_index = create_search_index()
@@ -0,0 +1,130 @@
+import asyncio
+import logging
+import math
+from typing import Dict, List, Optional, Set, Tuple
+import orjson
+from app.core.config import settings
+from app.core.websocket import ConnectionManager, manager
+
+logger = logging.getLogger(__name__)
+
+
+class TypingTracker:
+    """
+    正在输入状态引擎
+
+    - 每个聊天室维护正在输入的用户集合，每个条目有TTL
+    - 过期通过时间轮批量处理：条目按过期时刻放入对应的槽，每个tick只处理一个槽
+    - 状态变化只标记聊天室为脏，每个间隔最多向聊天室推送一次聚合后的"谁在输入"
+
+    输入事件经消息总线的 typing:{room_id} 频道分发，每个有本地成员的worker
+    都维护完整的输入状态，只向本地连接推送聚合结果
+    """
+
+    def __init__(self, connection_manager: ConnectionManager, ttl: float, interval: float):
+        self.manager = connection_manager
+        self.interval = interval
+        self.ttl_ticks = max(1, math.ceil(ttl / interval))
+        # 槽数比TTL多一个，保证新条目不会落在当前正在处理的槽里
+        self.wheel: List[Set[Tuple[int, int]]] = [set() for _ in range(self.ttl_ticks + 1)]
+        self.tick = 0
+        self.rooms: Dict[int, Dict[int, Tuple[str, int]]] = {}  # room_id -> {user_id -> (username, 过期tick)}
+        self.dirty: Set[int] = set()
+        self.task: Optional[asyncio.Task] = None
+        connection_manager.register_room_channel("typing", self._on_event)
+
+    def start(self):
+        self.task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self.task is not None:
+            self.task.cancel()
+            await asyncio.gather(self.task, return_exceptions=True)
+            self.task = None
+
+    async def publish(self, room_id: int, user_id: int, username: str, is_typing: bool = True):
+        """
+        发布输入状态
+        本worker已知该用户仍在输入且剩余有效期超过一半时不再重复发布
+        """
+        if is_typing:
+            entry = self.rooms.get(room_id, {}).get(user_id)
+            if entry is not None and entry[1] - self.tick > self.ttl_ticks // 2:
+                return
+        elif user_id not in self.rooms.get(room_id, {}):
+            return
+        await self.manager.publish_room_event(
+            "typing",
+            room_id,
+            {"user_id": user_id, "username": username, "is_typing": is_typing}
+        )
+
+    def _on_event(self, room_id: int, frame: str):
+        event = orjson.loads(frame)
+        if event["is_typing"]:
+            self.touch(room_id, event["user_id"], event["username"])
+        else:
+            self.remove(room_id, event["user_id"])
+
+    def touch(self, room_id: int, user_id: int, username: str):
+        users = self.rooms.setdefault(room_id, {})
+        if user_id not in users:
+            self.dirty.add(room_id)
+        expire = self.tick + self.ttl_ticks
+        users[user_id] = (username, expire)
+        self.wheel[expire % len(self.wheel)].add((room_id, user_id))
+
+    def remove(self, room_id: int, user_id: int):
+        users = self.rooms.get(room_id)
+        if users is None or user_id not in users:
+            return
+        del users[user_id]
+        if not users:
+            del self.rooms[room_id]
+        self.dirty.add(room_id)
+
+    def get_typing_users(self, room_id: int) -> List[dict]:
+        return [
+            {"user_id": user_id, "username": username}
+            for user_id, (username, _) in self.rooms.get(room_id, {}).items()
+        ]
+
+    def advance(self):
+        """
+        时间轮前进一格，批量处理到期的槽
+        续期过的条目过期tick已经更新，在这里直接跳过
+        """
+        self.tick += 1
+        index = self.tick % len(self.wheel)
+        bucket, self.wheel[index] = self.wheel[index], set()
+        for room_id, user_id in bucket:
+            entry = self.rooms.get(room_id, {}).get(user_id)
+            if entry is not None and entry[1] <= self.tick:
+                self.remove(room_id, user_id)
+
+    def flush(self):
+        """
+        向状态发生变化的聊天室推送一次聚合后的输入状态
+        """
+        dirty, self.dirty = self.dirty, set()
+        for room_id in dirty:
+            self.manager.deliver_to_room(
+                room_id,
+                {
+                    "type": "typing",
+                    "room_id": room_id,
+                    "users": self.get_typing_users(room_id)
+                }
+            )
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(self.interval)
+            try:
+                self.advance()
+                self.flush()
+            except Exception:
+                logger.exception("推送输入状态失败")
+
+
+typing_tracker = TypingTracker(manager, settings.TYPING_TTL, settings.TYPING_FLUSH_INTERVAL)
@@ -0,0 +1,166 @@
+import asyncio
+import logging
+from typing import Dict, Optional, Set, Tuple
+import orjson
+from app.core.config import settings
+from app.core.websocket import ConnectionManager, manager
+from app.crud.read_state import count_unread, get_unread_counts
+from app.models.message import Message
+
+logger = logging.getLogger(__name__)
+
+
+class UnreadTracker:
+    """
+    在线用户的未读数缓存
+
+    用户在本worker上建立第一个连接时用一次分组查询加载其所有聊天室的未读数，
+    并订阅这些聊天室的 unread:{room_id} 频道：
+    - 新消息: 频道上的每个worker为本地在线的成员（发送者除外）加一
+    - 已读: 处理已读请求的worker重新统计该聊天室的未读数，经频道同步
+    变化的 (用户, 聊天室) 标记为脏，每个间隔最多推送一次 unread 帧，客户端无需轮询。
+    成员关系变化等低频事件经全局 unread 频道通知重新加载
+    """
+
+    CHANNEL = "unread"
+
+    def __init__(self, connection_manager: ConnectionManager, interval: float):
+        self.manager = connection_manager
+        self.interval = interval
+        self.counts: Dict[int, Dict[int, int]] = {}  # user_id -> {room_id -> 未读数}
+        self.room_users: Dict[int, Set[int]] = {}  # room_id -> 已加载的本地在线用户
+        self.dirty: Set[Tuple[int, int]] = set()  # (user_id, room_id)
+        self.task: Optional[asyncio.Task] = None
+        connection_manager.register_channel(self.CHANNEL, self._on_event)
+        connection_manager.add_user_listener(self._on_user_change)
+
+    def start(self):
+        self.task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self.task is not None:
+            self.task.cancel()
+            await asyncio.gather(self.task, return_exceptions=True)
+            self.task = None
+
+    async def get_counts(self, user_id: int) -> Dict[int, int]:
+        counts = self.counts.get(user_id)
+        if counts is not None:
+            return dict(counts)
+        return await get_unread_counts(user_id)
+
+    async def on_message(self, message: Message):
+        """
+        新消息写入后调用
+        """
+        await self._publish(message.room_id, {"op": "message", "sender_id": message.sender_id})
+
+    async def on_read(self, room_id: int, user_id: int):
+        """
+        已读水位线前进后调用
+        """
+        count = await count_unread(room_id, user_id)
+        await self._publish(room_id, {"op": "set", "user_id": user_id, "count": count})
+
+    async def on_room_deleted(self, room_id: int):
+        await self._publish(room_id, {"op": "remove"})
+
+    async def refresh(self, user_id: int):
+        """
+        用户加入/退出聊天室后调用，重新加载其未读数
+        """
+        await self.manager.publish(self.CHANNEL, {"op": "refresh", "user_id": user_id})
+
+    async def _publish(self, room_id: int, event: dict):
+        await self.manager.publish(f"{self.CHANNEL}:{room_id}", event)
+
+    def _on_user_change(self, user_id: int, online: bool):
+        if online:
+            asyncio.create_task(self._load(user_id))
+        else:
+            self._drop(user_id)
+
+    async def _load(self, user_id: int):
+        try:
+            counts = await get_unread_counts(user_id)
+        except Exception:
+            logger.exception("加载未读数失败: user_id=%s", user_id)
+            return
+        if user_id not in self.manager.active_connections:
+            # 加载期间已经断开
+            return
+        self._drop(user_id)
+        self.counts[user_id] = counts
+        for room_id in counts:
+            self._track(room_id, user_id)
+        rooms = {str(room_id): count for room_id, count in counts.items()}
+        self.manager.send_to_local_user(user_id, {"type": "unread_state", "rooms": rooms})
+
+    def _drop(self, user_id: int):
+        counts = self.counts.pop(user_id, None)
+        if counts is None:
+            return
+        for room_id in counts:
+            self._untrack(room_id, user_id)
+
+    def _track(self, room_id: int, user_id: int):
+        users = self.room_users.setdefault(room_id, set())
+        if not users:
+            self.manager.register_channel(
+                f"{self.CHANNEL}:{room_id}",
+                lambda frame, room_id=room_id: self._on_room_event(room_id, frame)
+            )
+        users.add(user_id)
+
+    def _untrack(self, room_id: int, user_id: int):
+        users = self.room_users.get(room_id)
+        if users is None:
+            return
+        users.discard(user_id)
+        if not users:
+            del self.room_users[room_id]
+            self.manager.unregister_channel(f"{self.CHANNEL}:{room_id}")
+
+    def _on_room_event(self, room_id: int, frame: str):
+        event = orjson.loads(frame)
+        op = event["op"]
+        users = self.room_users.get(room_id, ())
+        if op == "message":
+            for user_id in users:
+                if user_id != event["sender_id"]:
+                    self.counts[user_id][room_id] += 1
+                    self.dirty.add((user_id, room_id))
+        elif op == "set":
+            user_id = event["user_id"]
+            if user_id in users:
+                self.counts[user_id][room_id] = event["count"]
+                self.dirty.add((user_id, room_id))
+        elif op == "remove":
+            for user_id in list(users):
+                del self.counts[user_id][room_id]
+                self._untrack(room_id, user_id)
+                self.manager.send_to_local_user(user_id, {"type": "unread", "room_id": room_id, "count": None})
+
+    def _on_event(self, frame: str):
+        event = orjson.loads(frame)
+        if event["op"] == "refresh" and event["user_id"] in self.counts:
+            asyncio.create_task(self._load(event["user_id"]))
+
+    def flush(self):
+        dirty, self.dirty = self.dirty, set()
+        for user_id, room_id in dirty:
+            counts = self.counts.get(user_id)
+            if counts is None or room_id not in counts:
+                continue
+            self.manager.send_to_local_user(user_id, {"type": "unread", "room_id": room_id, "count": counts[room_id]})
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(self.interval)
+            try:
+                self.flush()
+            except Exception:
+                logger.exception("推送未读数失败")
+
+
+unread_tracker = UnreadTracker(manager, settings.UNREAD_PUSH_INTERVAL)
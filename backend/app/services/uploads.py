@@ -0,0 +1,144 @@
+import asyncio
+import contextlib
+import hashlib
+import os
+import re
+import tempfile
+from datetime import datetime, timedelta, timezone
+from typing import List, Optional, Tuple
+from fastapi import UploadFile
+from tortoise import timezone as tortoise_timezone
+from app.core.config import settings
+from app.models.image_blob import ImageBlob
+from app.models.message import Message
+
+# 每次从上传的临时文件读取并写入目标文件的字节数
+UPLOAD_CHUNK_SIZE = 64 * 1024
+
+_EXTENSION = re.compile(r"\.[a-z0-9]{1,10}")
+
+
+class UploadTooLarge(Exception):
+    pass
+
+
+def _remove(path: str):
+    with contextlib.suppress(FileNotFoundError):
+        os.remove(path)
+
+
+def _write(out, digest, chunk: bytes):
+    digest.update(chunk)
+    out.write(chunk)
+
+
+async def save_upload(file: UploadFile, directory: str, max_size: int) -> Tuple[str, str, int]:
+    """
+    分块将上传的文件写入 directory 下的临时文件，同时计算SHA-256，返回 (临时文件路径, 哈希, 大小)
+    磁盘操作在线程池中执行，不阻塞事件循环；超过 max_size 时立即中止并删除临时文件（抛出 UploadTooLarge）。
+    临时文件与最终位置在同一目录树下，调用方可以原子地重命名
+    """
+    await asyncio.to_thread(os.makedirs, directory, exist_ok=True)
+    fd, temp_path = await asyncio.to_thread(tempfile.mkstemp, ".part", None, directory)
+    digest = hashlib.sha256()
+    size = 0
+    try:
+        with os.fdopen(fd, "wb") as out:
+            while chunk := await file.read(UPLOAD_CHUNK_SIZE):
+                size += len(chunk)
+                if size > max_size:
+                    raise UploadTooLarge()
+                await asyncio.to_thread(_write, out, digest, chunk)
+    except BaseException:
+        await asyncio.to_thread(_remove, temp_path)
+        raise
+    return temp_path, digest.hexdigest(), size
+
+
+class BlobStore:
+    """
+    按内容寻址的图片存储
+
+    文件保存在 {directory}/{哈希前两位}/{哈希}{扩展名}，相同内容无论上传到哪个聊天室都只保存一份，
+    URL 固定不变，HTTP缓存和CDN可以长期缓存。消息通过 image_hash 引用图片，
+    引用数在回收时直接由消息表统计，任何删除消息的途径（删除、保留策略、清理聊天室）都不需要额外维护
+    """
+
+    def __init__(self, directory: str, url_prefix: str, grace: float):
+        self.directory = directory
+        self.url_prefix = url_prefix
+        self.grace = grace
+
+    def _relative_path(self, blob: ImageBlob) -> str:
+        return f"{blob.hash[:2]}/{blob.hash}{blob.extension}"
+
+    def path(self, blob: ImageBlob) -> str:
+        return os.path.join(self.directory, self._relative_path(blob))
+
+    def url(self, blob: ImageBlob) -> str:
+        return f"{self.url_prefix}/{self._relative_path(blob)}"
+
+    async def store(self, file: UploadFile, max_size: int) -> ImageBlob:
+        """
+        保存上传的图片，内容已存在时复用已有的文件
+        """
+        temp_path, digest, size = await save_upload(file, self.directory, max_size)
+        try:
+            now = tortoise_timezone.now()
+            # 更新最近使用时间，回收任务不会删除宽限期内用过的图片
+            if await ImageBlob.filter(hash=digest).update(last_used_at=now):
+                blob = await ImageBlob.get(hash=digest)
+            else:
+                extension = os.path.splitext(file.filename or "")[1].lower()
+                blob, _ = await ImageBlob.get_or_create(hash=digest, defaults={
+                    "size": size,
+                    "extension": extension if _EXTENSION.fullmatch(extension) else "",
+                    "content_type": file.content_type,
+                    "last_used_at": now
+                })
+            path = self.path(blob)
+            if await asyncio.to_thread(os.path.exists, path):
+                await asyncio.to_thread(_remove, temp_path)
+            else:
+                await asyncio.to_thread(os.makedirs, os.path.dirname(path), exist_ok=True)
+                await asyncio.to_thread(os.replace, temp_path, path)
+        except BaseException:
+            await asyncio.to_thread(_remove, temp_path)
+            raise
+        return blob
+
+    async def collect(self, batch_size: int, horizon: Optional[datetime] = None) -> int:
+        """
+        回收不再被任何消息引用、且超过宽限期未使用的图片，返回回收的数量
+        已归档的消息不在消息表中，早于归档范围创建的图片可能仍被归档引用，不回收
+        """
+        cutoff = datetime.now(timezone.utc) - timedelta(seconds=self.grace)
+        query = ImageBlob.filter(last_used_at__lt=cutoff)
+        if horizon is not None:
+            query = query.filter(created_at__gte=horizon)
+        collected = 0
+        last_hash = ""
+        while True:
+            blobs: List[ImageBlob] = await query.filter(hash__gt=last_hash).order_by("hash").limit(batch_size)
+            if not blobs:
+                return collected
+            last_hash = blobs[-1].hash
+            hashes = [blob.hash for blob in blobs]
+            referenced = set(await Message.filter(image_hash__in=hashes).distinct().values_list("image_hash", flat=True))
+            unused = [blob for blob in blobs if blob.hash not in referenced]
+            if not unused:
+                continue
+            # 带上时间条件删除，期间被重新上传的图片会保留
+            await ImageBlob.filter(hash__in=[blob.hash for blob in unused], last_used_at__lt=cutoff).delete()
+            remaining = set(await ImageBlob.filter(hash__in=[blob.hash for blob in unused]).values_list("hash", flat=True))
+            for blob in unused:
+                if blob.hash not in remaining:
+                    await asyncio.to_thread(_remove, self.path(blob))
+                    collected += 1
+
+
+blob_store = BlobStore(
+    os.path.join(settings.UPLOAD_DIR, "blobs"),
+    "/static/uploads/blobs",
+    settings.IMAGE_BLOB_GC_GRACE
+)
@@ -1,38 +1,25 @@
-from fastapi import WebSocket
-from typing import Dict, List
-import json
-from datetime import datetime
+from typing import List
+from app.core.codec import encode_json
+from app.core.websocket import manager
+from app.services.typing import typing_tracker
 
 class WebSocketService:
-    def __init__(self):
-        self.active_connections: Dict[int, WebSocket] = {}
-        self.typing_users: Dict[int, Dict[int, datetime]] = {}  # room_id -> {user_id -> timestamp}
-
-    async def connect(self, websocket: WebSocket, user_id: int):
-        await websocket.accept()
-        self.active_connections[user_id] = websocket
-
-    def disconnect(self, user_id: int):
-        if user_id in self.active_connections:
-            del self.active_connections[user_id]
+    """
+    面向业务的推送服务，所有推送都经由连接管理器的消息总线，
+    因此无论目标用户连接在哪个worker上都能收到
+    """
 
     async def send_message(self, user_id: int, message: dict):
-        if user_id in self.active_connections:
-            await self.active_connections[user_id].send_json(message)
+        await manager.send_personal_message(message, user_id)
 
     async def broadcast_message(self, room_id: int, message: dict):
-        for user_id, websocket in self.active_connections.items():
-            if user_id in self.typing_users.get(room_id, {}):
-                await websocket.send_json(message)
+        await manager.broadcast_to_room(room_id, message)
 
-    def update_typing_status(self, room_id: int, user_id: int):
-        if room_id not in self.typing_users:
-            self.typing_users[room_id] = {}
-        self.typing_users[room_id][user_id] = datetime.utcnow()
+    async def update_typing_status(self, room_id: int, user_id: int, username: str):
+        await typing_tracker.publish(room_id, user_id, username)
 
-    def remove_typing_status(self, room_id: int, user_id: int):
-        if room_id in self.typing_users and user_id in self.typing_users[room_id]:
-            del self.typing_users[room_id][user_id]
+    async def remove_typing_status(self, room_id: int, user_id: int, username: str):
+        await typing_tracker.publish(room_id, user_id, username, is_typing=False)
 
     async def send_notification(self, user_id: int, notification: dict):
         """发送通知给指定用户"""
@@ -48,8 +35,9 @@ class WebSocketService:
             "type": "notification",
             "data": notification
         }
+        # 只编码一次，发布到每个用户的频道
+        frame = encode_json(message)
         for user_id in user_ids:
-            if user_id in self.active_connections:
-                await self.active_connections[user_id].send_json(message)
+            await manager.send_personal_message(frame, user_id)
 
 websocket_service = WebSocketService() 
\ No newline at end of file
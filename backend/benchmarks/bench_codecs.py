@@ -0,0 +1,76 @@
+"""
+WebSocket帧格式基准测试
+
+对每种帧格式统计单个事件的字节数、编码/解码耗时，
+以及启用 permessage-deflate（保留压缩上下文）后的平均字节数。
+
+运行方式（在 backend 目录下）:
+    python -m benchmarks.bench_codecs
+"""
+import time
+import zlib
+from datetime import datetime, timedelta
+
+from app.core.codec import CODECS
+
+EVENTS = 10_000
+
+
+def make_events():
+    start = datetime(2024, 1, 1, 12, 0, 0)
+    events = []
+    for i in range(EVENTS):
+        if i % 5 == 4:
+            events.append({
+                "type": "typing",
+                "room_id": 1,
+                "users": [{"user_id": 42, "username": "alice"}]
+            })
+        else:
+            events.append({
+                "type": "message",
+                "room_id": 1,
+                "content": f"第{i}条消息：今天下午三点开会",
+                "user_id": 42 + i % 7,
+                "username": f"user{i % 7}",
+                "message_type": "text",
+                "message_id": 100000 + i,
+                "created_at": (start + timedelta(seconds=i)).isoformat()
+            })
+    return events
+
+
+def deflated_size(frames) -> int:
+    """
+    模拟 permessage-deflate（保留上下文），每帧以 SYNC_FLUSH 结束并去掉末尾4字节
+    """
+    compressor = zlib.compressobj(wbits=-zlib.MAX_WBITS)
+    total = 0
+    for frame in frames:
+        data = frame.encode() if isinstance(frame, str) else frame
+        chunk = compressor.compress(data) + compressor.flush(zlib.Z_SYNC_FLUSH)
+        total += len(chunk) - 4
+    return total
+
+
+def main():
+    events = make_events()
+    print(f"事件数: {EVENTS}")
+    print(f"{'格式':<10}{'字节/事件':>12}{'deflate后':>12}{'编码us':>10}{'解码us':>10}")
+    for name, codec in CODECS.items():
+        start = time.perf_counter()
+        frames = [codec.encode(event) for event in events]
+        encode_cost = (time.perf_counter() - start) / EVENTS
+
+        start = time.perf_counter()
+        for frame in frames:
+            codec.decode(frame)
+        decode_cost = (time.perf_counter() - start) / EVENTS
+
+        raw = sum(len(frame.encode() if isinstance(frame, str) else frame) for frame in frames) / EVENTS
+        deflated = deflated_size(frames) / EVENTS
+        print(f"{name:<10}{raw:>12.1f}{deflated:>12.1f}{encode_cost * 1e6:>10.2f}{decode_cost * 1e6:>10.2f}")
+
+
+if __name__ == "__main__":
+    main()
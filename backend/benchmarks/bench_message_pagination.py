@@ -0,0 +1,93 @@
+"""
+消息历史翻页基准测试
+
+在一个聊天室中准备 BENCH_ROWS 条消息（默认1000万，已存在时复用），
+对比 offset 分页与 (created_at, id) 键集分页在不同深度取一页的耗时。
+需要可用的 PostgreSQL（settings.DATABASE_URL），首次准备数据需要几分钟。
+
+运行方式（在 backend 目录下）:
+    python -m benchmarks.bench_message_pagination
+    BENCH_ROWS=1000000 python -m benchmarks.bench_message_pagination
+"""
+import asyncio
+import os
+import statistics
+import time
+
+from tortoise import Tortoise
+
+from app.core.config import settings
+from app.crud.message import get_messages_page
+from app.models import TORTOISE_ORM, ChatRoom, Message, User
+
+ROWS = int(os.environ.get("BENCH_ROWS", 10_000_000))
+PAGE_SIZE = 50
+REPEAT = 5
+CHUNK = 1_000_000
+BENCH_USERNAME = "bench_pagination"
+
+
+async def prepare_room() -> int:
+    user, _ = await User.get_or_create(
+        username=BENCH_USERNAME,
+        defaults={"email": f"{BENCH_USERNAME}@example.com", "hashed_password": "-"}
+    )
+    room, _ = await ChatRoom.get_or_create(name=BENCH_USERNAME, owner=user)
+    existing = await Message.filter(room_id=room.id).count()
+    connection = Tortoise.get_connection("default")
+    # 已有的数据库不会由 generate_schemas 补建索引，与 migrations/20261018_message_keyset_index.sql 相同
+    await connection.execute_script(
+        "CREATE INDEX IF NOT EXISTS idx_messages_room_id_c3176d ON messages (room_id, created_at, id)"
+    )
+    for start in range(existing, ROWS, CHUNK):
+        end = min(start + CHUNK, ROWS)
+        print(f"写入第 {start + 1} - {end} 条消息...")
+        # 每秒10条消息，时间从旧到新，id随时间递增
+        await connection.execute_query(
+            "INSERT INTO messages (room_id, sender_id, content, message_type, created_at, updated_at, recalled) "
+            "SELECT $1, $2, 'message ' || g, 'text', "
+            "timestamptz '2020-01-01' + g * interval '100 milliseconds', "
+            "timestamptz '2020-01-01' + g * interval '100 milliseconds', false "
+            "FROM generate_series($3::int, $4::int) AS g",
+            [room.id, user.id, start + 1, end]
+        )
+    if existing < ROWS:
+        await connection.execute_script("ANALYZE messages")
+    return room.id
+
+
+async def timed(coro_factory) -> float:
+    samples = []
+    for _ in range(REPEAT):
+        start = time.perf_counter()
+        await coro_factory()
+        samples.append((time.perf_counter() - start) * 1000)
+    return statistics.median(samples)
+
+
+async def run():
+    config = {**TORTOISE_ORM, "connections": {"default": settings.DATABASE_URL}}
+    await Tortoise.init(config=config)
+    await Tortoise.generate_schemas(safe=True)
+    try:
+        room_id = await prepare_room()
+        depths = [d for d in (0, 1_000, 10_000, 100_000, 1_000_000, 5_000_000, ROWS - PAGE_SIZE) if d <= ROWS - PAGE_SIZE]
+        print(f"聊天室消息数: {ROWS}，每页 {PAGE_SIZE} 条，取 {REPEAT} 次中位数")
+        print(f"{'深度':>10}{'offset ms':>14}{'keyset ms':>14}")
+        for depth in depths:
+            query = Message.filter(room_id=room_id).order_by('-created_at', '-id')
+            offset_ms = await timed(lambda: query.offset(depth).limit(PAGE_SIZE))
+
+            # 键集分页的游标是上一页最后一条消息
+            before = None
+            if depth:
+                anchor = await query.offset(depth - 1).first()
+                before = (anchor.created_at, anchor.id)
+            keyset_ms = await timed(lambda: get_messages_page(room_id, PAGE_SIZE, before=before))
+            print(f"{depth:>10}{offset_ms:>14.2f}{keyset_ms:>14.2f}")
+    finally:
+        await Tortoise.close_connections()
+
+
+if __name__ == "__main__":
+    asyncio.run(run())
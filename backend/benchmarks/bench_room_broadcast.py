@@ -0,0 +1,109 @@
+"""
+聊天室广播基准测试
+
+对比旧实现（遍历所有在线用户的 user_rooms 列表）与聊天室索引实现
+在 50k 在线用户时向一个小房间广播的耗时。
+
+运行方式（在 backend 目录下）:
+    python -m benchmarks.bench_room_broadcast
+"""
+import asyncio
+import random
+import time
+from typing import Dict, List, Optional
+
+from app.core.codec import encode_json
+from app.core.sequence import room_sequencer
+from app.core.websocket import ConnectionManager
+
+USERS = 50_000
+ROOMS = 20_000
+ROOMS_PER_USER = 3
+ITERATIONS = 200
+
+
+class FakeWebSocket:
+    # 握手时按请求头和查询参数协商帧格式，这里都为空（使用JSON）
+    headers: Dict[str, str] = {}
+    query_params: Dict[str, str] = {}
+
+    async def accept(self, subprotocol: Optional[str] = None):
+        pass
+
+    async def send_text(self, message: str):
+        pass
+
+    async def send_json(self, message: dict):
+        pass
+
+
+class FakeUser:
+    def __init__(self, user_id: int):
+        self.id = user_id
+
+
+class LegacyConnectionManager:
+    """
+    旧实现：user_id -> [room_id]，广播时扫描所有用户
+    """
+
+    def __init__(self):
+        self.active_connections: Dict[int, FakeWebSocket] = {}
+        self.user_rooms: Dict[int, List[int]] = {}
+
+    def add_user_to_room(self, user_id: int, room_id: int):
+        if room_id not in self.user_rooms.setdefault(user_id, []):
+            self.user_rooms[user_id].append(room_id)
+
+    async def broadcast_to_room(self, room_id: int, message: str):
+        room_users = [
+            user_id for user_id, rooms in self.user_rooms.items()
+            if room_id in rooms
+        ]
+        for user_id in room_users:
+            if user_id in self.active_connections:
+                await self.active_connections[user_id].send_text(message)
+
+
+async def timed(broadcast, room_id: int, message) -> float:
+    start = time.perf_counter()
+    for _ in range(ITERATIONS):
+        await broadcast(room_id, message)
+        # 让出事件循环，使各连接的写任务能够清空队列
+        await asyncio.sleep(0)
+    return (time.perf_counter() - start) / ITERATIONS
+
+
+async def main():
+    rng = random.Random(0)
+    memberships = [rng.sample(range(ROOMS), ROOMS_PER_USER) for _ in range(USERS)]
+    # 一个只有 3 个人的小房间
+    small_room = ROOMS
+    for user_id in range(3):
+        memberships[user_id].append(small_room)
+
+    legacy = LegacyConnectionManager()
+    indexed = ConnectionManager()
+    for user_id, rooms in enumerate(memberships):
+        websocket = FakeWebSocket()
+        legacy.active_connections[user_id] = websocket
+        await indexed.connect(websocket, FakeUser(user_id))
+        for room_id in rooms:
+            legacy.add_user_to_room(user_id, room_id)
+            indexed.add_user_to_room(user_id, room_id)
+
+    # 广播时会为事件分配聊天室序号，预先初始化进程内计数器，不需要从数据库加载
+    room_sequencer.last[small_room] = 0
+    message = {"type": "message", "room_id": small_room, "content": "hello"}
+
+    legacy_cost = await timed(legacy.broadcast_to_room, small_room, encode_json(message))
+    indexed_cost = await timed(indexed.broadcast_to_room, small_room, message)
+
+    print(f"在线用户: {USERS}, 每人房间数: {ROOMS_PER_USER}, 目标房间人数: 3")
+    print(f"旧实现   每次广播: {legacy_cost * 1e6:10.1f} us")
+    print(f"索引实现 每次广播: {indexed_cost * 1e6:10.1f} us")
+    print(f"加速比: {legacy_cost / indexed_cost:.0f}x")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
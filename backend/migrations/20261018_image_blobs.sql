@@ -0,0 +1,8 @@
+-- 上传图片改为按内容寻址存储: image_blobs 每个内容一行，消息通过 image_hash 引用
+-- image_blobs 表由启动时的 generate_schemas 创建；已有的图片消息保持原来的URL，不参与去重和回收
+-- 执行方式: psql "$DATABASE_URL" -f migrations/20261018_image_blobs.sql
+
+ALTER TABLE messages ADD COLUMN IF NOT EXISTS image_hash VARCHAR(64);
+
+-- 与 Tortoise 生成的索引同名，启动时 generate_schemas 不会重复创建
+CREATE INDEX IF NOT EXISTS idx_messages_image_h_a7999b ON messages (image_hash);
@@ -0,0 +1,7 @@
+-- 消息历史改为按 (created_at, id) 键集分页，增加对应的复合索引
+-- 需在 20261018_message_partitions.sql 之前执行（分区迁移会在新表上重建该索引）
+-- CONCURRENTLY 不阻塞写入，不能在事务中执行:
+-- psql "$DATABASE_URL" -f migrations/20261018_message_keyset_index.sql
+
+-- 与 Tortoise 生成的索引同名，启动时 generate_schemas 不会重复创建
+CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_messages_room_id_c3176d ON messages (room_id, created_at, id);
@@ -0,0 +1,50 @@
+-- 消息表改为按 created_at 的月分区表
+-- 分区键必须包含在主键中，主键改为 (id, created_at)；id 仍由原来的序列生成，按 id 的查询和更新不受影响
+-- 之后的分区由应用的归档任务提前创建（MESSAGE_PARTITION_PREMAKE），
+-- 早于 MESSAGE_ARCHIVE_AFTER_MONTHS 的分区导出到归档目录后从数据库分离
+-- 执行期间消息表被锁定，请在维护窗口执行: psql "$DATABASE_URL" -f migrations/20261018_message_partitions.sql
+
+BEGIN;
+
+-- 分区边界按UTC的自然月计算
+SET LOCAL TIME ZONE 'UTC';
+
+LOCK TABLE messages IN ACCESS EXCLUSIVE MODE;
+
+ALTER TABLE messages RENAME TO messages_unpartitioned;
+
+CREATE TABLE messages (
+    LIKE messages_unpartitioned INCLUDING DEFAULTS INCLUDING CONSTRAINTS
+) PARTITION BY RANGE (created_at);
+
+ALTER TABLE messages ADD PRIMARY KEY (id, created_at);
+ALTER TABLE messages ADD FOREIGN KEY (room_id) REFERENCES chat_rooms (id) ON DELETE CASCADE;
+ALTER TABLE messages ADD FOREIGN KEY (sender_id) REFERENCES users (id) ON DELETE CASCADE;
+ALTER SEQUENCE messages_id_seq OWNED BY messages.id;
+
+-- 覆盖已有消息到未来3个月的分区，命名为 messages_pYYYY_MM
+DO $$
+DECLARE
+    month timestamptz := date_trunc('month', COALESCE((SELECT MIN(created_at) FROM messages_unpartitioned), now()));
+BEGIN
+    WHILE month < date_trunc('month', now()) + interval '4 months' LOOP
+        EXECUTE format(
+            'CREATE TABLE %I PARTITION OF messages FOR VALUES FROM (%L) TO (%L)',
+            'messages_p' || to_char(month, 'YYYY_MM'), month, month + interval '1 month'
+        );
+        month := month + interval '1 month';
+    END LOOP;
+END $$;
+
+INSERT INTO messages SELECT * FROM messages_unpartitioned;
+
+-- 与 Tortoise 生成的索引同名，启动时 generate_schemas 不会重复创建
+CREATE INDEX idx_messages_room_id_c3176d ON messages (room_id, created_at, id);
+CREATE INDEX idx_messages_room_id_8df77b ON messages (room_id, seq);
+CREATE INDEX idx_messages_room_id_2170a6 ON messages (room_id, id);
+
+DROP TABLE messages_unpartitioned;
+
+COMMIT;
+
+-- 全文索引（SEARCH_BACKEND=postgres）由应用启动时在分区表上重新创建
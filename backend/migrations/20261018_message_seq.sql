@@ -0,0 +1,26 @@
+-- 消息增加聊天室内的事件序号 seq，断线重连时按序号补发
+-- 已有消息按 (created_at, id) 顺序在各自的聊天室内从1开始编号，应用启动后从最大序号继续分配
+-- 需在 20261018_message_partitions.sql 之前、新版本应用启动之前执行:
+-- psql "$DATABASE_URL" -f migrations/20261018_message_seq.sql
+
+BEGIN;
+
+ALTER TABLE messages ADD COLUMN IF NOT EXISTS seq BIGINT;
+
+-- 重复执行时只为尚未编号的消息接着已有的最大序号编号
+UPDATE messages
+SET seq = numbered.seq
+FROM (
+    SELECT id,
+           COALESCE(MAX(seq) OVER (PARTITION BY room_id), 0)
+               + ROW_NUMBER() OVER (PARTITION BY room_id, seq IS NULL ORDER BY created_at, id) AS seq,
+           seq IS NULL AS missing
+    FROM messages
+) AS numbered
+WHERE messages.id = numbered.id
+  AND numbered.missing;
+
+-- 与 Tortoise 生成的索引同名，启动时 generate_schemas 不会重复创建
+CREATE INDEX IF NOT EXISTS idx_messages_room_id_8df77b ON messages (room_id, seq);
+
+COMMIT;
@@ -0,0 +1,36 @@
+-- 已读状态由每条消息一行（message_reads）改为每个成员一条水位线
+-- 每个成员的水位线取其在该聊天室中已读的最大消息ID，之前的消息都视为已读；没有已读记录的成员视为已读到最新
+-- 执行方式: psql "$DATABASE_URL" -f migrations/20261018_read_watermarks.sql
+
+BEGIN;
+
+ALTER TABLE chat_room_members ADD COLUMN IF NOT EXISTS last_read_message_id INT;
+
+UPDATE chat_room_members AS member
+SET last_read_message_id = reads.last_read_message_id,
+    last_read_at = GREATEST(member.last_read_at, reads.last_read_at)
+FROM (
+    SELECT message_reads.user_id,
+           messages.room_id,
+           MAX(message_reads.message_id) AS last_read_message_id,
+           MAX(message_reads.read_at) AS last_read_at
+    FROM message_reads
+    JOIN messages ON messages.id = message_reads.message_id
+    GROUP BY message_reads.user_id, messages.room_id
+) AS reads
+WHERE member.user_id = reads.user_id
+  AND member.room_id = reads.room_id
+  AND (member.last_read_message_id IS NULL OR member.last_read_message_id < reads.last_read_message_id);
+
+-- 没有已读记录的成员从聊天室当前最新的消息开始计算未读，不会把全部历史消息算作未读
+UPDATE chat_room_members
+SET last_read_message_id = COALESCE((SELECT MAX(id) FROM messages WHERE room_id = chat_room_members.room_id), 0)
+WHERE last_read_message_id IS NULL;
+
+-- 与 Tortoise 生成的索引同名，启动时 generate_schemas 不会重复创建
+CREATE INDEX IF NOT EXISTS idx_chat_room_m_room_id_e737fd
+    ON chat_room_members (room_id, last_read_message_id);
+
+DROP TABLE message_reads;
+
+COMMIT;
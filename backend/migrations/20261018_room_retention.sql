@@ -0,0 +1,7 @@
+-- 聊天室的消息保留策略和删除标记
+-- 删除聊天室时先设置 deleted_at，由后台任务分批清理消息等数据后再删除聊天室本身
+-- 执行方式: psql "$DATABASE_URL" -f migrations/20261018_room_retention.sql
+
+ALTER TABLE chat_rooms ADD COLUMN IF NOT EXISTS retention_days INT;
+ALTER TABLE chat_rooms ADD COLUMN IF NOT EXISTS retention_max_messages INT;
+ALTER TABLE chat_rooms ADD COLUMN IF NOT EXISTS deleted_at TIMESTAMPTZ;
@@ -1,9 +1,11 @@
 import uvicorn
+from app.core.config import settings
 
 if __name__ == "__main__":
     uvicorn.run(
         "app.main:app",
         host="0.0.0.0",
         port=8000,
-        reload=True  # 开发模式下启用热重载
+        reload=True,  # 开发模式下启用热重载
+        ws_per_message_deflate=settings.WS_PER_MESSAGE_DEFLATE  # 客户端可协商 permessage-deflate 压缩
     ) 
\ No newline at end of file
@@ -0,0 +1,69 @@
+"""
+从 NDJSON 文件批量导入聊天室的历史消息（从其它聊天系统迁移）
+
+每行一条消息，格式见 app.services.ingest.MessageIngest；以 .gz 结尾的文件按gzip读取，- 表示标准输入。
+直接连接数据库（settings.DATABASE_URL）写入，不经过HTTP接口，也不推送给在线成员。
+
+运行方式（在 backend 目录下）:
+    python -m scripts.ingest_messages --room 42 export.ndjson.gz
+    zcat export.ndjson.gz | python -m scripts.ingest_messages --room 42 -
+"""
+import argparse
+import asyncio
+import gzip
+import sys
+from typing import AsyncIterator, BinaryIO
+
+import orjson
+from tortoise import Tortoise
+
+from app.core.config import settings
+from app.models import TORTOISE_ORM, ChatRoom
+from app.services.ingest import ingest_messages
+
+READ_SIZE = 1024 * 1024
+
+
+def open_input(path: str) -> BinaryIO:
+    if path == "-":
+        return sys.stdin.buffer
+    if path.endswith(".gz"):
+        return gzip.open(path, "rb")
+    return open(path, "rb")
+
+
+async def read_chunks(file: BinaryIO) -> AsyncIterator[bytes]:
+    while True:
+        chunk = await asyncio.to_thread(file.read, READ_SIZE)
+        if not chunk:
+            return
+        yield chunk
+
+
+async def run(room_id: int, path: str):
+    config = {**TORTOISE_ORM, "connections": {"default": settings.DATABASE_URL}}
+    await Tortoise.init(config=config)
+    try:
+        if not await ChatRoom.exists(id=room_id, deleted_at__isnull=True):
+            sys.exit(f"聊天室不存在: {room_id}")
+        with open_input(path) as file:
+            result = await ingest_messages(room_id, read_chunks(file))
+    finally:
+        await Tortoise.close_connections()
+
+    print(f"导入 {result['accepted']} 条，拒绝 {result['rejected']} 条，"
+          f"耗时 {result['seconds']} 秒，{result['rows_per_second']} 条/秒")
+    for error in result["errors"]:
+        print(orjson.dumps(error).decode(), file=sys.stderr)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="批量导入聊天室的历史消息")
+    parser.add_argument("--room", type=int, required=True, help="聊天室ID")
+    parser.add_argument("path", help="NDJSON 文件路径（.gz 为gzip压缩），- 表示标准输入")
+    args = parser.parse_args()
+    asyncio.run(run(args.room, args.path))
+
+
+if __name__ == "__main__":
+    main()